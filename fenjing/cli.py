@@ -22,11 +22,13 @@ from .const import (
     PythonVersion,
     ReplacedKeywordStrategy,
     DetectWafKeywords,
+    BannedSubstringLearning,
     FindFlag,
     DEFAULT_USER_AGENT,
 )
 from .form import Form, get_form
 from .full_payload_gen import FullPayloadGen
+from .keyword_matcher import keyword_waf_func
 from .requester import (
     HTTPRequester,
     TCPRequester,
@@ -41,6 +43,10 @@ from .submitter import (
 )
 from .webui import main as webui_main
 from .options import Options
+from .generation_stats import GenerationStats
+from .rule_ordering import RuleOrdering
+from .waf_profile import WafProfileStore
+from .verdict_store import SqliteVerdictStore
 from .pbar import console
 from .job import (
     Job,
@@ -166,6 +172,84 @@ def parse_headers_cookies(headers_list: List[str], cookies: str) -> Dict[str, st
     return headers
 
 
+def save_generation_stats(
+    generation_stats: Union[GenerationStats, None], stats_output: str
+):
+    """按照--stats-output输出生成规则的统计数据
+
+    Args:
+        generation_stats (Union[GenerationStats, None]): 统计数据
+        stats_output (str): 输出的文件，为-时直接打印
+    """
+    if generation_stats is None or not stats_output:
+        return
+    if stats_output == "-":
+        console.print(rich_escape(generation_stats.format_table()))
+        return
+    output_path = Path(stats_output)
+    if output_path.suffix == ".json":
+        output_path.write_text(generation_stats.to_json())
+    else:
+        output_path.write_text(generation_stats.format_table())
+    logger.info(
+        "Generation stats are written into [blue]%s[/]",
+        rich_escape(output_path.as_posix()),
+        extra={"markup": True, "highlighter": None},
+    )
+
+
+def load_rule_ordering(rule_stats_file: str) -> Union[RuleOrdering, None]:
+    """按照--rule-stats-file读取学习到的规则排序
+
+    Args:
+        rule_stats_file (str): 保存规则成功率的文件，为空时不使用规则排序
+
+    Returns:
+        Union[RuleOrdering, None]: 规则排序
+    """
+    if not rule_stats_file:
+        return None
+    return RuleOrdering.load(rule_stats_file)
+
+
+def save_rule_ordering(rule_ordering: Union[RuleOrdering, None]):
+    """将学习到的规则排序保存回读取时的文件"""
+    if rule_ordering is None:
+        return
+    rule_ordering.save()
+    logger.info(
+        "Rule stats are written into [blue]%s[/]",
+        rich_escape(str(rule_ordering.path)),
+        extra={"markup": True, "highlighter": None},
+    )
+
+
+def load_waf_profiles(waf_profile_file: str) -> Union[WafProfileStore, None]:
+    """按照--waf-profile-file读取保存的WAF检测结果
+
+    Args:
+        waf_profile_file (str): 保存WAF检测结果的文件，为空时不保存
+
+    Returns:
+        Union[WafProfileStore, None]: 保存的WAF检测结果
+    """
+    if not waf_profile_file:
+        return None
+    return WafProfileStore.load(waf_profile_file)
+
+
+def save_waf_profiles(waf_profiles: Union[WafProfileStore, None]):
+    """将WAF检测结果保存回读取时的文件"""
+    if waf_profiles is None:
+        return
+    waf_profiles.save()
+    logger.info(
+        "WAF profiles are written into [blue]%s[/]",
+        rich_escape(str(waf_profiles.path)),
+        extra={"markup": True, "highlighter": None},
+    )
+
+
 def is_form_has_response(
     url: str,
     form: Form,
@@ -254,6 +338,49 @@ common_options_cli = [
         default=DetectWafKeywords.NONE,
         help="是否枚举被waf的关键字，需要额外时间，默认为none, 可选full/fast",
     ),
+    click.option(
+        "--learn-banned-substrings",
+        type=BannedSubstringLearning,
+        cls=EnumOption,
+        default=BannedSubstringLearning.DISABLED,
+        help="是否学习被waf的子串并在本地拒绝包含它们的payload，默认为disabled，"
+        + "可选enabled/verify，verify会抽样确认本地拒绝的结果",
+    ),
+    click.option(
+        "--seed",
+        type=int,
+        default=None,
+        help="随机数种子，设置之后对相同的WAF会生成相同的payload，默认不设置",
+    ),
+    click.option(
+        "--probe-workers",
+        type=int,
+        default=1,
+        help="检测WAF时同时发送的请求数，默认为1，即逐个发送",
+    ),
+    click.option(
+        "--probe-host-limit",
+        type=int,
+        default=0,
+        help="同一个主机上同时进行的探测请求数，所有WAF检测共享这个限制，默认为0，即不限制",
+    ),
+    click.option(
+        "--packed-probe-length",
+        type=int,
+        default=0,
+        help="目标会回显时在一个请求中合并检测多个payload，指定请求的最大长度，"
+        + "默认为0，即不合并",
+    ),
+    click.option(
+        "--waf-profile-file",
+        default="",
+        help="保存WAF检测结果的文件，一天内对同一个目标重新运行时会跳过WAF检测",
+    ),
+    click.option(
+        "--verdict-store",
+        default="",
+        help="保存WAF判断的SQLite文件，可以在多个进程之间共享",
+    ),
     click.option(
         "--find-flag",
         type=FindFlag,
@@ -273,6 +400,17 @@ common_options_cli = [
         help="在发送payload之前进行编码的命令，默认不进行额外操作",
     ),
     click.option("--interval", default=0.0, help="每次请求的间隔"),
+    click.option(
+        "--stats-output",
+        default="",
+        help="结束时输出每个生成规则的统计数据，.json后缀的文件保存为JSON，"
+        + "其他文件保存为表格，填-则直接打印表格",
+    ),
+    click.option(
+        "--rule-stats-file",
+        default="",
+        help="保存规则成功率的文件，会在启动时读取并按照其中的数据排列规则，结束时更新",
+    ),
 ]
 
 common_options_http = [
@@ -362,6 +500,15 @@ def crack(
     proxy: str,
     no_verify_ssl: bool,
     tamper_cmd: str,
+    stats_output: str,
+    rule_stats_file: str,
+    learn_banned_substrings: BannedSubstringLearning,
+    seed: Union[int, None],
+    probe_workers: int,
+    probe_host_limit: int,
+    packed_probe_length: int,
+    waf_profile_file: str,
+    verdict_store: str,
 ):
     """
     攻击指定的表单
@@ -389,6 +536,15 @@ def crack(
         environment=environment,
         detect_waf_keywords=detect_waf_keywords,
         waf_keywords=waf_keyword,
+        generation_stats=GenerationStats() if stats_output else None,
+        rule_ordering=load_rule_ordering(rule_stats_file),
+        banned_substring_learning=learn_banned_substrings,
+        seed=seed,
+        probe_workers=probe_workers,
+        probe_host_limit=probe_host_limit or None,
+        packed_probe_length=packed_probe_length or None,
+        waf_profiles=load_waf_profiles(waf_profile_file),
+        verdict_store=SqliteVerdictStore(verdict_store) if verdict_store else None,
     )
 
     if not eval_args_payload:
@@ -409,10 +565,15 @@ def crack(
         )
 
     job = Job(context)
-    if not job.do_crack_pre():
-        logger.warning("Test form failed...", extra={"highlighter": None})
-        raise RunFailed()
-    job.do_crack(exec_cmd, find_flag)
+    try:
+        if not job.do_crack_pre():
+            logger.warning("Test form failed...", extra={"highlighter": None})
+            raise RunFailed()
+        job.do_crack(exec_cmd, find_flag)
+    finally:
+        save_generation_stats(options.generation_stats, stats_output)
+        save_rule_ordering(options.rule_ordering)
+        save_waf_profiles(options.waf_profiles)
 
 
 @main.command()
@@ -436,6 +597,15 @@ def crack_path(
     proxy: str,
     no_verify_ssl: bool,
     tamper_cmd: str,
+    stats_output: str,
+    rule_stats_file: str,
+    learn_banned_substrings: BannedSubstringLearning,
+    seed: Union[int, None],
+    probe_workers: int,
+    probe_host_limit: int,
+    packed_probe_length: int,
+    waf_profile_file: str,
+    verdict_store: str,
 ):
     """
     攻击指定的路径
@@ -457,6 +627,15 @@ def crack_path(
         environment=environment,
         detect_waf_keywords=detect_waf_keywords,
         waf_keywords=waf_keyword,
+        generation_stats=GenerationStats() if stats_output else None,
+        rule_ordering=load_rule_ordering(rule_stats_file),
+        banned_substring_learning=learn_banned_substrings,
+        seed=seed,
+        probe_workers=probe_workers,
+        probe_host_limit=probe_host_limit or None,
+        packed_probe_length=packed_probe_length or None,
+        waf_profiles=load_waf_profiles(waf_profile_file),
+        verdict_store=SqliteVerdictStore(verdict_store) if verdict_store else None,
     )
     context = PathCrackContext(
         url=url,
@@ -465,10 +644,15 @@ def crack_path(
         tamper_cmd=tamper_cmd,
     )
     job = Job(context)
-    if not job.do_crack_pre():
-        logger.warning("Test form failed...", extra={"highlighter": None})
-        raise RunFailed()
-    job.do_crack(exec_cmd, find_flag)
+    try:
+        if not job.do_crack_pre():
+            logger.warning("Test form failed...", extra={"highlighter": None})
+            raise RunFailed()
+        job.do_crack(exec_cmd, find_flag)
+    finally:
+        save_generation_stats(options.generation_stats, stats_output)
+        save_rule_ordering(options.rule_ordering)
+        save_waf_profiles(options.waf_profiles)
 
 
 @main.command()
@@ -498,6 +682,15 @@ def crack_json(
     proxy: str,
     no_verify_ssl: bool,
     tamper_cmd: str,
+    stats_output: str,
+    rule_stats_file: str,
+    learn_banned_substrings: BannedSubstringLearning,
+    seed: Union[int, None],
+    probe_workers: int,
+    probe_host_limit: int,
+    packed_probe_length: int,
+    waf_profile_file: str,
+    verdict_store: str,
 ):
     """
     攻击指定的JSON API
@@ -519,6 +712,15 @@ def crack_json(
         environment=environment,
         detect_waf_keywords=detect_waf_keywords,
         waf_keywords=waf_keyword,
+        generation_stats=GenerationStats() if stats_output else None,
+        rule_ordering=load_rule_ordering(rule_stats_file),
+        banned_substring_learning=learn_banned_substrings,
+        seed=seed,
+        probe_workers=probe_workers,
+        probe_host_limit=probe_host_limit or None,
+        packed_probe_length=packed_probe_length or None,
+        waf_profiles=load_waf_profiles(waf_profile_file),
+        verdict_store=SqliteVerdictStore(verdict_store) if verdict_store else None,
     )
     context = JsonCrackContext(
         url=url,
@@ -530,10 +732,15 @@ def crack_json(
         tamper_cmd=tamper_cmd,
     )
     job = Job(context)
-    if not job.do_crack_pre():
-        logger.warning("Test form failed...", extra={"highlighter": None})
-        raise RunFailed()
-    job.do_crack(exec_cmd, find_flag)
+    try:
+        if not job.do_crack_pre():
+            logger.warning("Test form failed...", extra={"highlighter": None})
+            raise RunFailed()
+        job.do_crack(exec_cmd, find_flag)
+    finally:
+        save_generation_stats(options.generation_stats, stats_output)
+        save_rule_ordering(options.rule_ordering)
+        save_waf_profiles(options.waf_profiles)
 
 
 @main.command()
@@ -557,6 +764,15 @@ def scan(
     proxy: str,
     no_verify_ssl: bool,
     tamper_cmd: str,
+    stats_output: str,
+    rule_stats_file: str,
+    learn_banned_substrings: BannedSubstringLearning,
+    seed: Union[int, None],
+    probe_workers: int,
+    probe_host_limit: int,
+    packed_probe_length: int,
+    waf_profile_file: str,
+    verdict_store: str,
 ):
     """
     扫描指定的网站
@@ -577,6 +793,15 @@ def scan(
         environment=environment,
         detect_waf_keywords=detect_waf_keywords,
         waf_keywords=waf_keyword,
+        generation_stats=GenerationStats() if stats_output else None,
+        rule_ordering=load_rule_ordering(rule_stats_file),
+        banned_substring_learning=learn_banned_substrings,
+        seed=seed,
+        probe_workers=probe_workers,
+        probe_host_limit=probe_host_limit or None,
+        packed_probe_length=packed_probe_length or None,
+        waf_profiles=load_waf_profiles(waf_profile_file),
+        verdict_store=SqliteVerdictStore(verdict_store) if verdict_store else None,
     )
     context = ScanContext(
         url=url,
@@ -585,16 +810,21 @@ def scan(
         tamper_cmd=tamper_cmd,
     )
     job = Job(context)
-    if not job.do_crack_pre():
-        logger.warning("Scan failed...", extra={"highlighter": None})
-        logger.warning(
-            "Try to pass params manualy: "
-            + "python -m fenjing crack %s --inputs aaa,bbb --method GET",
-            url,
-            extra={"highlighter": None},
-        )
-        raise RunFailed()
-    job.do_crack(exec_cmd, find_flag)
+    try:
+        if not job.do_crack_pre():
+            logger.warning("Scan failed...", extra={"highlighter": None})
+            logger.warning(
+                "Try to pass params manualy: "
+                + "python -m fenjing crack %s --inputs aaa,bbb --method GET",
+                url,
+                extra={"highlighter": None},
+            )
+            raise RunFailed()
+        job.do_crack(exec_cmd, find_flag)
+    finally:
+        save_generation_stats(options.generation_stats, stats_output)
+        save_rule_ordering(options.rule_ordering)
+        save_waf_profiles(options.waf_profiles)
 
 
 @main.command()
@@ -634,6 +864,15 @@ def crack_request(
     interval: float,
     tamper_cmd: str,
     update_content_length: bool,
+    stats_output: str,
+    rule_stats_file: str,
+    learn_banned_substrings: BannedSubstringLearning,
+    seed: Union[int, None],
+    probe_workers: int,
+    probe_host_limit: int,
+    packed_probe_length: int,
+    waf_profile_file: str,
+    verdict_store: str,
 ):
     """
     从文本文件中读取请求并攻击目标，文本文件中用`PAYLOAD`标记payload插入位置
@@ -672,6 +911,15 @@ def crack_request(
         environment=environment,
         detect_waf_keywords=detect_waf_keywords,
         waf_keywords=waf_keyword,
+        generation_stats=GenerationStats() if stats_output else None,
+        rule_ordering=load_rule_ordering(rule_stats_file),
+        banned_substring_learning=learn_banned_substrings,
+        seed=seed,
+        probe_workers=probe_workers,
+        probe_host_limit=probe_host_limit or None,
+        packed_probe_length=packed_probe_length or None,
+        waf_profiles=load_waf_profiles(waf_profile_file),
+        verdict_store=SqliteVerdictStore(verdict_store) if verdict_store else None,
     )
     context = RequestCrackContext(
         host=host,
@@ -688,10 +936,15 @@ def crack_request(
         update_content_length=update_content_length,
     )
     job = Job(context)
-    if not job.do_crack_pre():
-        logger.warning("Crack request failed...", extra={"highlighter": None})
-        raise RunFailed()
-    job.do_crack(exec_cmd, find_flag)
+    try:
+        if not job.do_crack_pre():
+            logger.warning("Crack request failed...", extra={"highlighter": None})
+            raise RunFailed()
+        job.do_crack(exec_cmd, find_flag)
+    finally:
+        save_generation_stats(options.generation_stats, stats_output)
+        save_rule_ordering(options.rule_ordering)
+        save_waf_profiles(options.waf_profiles)
 
 
 @main.command()
@@ -718,6 +971,23 @@ def crack_request(
     default="",
     help="手动指定关键字文件的后缀，默认按照文件原本的后缀名读取",
 )
+@click.option(
+    "--keyword-regex",
+    multiple=True,
+    help="被禁止的正则表达式，可以指定多次",
+)
+@click.option(
+    "--ignore-case",
+    default=False,
+    is_flag=True,
+    help="匹配关键字和正则表达式时忽略大小写",
+)
+@click.option(
+    "--length-limit",
+    default=0,
+    type=int,
+    help="payload的最大长度，默认为0即不限制",
+)
 @click.option(
     "--detect-mode",
     type=DetectMode,
@@ -752,16 +1022,32 @@ def crack_request(
     type=int,
     help="目标的python小版本，默认为6(python3.6)",
 )
+@click.option(
+    "--stats-output",
+    default="",
+    help="结束时输出每个生成规则的统计数据，.json后缀的文件保存为JSON，"
+    + "其他文件保存为表格，填-则直接打印表格",
+)
+@click.option(
+    "--rule-stats-file",
+    default="",
+    help="保存规则成功率的文件，会在启动时读取并按照其中的数据排列规则，结束时更新",
+)
 def crack_keywords(
     keywords_file: str,
     output_file: str,
     command: str,
     suffix: str,
+    keyword_regex: Tuple[str, ...],
+    ignore_case: bool,
+    length_limit: int,
     detect_mode: DetectMode,
     replaced_keyword_strategy: ReplacedKeywordStrategy,
     environment: TemplateEnvironment,
     python_version: PythonVersion,
     python_subversion: int,
+    stats_output: str,
+    rule_stats_file: str,
 ):
     """根据关键字生成对应的payload"""
     keywords_path = Path(keywords_file)
@@ -803,13 +1089,22 @@ def crack_keywords(
         python_version=python_version,
         python_subversion=python_subversion,
         waf_keywords=waf_keywords,
+        generation_stats=GenerationStats() if stats_output else None,
+        rule_ordering=load_rule_ordering(rule_stats_file),
     )
     full_payload_gen = FullPayloadGen(
-        waf_func=lambda x: all(keyword not in x for keyword in waf_keywords),
+        waf_func=keyword_waf_func(
+            waf_keywords,
+            regexes=keyword_regex or (),
+            ignore_case=ignore_case,
+            max_length=length_limit if length_limit > 0 else None,
+        ),
         callback=None,
         options=options,
     )
     payload, will_print = full_payload_gen.generate("os_popen_read", command)
+    save_generation_stats(options.generation_stats, stats_output)
+    save_rule_ordering(options.rule_ordering)
     if payload is None or will_print is None:
         logger.error(
             "Generate [yellow]%s[/] failed...",
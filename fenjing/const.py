@@ -135,6 +135,30 @@ class DetectWafKeywords(Enum):
     NONE = "none"
 
 
+class SearchStrategy(Enum):
+    """生成表达式时选择规则的策略：使用第一个通过WAF的规则，或者按照估计的代价
+    优先尝试更短的规则"""
+
+    FIRST = "first"
+    BEST_FIRST = "best_first"
+
+
+class GenerationEngine(Enum):
+    """PayloadGenerator使用的生成引擎：递归调用python函数，或者在显式的栈上迭代运行"""
+
+    RECURSIVE = "recursive"
+    ITERATIVE = "iterative"
+
+
+class BannedSubstringLearning(Enum):
+    """是否从WAF的检测结果中学习被禁止的子串，并在本地拒绝包含这些子串的payload
+    VERIFY模式会抽样使用WAF确认本地拒绝的结果，用于不是简单子串黑名单的WAF"""
+
+    DISABLED = "disabled"
+    ENABLED = "enabled"
+    VERIFY = "verify"
+
+
 class FindFlag(Enum):
     """自动获取flag"""
 
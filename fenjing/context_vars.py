@@ -244,8 +244,15 @@ class ContextVariableManager:
     这个类管理{%set xxx%}等payload以及其对应的变量名与值
     """
 
-    def __init__(self, waf: WafFunc, context_payloads: ContextPayloads):
+    def __init__(
+        self,
+        waf: WafFunc,
+        context_payloads: ContextPayloads,
+        random_generator: Union[random.Random, None] = None,
+    ):
         self.waf = waf
+        # 生成变量名使用的随机数生成器
+        self.random = random_generator if random_generator else random.Random()
         self.context_payloads = dict(context_payloads).copy()
         self.request_args_expressions: Dict[str, Tuple[str, int]] = {}
         self.payload_dependency = {}
@@ -305,7 +312,7 @@ class ContextVariableManager:
         for i in range(20):
             # 变量名的长度由尝试次数决定
             var_length = 2 if i < 10 else 3
-            name = "".join(random.choices(string.ascii_lowercase, k=var_length))
+            name = "".join(self.random.choices(string.ascii_lowercase, k=var_length))
             if self.is_expression_exists(name):
                 continue
             if name in BRAINROT_VARNAMES:
@@ -432,7 +439,9 @@ def prepare_context_vars(waf: WafFunc, options: Options) -> ContextVariableManag
     context_payloads = dict(context_payloads_stmts).copy()
     if options.python_version == PythonVersion.PYTHON3:
         context_payloads.update(context_payloads_stmts_py3)
-    manager = ContextVariableManager(waf, context_payloads)
+    manager = ContextVariableManager(
+        waf, context_payloads, random.Random(options.component_seed("context_vars"))
+    )
     manager.do_prepare()
 
     stmt = None  # sth like "{%set NAME=EXPR%}"
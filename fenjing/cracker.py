@@ -37,7 +37,8 @@ from .const import (
     FLASK_CONTEXT_VAR,
 )
 from .waf_func_gen import WafFuncGen, KeywordWafFuncGen, WafFunc
-from .full_payload_gen import FullPayloadGen
+from .full_payload_gen import FullPayloadGen, generate_or_fail
+from .payload_gen import GenerationBudgetExhausted, log_budget_exhausted
 from .context_vars import ContextVariableManager
 from .options import Options
 
@@ -172,6 +173,7 @@ class Cracker:
     ):
         self.options = options if options else Options()
         self.subm = submitter
+        self.random = random.Random(self.options.component_seed("cracker"))
 
         self._callback: Callable[[str, Dict], None] = (
             callback if callback else (lambda x, y: None)
@@ -248,7 +250,7 @@ class Cracker:
             bool: 是否产生回显
         """
         for _ in range(10):
-            content = random.choice(ascii_lowercase) * 6
+            content = self.random.choice(ascii_lowercase) * 6
             resp = self.subm.submit(content)
             assert resp is not None, "HTTP Failed"
             if content in resp.text:
@@ -272,15 +274,19 @@ class Cracker:
         ), "you need to run full_payload_gen.do_prepare()"
         with pbar_manager.pbar(values, "add_request_args") as values:
             for value in values:
-                name = "".join(random.choices(string.ascii_lowercase, k=2))
+                name = "".join(self.random.choices(string.ascii_lowercase, k=2))
                 while name in used_name and waf(name):
-                    name = "".join(random.choices(string.ascii_lowercase, k=2))
+                    name = "".join(self.random.choices(string.ascii_lowercase, k=2))
                 target = (
                     ITEM,
                     (ATTRIBUTE, (FLASK_CONTEXT_VAR, "request"), "args"),
                     name,
                 )
-                result = full_payload_gen.payload_gen.generate_detailed(*target)
+                try:
+                    result = full_payload_gen.payload_gen.generate_detailed(*target)
+                except GenerationBudgetExhausted as exhausted:
+                    log_budget_exhausted(exhausted, target)
+                    continue
                 if result is None:
                     logger.warning(
                         "Failed generating [yellow]request.args.%s[/], continue...",
@@ -300,7 +306,11 @@ class Cracker:
                     )
                     continue
 
-                value_payload = full_payload_gen.payload_gen.generate(STRING, value)
+                try:
+                    value_payload = full_payload_gen.payload_gen.generate(STRING, value)
+                except GenerationBudgetExhausted as exhausted:
+                    log_budget_exhausted(exhausted, (STRING, value))
+                    value_payload = None
                 if value_payload is not None and len(value_payload) < len(payload):
                     # We skip it if the payload of the value is shorter than
                     # the payload for request.args.xxx
@@ -342,8 +352,11 @@ class Cracker:
         full_payload_gen.do_prepare()
         assert full_payload_gen.payload_gen is not None
         self.add_request_args(full_payload_gen, waf=waf_func)
-        full_payload_gen.payload_gen.cache_by_repr.clear()
-        result = full_payload_gen.generate_with_tree(OS_POPEN_READ, self.test_cmd)
+        try:
+            result = full_payload_gen.generate_with_tree(OS_POPEN_READ, self.test_cmd)
+        except GenerationBudgetExhausted as exhausted:
+            log_budget_exhausted(exhausted, (OS_POPEN_READ, self.test_cmd))
+            return None
         if result is None:
             return None
         payload, will_print, tree = result
@@ -493,8 +506,8 @@ class Cracker:
                 "eval",
             ],
         )
-        full_payload_gen.payload_gen.cache_by_repr.clear()
-        payload, will_print = full_payload_gen.generate(
+        payload, will_print = generate_or_fail(
+            full_payload_gen,
             EVAL,
             (
                 CHAINED_ATTRIBUTE_ITEM,
@@ -3,7 +3,7 @@
 import logging
 import sys
 
-from typing import Mapping, Any
+from typing import Mapping, Any, Iterable, Iterator, NamedTuple
 
 from rich.markup import escape as rich_escape
 
@@ -38,6 +38,20 @@ else:
 logger = logging.getLogger("full_payload_gen")
 
 
+class FullPayloadResult(NamedTuple):
+    """批量生成中一个生成目标对应的完整payload"""
+
+    target: tuple
+    # payload，生成失败时为None
+    payload: Union[str, None]
+    # payload是否会有回显，生成失败时为None
+    will_print: Union[bool, None]
+    # 生成这个目标花费的秒数
+    elapsed: float
+    # 预算用完并且没有找到结果时的详细信息
+    exhausted: Union[payload_gen.GenerationBudgetExhausted, None] = None
+
+
 def get_outer_pattern(
     waf_func: Callable,
 ) -> Union[Tuple[str, bool], Tuple[None, None]]:
@@ -161,6 +175,10 @@ class FullPayloadGen:
         self.payload_gen = None
         self.options = options if options else Options()
         self.waf_expr_func = waf_expr_func
+        # 连接上下文payload和作用payload的空白字符，None表示还没有检测
+        self.separator: Union[str, None] = None
+        # 用到的上下文变量 -> 对应的上下文payload的长度
+        self.context_lengths: Dict[frozenset, int] = {}
 
     @property
     def callback(self):
@@ -216,6 +234,14 @@ class FullPayloadGen:
             options=self.options,
             waf_expr_func=self.waf_expr_func,
         )
+        if self.options.max_length is not None:
+            # max_length限制的是完整的payload，最外层的结构和用到的上下文payload也要计入
+            self.payload_gen.max_length = max(
+                0,
+                self.options.max_length
+                - len(self.outer_pattern.replace("PAYLOAD", "")),
+            )
+            self.payload_gen.context_length = self.context_payload_length
         if self.options.detect_mode == DetectMode.ACCURATE:
             self.prepare_exprs()
         self.prepared = True
@@ -229,6 +255,40 @@ class FullPayloadGen:
         )
         return True
 
+    def context_separator(self) -> Union[str, None]:
+        """找到可以连接上下文payload和作用payload的空白字符，防止waf ban掉 `}{` 等
+
+        Returns:
+            Union[str, None]: 空白字符，都不能通过WAF时返回None
+        """
+        if self.separator is None:
+            for whitespace in ["", " ", "\t", "\n"]:
+                if self.waf_func("}" + whitespace + "{"):
+                    self.separator = whitespace
+                    break
+        return self.separator
+
+    def context_payload_length(
+        self, used_context: Mapping[str, Tuple[Any, int]]
+    ) -> int:
+        """用到的上下文变量对应的上下文payload在完整payload中的长度
+
+        Args:
+            used_context (Mapping[str, Tuple[Any, int]]): 用到的上下文变量
+
+        Returns:
+            int: 长度
+        """
+        assert self.context_vars is not None
+        key = frozenset(used_context)
+        length = self.context_lengths.get(key)
+        if length is None:
+            context_payload = self.context_vars.get_payload(dict(used_context))
+            separator = self.context_separator() or ""
+            length = sum(len(payload) + len(separator) for payload in context_payload)
+            self.context_lengths[key] = length
+        return length
+
     def try_add_context_var(
         self, value: Union[str, int], clean_cache=True
     ) -> Literal["success", "failed", "skip"]:
@@ -236,7 +296,8 @@ class FullPayloadGen:
 
         Args:
             value (Union[str, int]): 表达式的值
-            clean_cache (bool, optional): 是否清除payload_gen的缓存. Defaults to True.
+            clean_cache (bool, optional): 保留以兼容旧代码，添加变量时payload_gen会自动删除
+                受影响的缓存. Defaults to True.
 
         Returns:
             Literal["success", "failed", "skip"]: 是否成功
@@ -258,7 +319,10 @@ class FullPayloadGen:
         if stmt_pattern is None or expr_pattern is None:
             return "failed"
         value_type = {str: STRING, int: INTEGER}[type(value)]
-        ret = self.payload_gen.generate_detailed(value_type, value)
+        try:
+            ret = self.payload_gen.generate_detailed(value_type, value)
+        except payload_gen.GenerationBudgetExhausted:
+            return "failed"
         if ret is None:
             return "failed"
         expression, used_context, tree = ret
@@ -290,11 +354,6 @@ class FullPayloadGen:
         )
         if not success:
             return "failed"
-        # 需要清除缓存，否则生成器只会使用缓存的表达式而不会使用加入的变量
-        if clean_cache:
-            self.payload_gen.cache_by_repr.clear()
-        else:
-            self.payload_gen.delete_from_cache(STRING, value)
         logger.debug(
             "Adding [blue]%s[/]=[yellow]%s[/]",
             rich_escape(payload),
@@ -440,6 +499,7 @@ class FullPayloadGen:
         )
         if not success:
             return False
+        self.context_lengths.clear()
         self.payload_gen.context = self.context_vars.get_context()
         return True
 
@@ -460,6 +520,7 @@ class FullPayloadGen:
         self.context_vars.add_request_args_expression(
             expression, value, precedence_index
         )
+        self.context_lengths.clear()
         self.payload_gen.context = self.context_vars.get_context()
 
     def prepare_exprs(self):
@@ -468,9 +529,11 @@ class FullPayloadGen:
 
         with pbar_manager.pbar(EXTRA_TARGETS, "prepare_exprs") as targets:
             for target in targets:
-                self.payload_gen.add_generated_expr(
-                    target, self.payload_gen.generate_detailed(*target)
-                )
+                try:
+                    result = self.payload_gen.generate_detailed(*target)
+                except payload_gen.GenerationBudgetExhausted:
+                    result = None
+                self.payload_gen.add_generated_expr(target, result)
 
     def generate_with_tree(
         self, gen_type, *args
@@ -480,6 +543,9 @@ class FullPayloadGen:
         Args:
             gen_type (str): 生成payload的类型，应传入如OS_POPEN_READ等在const.py中定义的类型
 
+        Raises:
+            GenerationBudgetExhausted: 选项中的时间或WAF检测次数预算用完时仍然没有找到结果
+
         Returns:
             Tuple[Union[str, None], Union[bool, None]]:
                 payload, 以及payload是否会有回显
@@ -490,21 +556,43 @@ class FullPayloadGen:
         assert self.payload_gen is not None and self.context_vars is not None
         assert isinstance(self.outer_pattern, str) and self.will_print is not None
 
-        # 在生成模式不是快速时生成一系列的字符串变量以减少嵌套括号
-        if self.options.detect_mode != DetectMode.FAST:
-            # 添加一系列值为字符串的变量，需要从生成目标中取出需要生成的字符串
-            extra_strings = []
-            if gen_type == OS_POPEN_READ:
-                extra_strings = [args[0]]
-            elif gen_type == EVAL and args[0][0] == STRING:
-                extra_strings = [args[0][1]]
-            self.prepare_extra_context_vars(extra_strings)
+        # 准备字符串变量和生成表达式共用选项中的时间和WAF检测次数预算
+        with self.payload_gen.budget_scope() as budget:
+            try:
+                # 在生成模式不是快速时生成一系列的字符串变量以减少嵌套括号
+                if self.options.detect_mode != DetectMode.FAST:
+                    self.prepare_extra_context_vars(
+                        extra_strings_of([(gen_type, *args)])
+                    )
 
-        logger.info("Start generating final expression...", extra={"highlighter": None})
+                logger.info(
+                    "Start generating final expression...", extra={"highlighter": None}
+                )
 
-        # 生成并检查
-        ret = self.payload_gen.generate_detailed(gen_type, *args)
+                # 生成并检查
+                ret = self.payload_gen.generate_detailed(gen_type, *args)
+            except payload_gen.BudgetExhausted:
+                ret = None
+        if ret is None and budget is not None and budget.exhausted is not None:
+            raise self.payload_gen.budget_exhausted_error(budget)
+        return self.assemble_payload(gen_type, args, ret)
+
+    def assemble_payload(
+        self, gen_type, args, ret: Union[payload_gen.PayloadGeneratorResult, None]
+    ) -> Union[Tuple[str, bool, payload_gen.TargetAndSubTargets], None]:
+        """将生成的表达式和用到的上下文变量组合成完整的payload
 
+        Args:
+            gen_type (str): 生成目标的类型
+            args (tuple): 生成目标的参数
+            ret (Union[PayloadGeneratorResult, None]): 表达式的生成结果
+
+        Returns:
+            Union[Tuple[str, bool, TargetAndSubTargets], None]:
+                payload, payload是否会有回显，以及生成树
+        """
+        assert self.context_vars is not None
+        assert isinstance(self.outer_pattern, str) and self.will_print is not None
         if ret is None:
             logger.info(
                 "Bypassing WAF Failed for [blue]%s[/]",
@@ -516,19 +604,27 @@ class FullPayloadGen:
         context_payload = self.context_vars.get_payload(used_context)
 
         # 产生最终的payload
-        # 防止waf ban掉 `}{` 等
-        payload = None
-        for whitespace in ["", " ", "\t", "\n"]:
-            if not context_payload or self.waf_func("}" + whitespace + "{"):
-                payload = whitespace.join(
-                    [
-                        *context_payload,
-                        self.outer_pattern.replace("PAYLOAD", inner_payload),
-                    ]
-                )
-                break
-        else:
+        separator = self.context_separator() if context_payload else ""
+        if separator is None:
             return None
+        payload = separator.join(
+            [
+                *context_payload,
+                self.outer_pattern.replace("PAYLOAD", inner_payload),
+            ]
+        )
+        if (
+            self.options.max_length is not None
+            and len(payload) > self.options.max_length
+        ):
+            logger.warning(
+                "Payload for [blue]%s[/] is [yellow]%d[/] characters long, "
+                + "longer than max_length %d",
+                rich_escape(repr((gen_type, *args))),
+                len(payload),
+                self.options.max_length,
+                extra={"markup": True, "highlighter": None},
+            )
         self.callback(
             CALLBACK_GENERATE_FULLPAYLOAD,
             {
@@ -560,3 +656,86 @@ class FullPayloadGen:
         if result:
             return result[:2]
         return None, None
+
+    def iter_generate_many(
+        self, targets: Iterable[tuple]
+    ) -> Iterator[FullPayloadResult]:
+        """批量生成多个payload，每个payload生成完成之后立即返回
+
+        所有目标需要的字符串变量会一次性准备好，多个目标共同需要的子目标
+        （比如os模块和__globals__）只会生成一次
+
+        Args:
+            targets (Iterable[tuple]): (gen_type, *args)形式的生成目标列表
+
+        Yields:
+            FullPayloadResult: 按照输入的顺序返回每个生成目标的结果
+        """
+        targets = list(targets)
+        if not self.prepared and not self.do_prepare():
+            for target in targets:
+                yield FullPayloadResult(target, None, None, 0.0)
+            return
+        assert self.payload_gen is not None
+        if self.options.detect_mode != DetectMode.FAST:
+            self.prepare_extra_context_vars(extra_strings_of(targets))
+        logger.info(
+            "Start generating %d final expressions...",
+            len(targets),
+            extra={"highlighter": None},
+        )
+        for item in self.payload_gen.iter_generate_many(targets):
+            gen_type, *args = item.target
+            result = self.assemble_payload(gen_type, args, item.result)
+            if result is None:
+                yield FullPayloadResult(
+                    item.target, None, None, item.elapsed, item.exhausted
+                )
+            else:
+                yield FullPayloadResult(item.target, result[0], result[1], item.elapsed)
+
+    def generate_many(self, targets: Iterable[tuple]) -> List[FullPayloadResult]:
+        """批量生成多个payload，参数见iter_generate_many
+
+        Returns:
+            List[FullPayloadResult]: 每个生成目标的结果
+        """
+        return list(self.iter_generate_many(targets))
+
+
+def generate_or_fail(
+    full_payload_gen: Any, gen_type, *args
+) -> Tuple[Union[str, None], Union[bool, None]]:
+    """调用full_payload_gen.generate，选项中的预算用完时记录原因并当作生成失败
+
+    Args:
+        full_payload_gen (Any): FullPayloadGen或者有相同generate接口的对象
+        gen_type (str): 生成目标的类型
+
+    Returns:
+        Tuple[Union[str, None], Union[bool, None]]:
+            payload, 以及payload是否会有回显
+    """
+    try:
+        return full_payload_gen.generate(gen_type, *args)
+    except payload_gen.GenerationBudgetExhausted as exhausted:
+        payload_gen.log_budget_exhausted(exhausted, (gen_type, *args))
+        return None, None
+
+
+def extra_strings_of(targets: Iterable[tuple]) -> List[str]:
+    """取出生成目标中值得事先生成为字符串变量的字符串
+
+    Args:
+        targets (Iterable[tuple]): (gen_type, *args)形式的生成目标列表
+
+    Returns:
+        List[str]: 字符串列表
+    """
+    extra_strings = []
+    for gen_type, *args in targets:
+        if gen_type == OS_POPEN_READ:
+            extra_strings.append(args[0])
+        elif gen_type == EVAL and args[0][0] == STRING:
+            extra_strings.append(args[0][1])
+    return list(dict.fromkeys(extra_strings))
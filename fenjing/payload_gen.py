@@ -16,14 +16,23 @@ PayloadGen：将用户提供的生成目标一层层展开，并使用WAF检测
 
 import re
 import logging
+import threading
+import time
 
-from collections import defaultdict
-from contextlib import contextmanager
+from collections import defaultdict, deque
+from collections.abc import Mapping as MappingABC
+from concurrent.futures import ThreadPoolExecutor, Future, wait as wait_futures
+from contextlib import contextmanager, nullcontext
 from typing import (
     Callable,
     DefaultDict,
+    Any,
     List,
     Dict,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Tuple,
     Union,
 )
 from pprint import pformat
@@ -33,12 +42,16 @@ from rich.markup import escape as rich_escape
 from .const import *
 from .options import Options
 from .rules_utils import (
+    RuleRandom,
+    default_rule_random,
     precedence,
     tree_precedence,
-    unwrap_whitespace,
+    WhitespaceUnwrapper,
 )
 from .rules_types import *
 from .pbar import pbar_manager, Pbar
+from .waf_oracle import BatchWafFunc, CombinedWafFunc, ensure_batch_waf
+from .generation_stats import GenerationStats, StatsRecord
 
 expression_gens: DefaultDict[str, List[ExpressionGenerator]] = defaultdict(list)
 logger = logging.getLogger("payload_gen")
@@ -57,6 +70,75 @@ gen_weight_default = {
 }
 
 
+# 生成目标类型 -> 对应的处理函数，处理函数接受PayloadGenerator和生成目标并返回生成结果
+# 没有处理函数的生成目标会先查找缓存，然后使用expression_gens中的规则生成
+target_handlers: Dict[str, Callable[[Any, Target], Any]] = {}
+
+
+def target_handler(kind: str):
+    """注册某种生成目标的处理函数，第三方规则可以用它添加新的生成目标类型
+
+    Args:
+        kind (str): 生成目标的类型，即生成目标的第一个元素
+    """
+
+    def _wraps(func):
+        target_handlers[kind] = func
+        return func
+
+    return _wraps
+
+
+# 生成目标类型 -> 对应的迭代式处理函数，处理函数返回一个python生成器，见GenerationTask
+iterative_target_handlers: Dict[str, Callable[[Any, Target], Any]] = {}
+
+
+def iterative_target_handler(kind: str):
+    """注册某种生成目标在迭代式生成引擎中的处理函数
+
+    Args:
+        kind (str): 生成目标的类型
+    """
+
+    def _wraps(func):
+        iterative_target_handlers[kind] = func
+        return func
+
+    return _wraps
+
+
+def literal_words(text: str) -> List[str]:
+    """literal中需要事先检测的片段
+
+    Args:
+        text (str): literal的内容
+
+    Returns:
+        List[str]: 片段列表
+    """
+    return list(dict.fromkeys(re.findall(r"[a-z]{3,}|[0-9]", text)))
+
+
+def merge_used_context(contexts: List[ContextExpressions]) -> ContextExpressions:
+    """合并子目标用到的上下文变量
+    只有一个子目标用到上下文时直接共享它的字典而不复制，所以生成结果中的字典是只读的
+
+    Args:
+        contexts (List[ContextExpressions]): 子目标用到的非空的上下文变量
+
+    Returns:
+        ContextExpressions: 合并后的上下文变量
+    """
+    if not contexts:
+        return {}
+    if len(contexts) == 1:
+        return contexts[0]
+    merged = dict(contexts[0])
+    for context in contexts[1:]:
+        merged.update(context)
+    return merged
+
+
 @contextmanager
 def optional_context(condition, data, mapper):
     """让一个contextmanager变为可选的"""
@@ -112,12 +194,332 @@ class CacheByRepr:
         self.cache = {}
 
 
+class TargetInterner:
+    """为结构相同的生成目标分配一个稳定的整数id（hash consing）
+    生成目标的结构键由其类型和子元素的id组成，所以每个子目标只会被遍历一次，
+    之后同一个对象会通过id(obj)直接找到对应的整数id
+
+    注意：生成目标在被intern之后不应该再被修改
+    """
+
+    def __init__(self, identity_cache_size: int = 100000):
+        self.ids: Dict[Any, int] = {}
+        self.targets: List[Any] = []
+        # id(obj) -> (obj, target_id)，保存obj的引用以防止id(obj)被复用
+        self.identity: Dict[int, Tuple[Any, int]] = {}
+        self.identity_cache_size = identity_cache_size
+        self.lock = threading.Lock()
+
+    def _remember(self, obj, target_id: int):
+        if len(self.identity) >= self.identity_cache_size:
+            self.identity.clear()
+        self.identity[id(obj)] = (obj, target_id)
+
+    def _structural_key(self, obj, insert: bool):
+        parts = ["l" if isinstance(obj, list) else "t"]
+        for element in obj:
+            if type(element) is str:  # pylint: disable=unidiomatic-typecheck
+                parts.append(element)
+            elif isinstance(element, (tuple, list)):
+                element_id = (
+                    self.intern(element) if insert else self.lookup(element)
+                )
+                if element_id is None:
+                    return None
+                parts.append(element_id)
+            else:
+                # 包含类型以区分1和True, 以及区分整数和子目标的id
+                try:
+                    hash(element)
+                    parts.append((type(element), element))
+                except TypeError:
+                    parts.append((type(element), repr(element)))
+        return tuple(parts)
+
+    def lookup(self, obj) -> Union[int, None]:
+        """查找生成目标对应的id，不存在时返回None且不会分配新的id
+
+        Args:
+            obj (Target): 生成目标
+
+        Returns:
+            Union[int, None]: 对应的id
+        """
+        entry = self.identity.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            return entry[1]
+        key = self._structural_key(obj, insert=False)
+        if key is None:
+            return None
+        target_id = self.ids.get(key)
+        if target_id is not None:
+            self._remember(obj, target_id)
+        return target_id
+
+    def intern(self, obj) -> int:
+        """获得生成目标对应的id，不存在时分配一个新的id
+
+        Args:
+            obj (Target): 生成目标
+
+        Returns:
+            int: 对应的id
+        """
+        entry = self.identity.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            return entry[1]
+        key = self._structural_key(obj, insert=True)
+        with self.lock:
+            target_id = self.ids.get(key)
+            if target_id is None:
+                target_id = len(self.targets)
+                self.ids[key] = target_id
+                self.targets.append(obj)
+        self._remember(obj, target_id)
+        return target_id
+
+
+class TargetCache:
+    """以生成目标的intern id为键的缓存，接口与CacheByRepr相同
+    清空缓存不会清空interner，所以生成目标的id在整个生成器的生命周期中保持不变
+    """
+
+    def __init__(self, interner: Union[TargetInterner, None] = None):
+        self.interner = interner if interner else TargetInterner()
+        self.cache: Dict[int, Any] = {}
+
+    def __setitem__(self, k, v):
+        self.cache[self.interner.intern(k)] = v
+
+    def __getitem__(self, k):
+        target_id = self.interner.lookup(k)
+        if target_id is None or target_id not in self.cache:
+            raise KeyError(f"Not found: {k!r}")
+        return self.cache[target_id]
+
+    def __delitem__(self, k):
+        target_id = self.interner.lookup(k)
+        if target_id is None:
+            raise KeyError(f"Not found: {k!r}")
+        del self.cache[target_id]
+
+    def __contains__(self, k):
+        target_id = self.interner.lookup(k)
+        return target_id is not None and target_id in self.cache
+
+    def __iter__(self):
+        return (self.interner.targets[target_id] for target_id in list(self.cache))
+
+    def __len__(self):
+        return len(self.cache)
+
+    def discard_id(self, target_id: int):
+        """根据intern id删除缓存，不存在时忽略"""
+        self.cache.pop(target_id, None)
+
+    def clear(self):
+        self.cache = {}
+
+
+# 读取了整个上下文的生成结果对应的依赖，任何变量的变化都会使其失效
+CONTEXT_ANY = ("any",)
+
+
+def context_value_dependency(value) -> Tuple:
+    """上下文中某个值对应的依赖"""
+    try:
+        hash(value)
+    except TypeError:
+        return CONTEXT_ANY
+    return ("value", value)
+
+
+class ContextView(MappingABC):
+    """传给规则的只读上下文，规则读取上下文时会记录对整个上下文的依赖
+    规则使用的随机数生成器也通过它传给规则，见rules_utils.context_random"""
+
+    def __init__(
+        self,
+        context: Mapping,
+        on_access: Callable[[], None],
+        random: Union[RuleRandom, None] = None,
+    ):
+        self.context = context
+        self.on_access = on_access
+        self.random = random
+
+    def __getitem__(self, key):
+        self.on_access()
+        return self.context[key]
+
+    def __iter__(self):
+        self.on_access()
+        return iter(self.context)
+
+    def __len__(self):
+        self.on_access()
+        return len(self.context)
+
+    def __contains__(self, key):
+        self.on_access()
+        return key in self.context
+
+
+class SpeculationAbandoned(Exception):
+    """并行尝试的规则已经不再被需要，用于中止其运行"""
+
+
+class BudgetExhausted(Exception):
+    """生成的时间或WAF检测次数预算已经用完，用于中止生成
+
+    best_first策略在已经找到结果时会捕获它并返回找到的最好结果
+    """
+
+
+class SpeculationToken:
+    """并行尝试的规则对应的标记，规则自身或者任何一个上层规则被放弃时即视为放弃
+
+    尝试写入的缓存和增加的规则使用次数会被记录在标记中，尝试被采纳时合并到上层，
+    被放弃时撤销，所以没有被采纳的尝试不会留下影响之后规则排序的结果
+    """
+
+    def __init__(self, parent: Union["SpeculationToken", None] = None):
+        self.parent = parent
+        self.abandoned = False
+        # 运行这次尝试的线程，以及开始运行或者已经结束时设置的事件
+        self.thread: Union[int, None] = None
+        self.started = threading.Event()
+        # 这次尝试写入的缓存的target id
+        self.cache_writes: List[int] = []
+        # 这次尝试增加的规则使用次数
+        self.used_count: DefaultDict[str, int] = defaultdict(int)
+
+    def is_abandoned(self) -> bool:
+        token = self
+        while token is not None:
+            if token.abandoned:
+                return True
+            token = token.parent
+        return False
+
+
+class GenerationBudget:
+    """一次生成的时间和WAF检测次数预算"""
+
+    def __init__(
+        self,
+        time_budget: Union[float, None],
+        waf_call_budget: Union[int, None],
+        waf_call_count: int,
+    ):
+        self.start = time.perf_counter()
+        self.deadline = None if time_budget is None else self.start + time_budget
+        self.start_waf_calls = waf_call_count
+        self.waf_call_limit = (
+            None if waf_call_budget is None else waf_call_count + waf_call_budget
+        )
+        # 用完的预算，"time"或者"waf_calls"，没有用完时为None
+        self.exhausted: Union[str, None] = None
+
+    def check(self, waf_call_count: int) -> bool:
+        """检查预算是否已经用完
+
+        Args:
+            waf_call_count (int): 当前的WAF检测次数
+
+        Returns:
+            bool: 是否已经用完
+        """
+        if self.exhausted is None:
+            if (
+                self.waf_call_limit is not None
+                and waf_call_count >= self.waf_call_limit
+            ):
+                self.exhausted = "waf_calls"
+            elif self.deadline is not None and time.perf_counter() >= self.deadline:
+                self.exhausted = "time"
+        return self.exhausted is not None
+
+
+class GenerationBudgetExhausted(Exception):
+    """预算用完时仍然没有找到任何结果"""
+
+    def __init__(
+        self,
+        reason: str,
+        elapsed: float,
+        waf_calls: int,
+        stats: Union[GenerationStats, None] = None,
+    ):
+        super().__init__(
+            f"Generation budget exhausted ({reason}) "
+            f"after {elapsed:.2f}s and {waf_calls} WAF calls"
+        )
+        # 用完的预算，"time"或者"waf_calls"
+        self.reason = reason
+        self.elapsed = elapsed
+        self.waf_calls = waf_calls
+        # Options.generation_stats中记录的统计数据
+        self.stats = stats
+
+
+def log_budget_exhausted(exhausted: GenerationBudgetExhausted, target: Any):
+    """记录预算用完导致的生成失败，调用方会把它当作一次失败的尝试
+
+    Args:
+        exhausted (GenerationBudgetExhausted): 生成时抛出的异常
+        target (Any): 生成目标
+    """
+    logger.warning(
+        "Generating [blue]%s[/] [red]failed[/]: %s",
+        rich_escape(repr(target)),
+        rich_escape(str(exhausted)),
+        extra={"markup": True, "highlighter": None},
+    )
+    if exhausted.stats is not None:
+        logger.info(
+            "Generation stats:\n%s",
+            exhausted.stats.format_table(limit=10),
+            extra={"highlighter": None},
+        )
+
+
+class BatchGenerationResult(NamedTuple):
+    """批量生成中一个生成目标的结果"""
+
+    target: Target
+    result: Union[PayloadGeneratorResult, None]
+    # 生成这个目标花费的秒数，不包括事先生成共享子目标的时间
+    elapsed: float
+    # 预算用完并且没有找到结果时的详细信息
+    exhausted: Union[GenerationBudgetExhausted, None] = None
+
+
 class PayloadGenerator:
     """生成一个表达式，如('a'+'b')
     其会遍历对应的expression_gen，依次“展开”生成目标为一个生成目标的列表，递归地
     将每一个元素转为payload，拼接在一起并使用WAF函数检测是否合法。
     """
 
+    # best_first策略中一次WAF检测相当于多少个字符的payload长度
+    waf_cost_weight = 8
+    # best_first策略最多嵌套的层数
+    best_first_max_depth = 24
+    # 最多保存的批量提前检测结果数量
+    prefetched_verdicts_size = 10000
+    # 不需要调用WAF函数就可以得到结果的生成目标类型
+    local_target_kinds = {
+        LITERAL,
+        WITH_CONTEXT_VAR,
+        JINJA_CONTEXT_VAR,
+        FLASK_CONTEXT_VAR,
+        REQUIRE_PYTHON3,
+        REQUIRE_PYTHON3_SUBVERSION,
+        REQUIRE_FLASK,
+        GENERATED_EXPR,
+        WHITESPACE,
+    }
+
     def __init__(
         self,
         waf_func: WafFunc,
@@ -127,38 +529,531 @@ class PayloadGenerator:
         waf_expr_func: Union[WafFunc, None] = None,
         generated_exprs: Union[Dict[Target, PayloadGeneratorResult], None] = None,
     ):
-        self.waf_func = (
-            waf_func
+        self.waf_func: BatchWafFunc = (
+            ensure_batch_waf(waf_func)
             if waf_expr_func is None
-            else (lambda x: waf_func(x) and waf_expr_func(x))
+            else CombinedWafFunc(waf_func, waf_expr_func)
+        )
+        # 批量提前检测的结果，在被使用时取出
+        self.prefetched_verdicts: Dict[str, bool] = {}
+        self.cache = TargetCache()
+        # 缓存的生成结果依赖的上下文，用于在上下文变化时只删除受影响的缓存
+        self.cache_deps: Dict[int, frozenset] = {}
+        self.dependents: DefaultDict[Tuple, set] = defaultdict(set)
+        self.dependency_state = threading.local()
+        self.options = options if options else Options()
+        # 规则使用的随机数生成器，设置了seed时生成的过程是确定的
+        # 没有设置时和之前一样使用全局共享的，让同一进程中的生成器作出相同的随机选择
+        self.rule_random = (
+            RuleRandom(self.options.component_seed("rules"))
+            if self.options.seed is not None
+            else default_rule_random
         )
+        # 将生成目标列表中的whitespace替换为备选项，同一个列表总是得到同一个结果
+        self.unwrap_whitespace = WhitespaceUnwrapper()
         self.context = context if context else {}
-        self.cache_by_repr = CacheByRepr()
         self.used_count = defaultdict(int)
-        self.options = options if options else Options()
+        # 并行尝试的线程会同时修改used_count以及waf_call_count等计数器，修改时需要持有这个锁
+        self.used_count_lock = threading.Lock()
         if self.options.detect_mode == DetectMode.FAST:
             for k, v in gen_weight_default.items():
                 self.used_count[k] += v
         self.callback = callback if callback else (lambda x, y: None)
         self.generated_exprs = generated_exprs if generated_exprs else {}
+        # best_first策略中正在生成的目标，用于检测规则之间的环
+        self.generating = set()
+        self.cycle_hits = 0
+        # speculative_workers大于1时用于并行尝试规则的线程池，在最外层的并行尝试
+        # 结束时关闭，executor_users是正在使用它的并行尝试的数量
+        self.executor: Union[ThreadPoolExecutor, None] = None
+        self.executor_users = 0
+        self.speculation_state = threading.local()
+        self.speculation_lock = threading.Lock()
+        # 正在被某个线程生成的目标：target id -> (线程, 生成完成的事件)
+        self.inflight: Dict[int, Tuple[int, threading.Event]] = {}
+        # 线程之间的等待关系，用于避免死锁
+        self.waits_for: Dict[int, int] = {}
+        # 每个规则和生成目标的统计数据，为None时不统计
+        self.stats = self.options.generation_stats
+        self.stats_state = threading.local()
+        # 跨运行学习到的规则排序，以及用于计算规则开销的WAF检测计数
+        self.rule_ordering = self.options.rule_ordering
+        self.waf_call_count = 0
+        # 生成的表达式的最大长度，以及当前线程中每一层生成目标列表剩下的长度预算
+        self.max_length = self.options.max_length
+        self.length_budget_state = threading.local()
+        self.pruned_hits = 0
+        # 生成结果用到的上下文变量需要的额外长度（比如{%set%}语句），由FullPayloadGen设置，
+        # 为None时不计入长度预算
+        self.context_length: Union[Callable[[ContextExpressions], int], None] = None
+        # target id -> 生成失败时的最大长度预算，预算不超过它时直接失败
+        self.length_failures: Dict[int, int] = {}
+        # 当前生成的时间和WAF检测次数预算，用完之后中止生成
+        self.generation_budget: Union[GenerationBudget, None] = None
+        # 有预算时记录通过了WAF的payload，预算用完之后仍然可以组合已经找到的结果
+        self.passed_payloads: Dict[str, None] = {}
+
+    @property
+    def context(self) -> Mapping[str, Tuple[Any, int]]:
+        """生成时可以使用的上下文变量：表达式 -> (值, 优先级)"""
+        return self._context
+
+    @context.setter
+    def context(self, context: Mapping[str, Tuple[Any, int]]):
+        old_context = getattr(self, "_context", None)
+        self._context = context
+        self.context_view = ContextView(
+            context,
+            lambda: self.record_context_dependency(CONTEXT_ANY),
+            self.rule_random,
+        )
+        if old_context is None:
+            return
+        # 值被添加、删除或者修改的变量都会影响对应的生成结果
+        changed_values = [
+            value
+            for expr, (value, _) in old_context.items()
+            if context.get(expr) != old_context[expr]
+        ] + [
+            value
+            for expr, (value, _) in context.items()
+            if old_context.get(expr) != context[expr]
+        ]
+        if changed_values:
+            self.invalidate_context_values(changed_values)
+
+    def record_context_dependency(self, dependency: Tuple):
+        """记录当前正在生成的目标依赖了上下文中的某些内容
+
+        Args:
+            dependency (Tuple): CONTEXT_ANY或者context_value_dependency的返回值
+        """
+        frames = getattr(self.dependency_state, "frames", None)
+        if frames:
+            frames[-1].add(dependency)
+
+    def push_dependency_frame(self):
+        """开始记录一个生成目标的依赖"""
+        if not hasattr(self.dependency_state, "frames"):
+            self.dependency_state.frames = []
+        self.dependency_state.frames.append(set())
+
+    def pop_dependency_frame(self) -> set:
+        """结束记录一个生成目标的依赖，依赖会被合并到上一层的生成目标中
+
+        Returns:
+            set: 这个生成目标的依赖
+        """
+        frames = self.dependency_state.frames
+        deps = frames.pop()
+        if frames:
+            frames[-1] |= deps
+        return deps
+
+    def merge_dependencies(self, deps: set):
+        """将其他线程记录的依赖合并到当前的生成目标中"""
+        frames = getattr(self.dependency_state, "frames", None)
+        if frames and deps:
+            frames[-1] |= deps
+
+    def stats_stack(self) -> list:
+        """当前线程的统计栈，见GenerationStats"""
+        if not hasattr(self.stats_state, "stack"):
+            self.stats_state.stack = []
+        return self.stats_state.stack
+
+    def measure_target(self, gen_type: str):
+        """统计一次生成目标的生成，没有开启统计时什么都不做
+
+        Args:
+            gen_type (str): 生成目标的类型
+
+        Returns:
+            ContextManager[StatsRecord]: 需要在成功时设置success的记录
+        """
+        if self.stats is None:
+            return nullcontext(StatsRecord())
+        return self.stats.measure(self.stats_stack(), target_type=gen_type)
+
+    def measure_rule(self, gen: ExpressionGenerator):
+        """统计一次规则的尝试，没有开启统计和规则排序时什么都不做
+
+        Args:
+            gen (ExpressionGenerator): 规则
+
+        Returns:
+            ContextManager[StatsRecord]: 需要在成功时设置success的记录
+        """
+        if self.rule_ordering is not None:
+            return self.learn_rule(gen)
+        if self.stats is None:
+            return nullcontext(StatsRecord())
+        return self.stats.measure(self.stats_stack(), rule=gen.__name__)
+
+    @contextmanager
+    def learn_rule(self, gen: ExpressionGenerator):
+        """统计一次规则的尝试，并将结果和WAF检测次数记录到规则排序中"""
+        assert self.rule_ordering is not None
+        start = self.waf_call_count
+        if self.stats is None:
+            measure = nullcontext(StatsRecord())
+        else:
+            measure = self.stats.measure(self.stats_stack(), rule=gen.__name__)
+        with measure as record:
+            yield record
+        # 被放弃的尝试会抛出异常，不会被记录
+        self.rule_ordering.record(
+            gen.__name__, record.success, self.waf_call_count - start
+        )
+
+    def order_rules(self, gens: List[ExpressionGenerator]):
+        """按照学习到的规则排序或者FAST模式下规则的使用次数排列规则
+
+        Args:
+            gens (List[ExpressionGenerator]): 需要排列的规则，会被原地排序
+        """
+        rule_ordering = self.rule_ordering
+        if rule_ordering is not None:
+            gens.sort(key=lambda gen: rule_ordering.score(gen.__name__), reverse=True)
+        elif self.options.detect_mode == DetectMode.FAST:
+            gens.sort(key=lambda gen: self.used_count[gen.__name__], reverse=True)
+
+    def speculative(self) -> bool:
+        """是否并行尝试规则
+
+        FAST模式和学习规则排序时规则的顺序会随着规则的成功和失败而变化，
+        并行尝试的规则会在其他规则完成之前读取顺序，结果取决于线程的运行时机，
+        所以此时按顺序尝试规则
+        """
+        return (
+            self.options.speculative_workers > 1
+            and self.options.detect_mode != DetectMode.FAST
+            and self.rule_ordering is None
+        )
+
+    def failure_epoch(self) -> Tuple[int, int]:
+        """遇到环和长度剪枝的次数，生成期间其发生变化时失败的结果不是最终结果"""
+        return (self.cycle_hits, self.pruned_hits)
+
+    def length_budget_stack(self) -> List[int]:
+        """当前线程的长度预算栈，栈顶是当前生成目标可以使用的最大长度"""
+        if not hasattr(self.length_budget_state, "stack"):
+            self.length_budget_state.stack = []
+        return self.length_budget_state.stack
+
+    def length_budget(self) -> Union[int, None]:
+        """当前生成目标列表可以使用的最大长度，没有限制时返回None"""
+        if self.max_length is None:
+            return None
+        stack = self.length_budget_stack()
+        return stack[-1] if stack else self.max_length
+
+    def prune_length(self, committed: int, remaining: float, budget: int) -> bool:
+        """已经生成的长度加上剩下部分的长度下界超出预算时进行剪枝
+
+        Args:
+            committed (int): 已经生成的长度
+            remaining (float): 剩下的生成目标的长度下界
+            budget (int): 长度预算
+
+        Returns:
+            bool: 是否需要剪枝
+        """
+        if committed + remaining <= budget:
+            return False
+        with self.used_count_lock:
+            self.pruned_hits += 1
+        return True
+
+    def result_length(self, result: PayloadGeneratorResult) -> int:
+        """生成结果计入长度预算的长度，包括其用到的上下文变量需要的额外长度
+
+        Args:
+            result (PayloadGeneratorResult): 生成结果
+
+        Returns:
+            int: 长度
+        """
+        if self.context_length is None or not result[1]:
+            return len(result[0])
+        return len(result[0]) + self.context_length(result[1])
+
+    def contexts_length(self, contexts: List[ContextExpressions]) -> int:
+        """子目标用到的上下文变量一共需要的额外长度，同一个变量只计算一次
+
+        Args:
+            contexts (List[ContextExpressions]): 子目标用到的非空的上下文变量
+
+        Returns:
+            int: 长度
+        """
+        if self.context_length is None or not contexts:
+            return 0
+        return self.context_length(merge_used_context(contexts))
+
+    def pruned_by_length_failure(self, gen_req: Target) -> bool:
+        """生成目标之前在不小于当前长度预算的预算下失败过时直接剪枝"""
+        budget = self.length_budget()
+        if budget is None:
+            return False
+        target_id = self.cache.interner.intern(gen_req)
+        if self.length_failures.get(target_id, -1) < budget:
+            return False
+        with self.used_count_lock:
+            self.pruned_hits += 1
+        return True
+
+    def cached_within_budget(self, target: Target) -> bool:
+        """生成目标是否有可以直接使用的缓存，超出当前长度预算的缓存结果需要重新生成
+
+        缓存中保存的是第一个找到的结果，在更宽松的预算下找到的结果可能比当前预算长，
+        此时其他规则可能在预算内生成更短的结果
+
+        Args:
+            target (Target): 生成目标
+
+        Returns:
+            bool: 是否可以使用缓存
+        """
+        if target not in self.cache:
+            return False
+        budget = self.length_budget()
+        if budget is None:
+            return True
+        result = self.get_cached(target)
+        return result is None or self.result_length(result) <= budget
+
+    def record_waf_calls(self, count: int):
+        """记录WAF函数检测的payload数"""
+        with self.used_count_lock:
+            self.waf_call_count += count
+        if self.stats is not None:
+            self.stats.record_waf_calls(self.stats_stack(), count)
+
+    def record_cache_hit(self, target: Target):
+        """记录一次缓存命中"""
+        if self.stats is not None:
+            self.stats.record_cache_hit(self.stats_stack(), target[0])
+
+    def get_cached(self, target: Target) -> Union[PayloadGeneratorResult, None]:
+        """读取缓存的生成结果，并将其依赖合并到当前的生成目标中
+
+        Args:
+            target (Target): 已经缓存的生成目标
+
+        Returns:
+            Union[PayloadGeneratorResult, None]: 生成结果
+        """
+        deps = self.cache_deps.get(self.cache.interner.lookup(target))
+        if deps:
+            self.merge_dependencies(deps)
+        return self.cache[target]
+
+    def set_cached(
+        self, target: Target, result: Union[PayloadGeneratorResult, None], deps: set
+    ):
+        """缓存生成结果以及其依赖的上下文
+
+        Args:
+            target (Target): 生成目标
+            result (Union[PayloadGeneratorResult, None]): 生成结果
+            deps (set): 生成结果依赖的上下文
+        """
+        target_id = self.cache.interner.intern(target)
+        self.cache[target] = result
+        token = getattr(self.speculation_state, "token", None)
+        if token is not None:
+            token.cache_writes.append(target_id)
+        with self.speculation_lock:
+            for dep in self.cache_deps.pop(target_id, ()):
+                self.dependents[dep].discard(target_id)
+            if deps:
+                self.cache_deps[target_id] = frozenset(deps)
+                for dep in deps:
+                    self.dependents[dep].add(target_id)
+
+    def invalidate_context_values(self, values: List[Any]) -> int:
+        """删除依赖了上下文中这些值的缓存
+
+        Args:
+            values (List[Any]): 被添加、删除或者修改的变量的值
+
+        Returns:
+            int: 被删除的缓存数量
+        """
+        deps = {CONTEXT_ANY} | {context_value_dependency(value) for value in values}
+        with self.speculation_lock:
+            target_ids = set()
+            for dep in deps:
+                target_ids |= self.dependents.pop(dep, set())
+            for target_id in target_ids:
+                self.cache.discard_id(target_id)
+                for dep in self.cache_deps.pop(target_id, ()):
+                    self.dependents[dep].discard(target_id)
+            # 新的上下文可能让生成结果变短
+            self.length_failures.clear()
+        return len(target_ids)
+
+    @property
+    def cache_by_repr(self) -> TargetCache:
+        """旧版本的缓存名，保留以兼容外部代码"""
+        return self.cache
 
     def add_generated_expr(self, target, result):
         self.generated_exprs[target] = result
 
-    # it is correct pylint, it returns a internal decorator.
-    def create_generate_func_register():  # pylint: disable=no-method-argument
-        generate_funcs = []
+    def check_waf(self, payload: str) -> bool:
+        """检测payload能否通过WAF，优先使用批量提前检测的结果
+
+        Args:
+            payload (str): payload
+
+        Returns:
+            bool: 能否通过WAF
+        """
+        token = getattr(self.speculation_state, "token", None)
+        if token is not None and token.is_abandoned():
+            raise SpeculationAbandoned()
+        verdict = self.prefetched_verdicts.pop(payload, None)
+        if verdict is None:
+            if payload in self.passed_payloads:
+                return True
+            if self.budget_exhausted():
+                raise BudgetExhausted()
+            self.record_waf_calls(1)
+            verdict = self.waf_func(payload)
+            if verdict:
+                self.record_passed([payload])
+        return verdict
+
+    @contextmanager
+    def budget_scope(self):
+        """在选项中的时间和WAF检测次数预算内运行，嵌套时使用最外层的预算
+
+        Yields:
+            Union[GenerationBudget, None]: 这次生成的预算，嵌套或者没有预算时为None
+        """
+        time_budget, waf_call_budget = (
+            self.options.time_budget,
+            self.options.waf_call_budget,
+        )
+        if self.generation_budget is not None or (
+            time_budget is None and waf_call_budget is None
+        ):
+            yield None
+            return
+        self.generation_budget = GenerationBudget(
+            time_budget, waf_call_budget, self.waf_call_count
+        )
+        try:
+            yield self.generation_budget
+        finally:
+            self.generation_budget = None
+            self.passed_payloads = {}
+
+    def budget_exhausted_error(
+        self, budget: GenerationBudget
+    ) -> GenerationBudgetExhausted:
+        """预算用完并且没有找到结果时抛出的异常，包含这次生成的统计数据"""
+        assert budget.exhausted is not None
+        return GenerationBudgetExhausted(
+            budget.exhausted,
+            time.perf_counter() - budget.start,
+            self.waf_call_count - budget.start_waf_calls,
+            self.options.generation_stats,
+        )
+
+    def budget_exhausted(self) -> bool:
+        """当前生成的预算是否已经用完"""
+        budget = self.generation_budget
+        return budget is not None and budget.check(self.waf_call_count)
+
+    def record_passed(self, payloads: List[str]):
+        """有预算时记录通过了WAF的payload"""
+        if self.generation_budget is None:
+            return
+        if len(self.passed_payloads) > self.prefetched_verdicts_size:
+            self.passed_payloads.clear()
+        self.passed_payloads.update(dict.fromkeys(payloads))
+
+    def prefetch_waf(self, payloads: List[str]):
+        """将之后可能会检测的payload一次性交给WAF函数检测，
+        仅在WAF函数能从批量检测中获益时才会检测
+
+        Args:
+            payloads (List[str]): payload列表
+        """
+        batch_size = self.waf_func.batch_size
+        if batch_size <= 1:
+            return
+        if len(self.prefetched_verdicts) > self.prefetched_verdicts_size:
+            self.prefetched_verdicts.clear()
+        payloads = [
+            payload
+            for payload in dict.fromkeys(payloads)
+            if payload not in self.prefetched_verdicts
+        ]
+        for i in range(0, len(payloads), batch_size):
+            if self.budget_exhausted():
+                return
+            chunk = payloads[i : i + batch_size]
+            self.record_waf_calls(len(chunk))
+            self.prefetched_verdicts.update(
+                zip(chunk, self.waf_func.check_many(chunk))
+            )
+
+    def literal_probes(self, targets: List[Target]) -> Union[List[str], None]:
+        """在不调用WAF函数的情况下，求出generate_by_list在生成目标列表上会检测的所有payload
+        仅支持只包含literal的生成目标列表，否则返回None
+
+        Args:
+            targets (List[Target]): 生成目标列表
+
+        Returns:
+            Union[List[str], None]: 会被检测的payload
+        """
+        targets = self.unwrap_whitespace(targets)
+        if len(targets) == 1 and targets[0][0] == ONEOF:
+            probes = []
+            for req in targets[0][1]:
+                req_probes = self.literal_probes(req)
+                if req_probes is None:
+                    return None
+                probes += req_probes
+            return probes
+        if not all(target[0] == LITERAL for target in targets):
+            return None
+        probes = [word for target in targets for word in literal_words(target[1])]
+        probes.append("".join(target[1] for target in targets))
+        return probes
 
-        def register(checker_func):
-            def _wraps(runner_func):
-                generate_funcs.append((checker_func, runner_func))
-                return runner_func
+    def prefetch_targets_list(self, targets_list: List[List[Target]]):
+        """提前检测一系列生成目标列表中可以直接确定的payload
+
+        Args:
+            targets_list (List[List[Target]]): 生成目标列表的列表
+        """
+        if self.waf_func.batch_size <= 1:
+            return
+        payloads = self.collect_literal_probes(targets_list)
+        if payloads:
+            self.prefetch_waf(payloads)
 
-            return _wraps
+    def collect_literal_probes(self, targets_list: List[List[Target]]) -> List[str]:
+        """收集一系列生成目标列表中不需要WAF就可以确定的payload
 
-        return generate_funcs, register
+        Args:
+            targets_list (List[List[Target]]): 生成目标列表的列表
 
-    generate_funcs, register_generate_func = create_generate_func_register()
+        Returns:
+            List[str]: payload列表
+        """
+        payloads = []
+        for targets in targets_list:
+            probes = self.literal_probes(targets)
+            if probes is not None:
+                payloads += probes
+        return payloads
 
     def generate_by_list(
         self, targets: List[Target]
@@ -171,28 +1066,86 @@ class PayloadGenerator:
         Returns:
             Union[PayloadGeneratorResult, None]: 生成结果，其包含payload和payload用到的上下文中的变量
         """
-        targets = unwrap_whitespace(targets)
-        str_result, used_context, tree = "", {}, []
+        targets = self.unwrap_whitespace(targets)
+        budget = self.length_budget()
+        if budget is not None:
+            return self.generate_by_list_budgeted(targets, budget)
+        parts, contexts, tree = [], [], []
 
         for target in targets:
-            for checker, runner in self.generate_funcs:
-                if not checker(self, target):
-                    continue
-                result = runner(self, target)
-                if result is None:
-                    return None
-                s, c, subs = result
-                str_result += s
-                used_context.update(c)
-                tree.append((target, subs))
-                break
+            handler = target_handlers.get(target[0])
+            if handler is not None:
+                result = handler(self, target)
+            elif target in self.cache:
+                result = self.cache_generate(target)
             else:
-                raise RuntimeError("it shouldn't runs this line")
-        if not self.waf_func(str_result):
+                result = self.common_generate(target)
+            if result is None:
+                return None
+            s, c, subs = result
+            parts.append(s)
+            if c:
+                contexts.append(c)
+            tree.append((target, subs))
+        str_result = "".join(parts)
+        if not self.check_waf(str_result):
             return None
-        return str_result, used_context, tree
+        return str_result, merge_used_context(contexts), tree
+
+    def generate_single(self, target: Target) -> Union[PayloadGeneratorResult, None]:
+        """生成单个生成目标，不使用WAF检测其结果"""
+        handler = target_handlers.get(target[0])
+        if handler is not None:
+            return handler(self, target)
+        if self.cached_within_budget(target):
+            return self.cache_generate(target)
+        return self.common_generate(target)
+
+    def generate_by_list_budgeted(
+        self, targets: List[Target], budget: int
+    ) -> Union[PayloadGeneratorResult, None]:
+        """在长度预算内根据一个生成目标的列表生成payload
+        每个子目标的预算为总预算减去已经生成的长度和剩下子目标的长度下界，
+        超出预算的部分在调用WAF函数之前就会被剪枝
+
+        Args:
+            targets (List[Target]): 已经替换了whitespace的生成目标列表
+            budget (int): 长度预算
+
+        Returns:
+            Union[PayloadGeneratorResult, None]: 生成结果
+        """
+        bounds = [self.estimate_length(target) for target in targets]
+        remaining = sum(bounds)
+        if self.prune_length(0, remaining, budget):
+            return None
+        parts, contexts, tree = [], [], []
+        # committed包括已经生成的部分和它们用到的上下文变量需要的额外长度
+        generated, committed, stack = 0, 0, self.length_budget_stack()
+        for target, bound in zip(targets, bounds):
+            remaining -= bound
+            stack.append(int(budget - committed - remaining))
+            try:
+                result = self.generate_single(target)
+            finally:
+                stack.pop()
+            if result is None:
+                return None
+            s, c, subs = result
+            parts.append(s)
+            if c:
+                contexts.append(c)
+            tree.append((target, subs))
+            generated += len(s)
+            committed = generated + self.contexts_length(contexts)
+            if self.prune_length(committed, remaining, budget):
+                return None
+        str_result = "".join(parts)
+        if not self.check_waf(str_result):
+            return None
+        return str_result, merge_used_context(contexts), tree
 
-    @register_generate_func(lambda self, target: target[0] == LITERAL)
+    @target_handler(LITERAL)
     def literal_generate(
         self, target: LiteralTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -208,12 +1161,13 @@ class PayloadGenerator:
         # 因为这些片段的种类比Literal少得多，利于缓存
         # 为了提升速度，literal也会被generate_by_list检查
         # 不应该在这里检测单双引号，因为引号对应的页面hash可能被收集了，导致误判
-        words = set(re.findall(r"[a-z]{3,}|[0-9]", target[1]))
-        if not all(self.waf_func(word) for word in words):
+        words = literal_words(target[1])
+        self.prefetch_waf(words)
+        if not all(self.check_waf(word) for word in words):
             return None
         return (target[1], {}, [])
 
-    @register_generate_func(lambda self, target: target[0] == GENERATED_EXPR)
+    @target_handler(GENERATED_EXPR)
     def generated_generate(
         self, target: GeneratedExprTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -227,7 +1181,6 @@ class PayloadGenerator:
         """
         return self.generated_exprs.get(target[1])
 
-    @register_generate_func(lambda self, target: target in self.cache_by_repr)
     def cache_generate(self, target: Target) -> Union[PayloadGeneratorResult, None]:
         """为已经缓存的生成目标生成payload
 
@@ -237,9 +1190,10 @@ class PayloadGenerator:
         Returns:
             Union[PayloadGeneratorResult, None]: 生成结果
         """
-        return self.cache_by_repr[target]
+        self.record_cache_hit(target)
+        return self.get_cached(target)
 
-    @register_generate_func(lambda self, target: target[0] == EXPRESSION)
+    @target_handler(EXPRESSION)
     def expression_generate(
         self, target: ExpressionTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -257,7 +1211,7 @@ class PayloadGenerator:
         ), repr(target)[:100]
         return self.generate_by_list(target[2])
 
-    @register_generate_func(lambda self, target: target[0] == ENCLOSE_UNDER)
+    @target_handler(ENCLOSE_UNDER)
     def enclose_under_generate(
         self, target: EncloseUnderTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -308,12 +1262,12 @@ class PayloadGenerator:
             )
         return str_result, used_context, tree
 
-    @register_generate_func(lambda self, target: target[0] == UNSATISFIED)
+    @target_handler(UNSATISFIED)
     def unsatisfied_generate(self, target: UnsatisfiedTarget) -> None:
         """直接拒绝类型为unsatisfied的生成目标"""
         return None
 
-    @register_generate_func(lambda self, target: target[0] == ONEOF)
+    @target_handler(ONEOF)
     def oneof_generate(
         self, target: OneofTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -326,13 +1280,63 @@ class PayloadGenerator:
             Union[PayloadGeneratorResult, None]: 生成结果
         """
         _, alternative_targets = target
+        self.prefetch_targets_list(alternative_targets)
+        if self.options.search_strategy == SearchStrategy.BEST_FIRST:
+            return self.oneof_generate_best_first(alternative_targets)
         for req in alternative_targets:
             ret = self.generate_by_list(req)
             if ret is not None:
                 return ret
         return None
 
-    @register_generate_func(lambda self, target: target[0] == WITH_CONTEXT_VAR)
+    def oneof_generate_best_first(
+        self, alternative_targets: List[List[Target]]
+    ) -> Union[PayloadGeneratorResult, None]:
+        """按照估计的长度从小到大尝试oneof中的每一个子目标，在找到结果之后继续尝试
+        至多search_budget个可能更短的子目标
+
+        Args:
+            alternative_targets (List[List[Target]]): oneof中的生成目标列表
+
+        Returns:
+            Union[PayloadGeneratorResult, None]: 最短的生成结果
+        """
+        best, budget = None, self.options.search_budget
+        for length, _, req in self.rank_alternatives(alternative_targets):
+            if length == float("inf"):
+                break
+            if best is not None:
+                if budget <= 0 or length >= len(best[0]):
+                    break
+                budget -= 1
+            try:
+                ret = self.generate_by_list(req)
+            except BudgetExhausted:
+                if best is None:
+                    raise
+                break
+            if ret is not None and (best is None or len(ret[0]) < len(best[0])):
+                best = ret
+        return best
+
+    def rank_alternatives(self, alternative_targets: List[List[Target]]) -> List[Tuple]:
+        """按照估计的长度从小到大排序oneof中的子目标
+
+        Args:
+            alternative_targets (List[List[Target]]): oneof中的生成目标列表
+
+        Returns:
+            List[Tuple]: (估计的长度, 序号, 生成目标列表)的列表
+        """
+        return sorted(
+            (
+                (self.estimate_targets_length(req), i, req)
+                for i, req in enumerate(alternative_targets)
+            ),
+            key=lambda item: item[:2],
+        )
+
+    @target_handler(WITH_CONTEXT_VAR)
     def with_context_var_generate(
         self, target: WithContextVarTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -346,7 +1350,7 @@ class PayloadGenerator:
         """
         return ("", {target[1]: self.context[target[1]]}, [])
 
-    @register_generate_func(lambda self, target: target[0] == JINJA_CONTEXT_VAR)
+    @target_handler(JINJA_CONTEXT_VAR)
     def jinja_context_var_generate(
         self, target: JinjaContextVarTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -360,7 +1364,7 @@ class PayloadGenerator:
         """
         return (target[1], {}, [])
 
-    @register_generate_func(lambda self, target: target[0] == FLASK_CONTEXT_VAR)
+    @target_handler(FLASK_CONTEXT_VAR)
     def flask_context_var_generate(
         self, target: FlaskContextVarTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -376,7 +1380,7 @@ class PayloadGenerator:
             return None
         return (target[1], {}, [])
 
-    @register_generate_func(lambda self, target: target[0] == REQUIRE_PYTHON3)
+    @target_handler(REQUIRE_PYTHON3)
     def require_python3_generate(
         self, target: RequirePython3Target
     ) -> Union[PayloadGeneratorResult, None]:
@@ -392,9 +1396,7 @@ class PayloadGenerator:
             return None
         return ("", {}, [])
 
-    @register_generate_func(
-        lambda self, target: target[0] == REQUIRE_PYTHON3_SUBVERSION
-    )
+    @target_handler(REQUIRE_PYTHON3_SUBVERSION)
     def require_python3_subversion_generate(
         self, target: RequirePython3SubversionTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -414,7 +1416,7 @@ class PayloadGenerator:
             return None
         return ("", {}, [])
 
-    @register_generate_func(lambda self, target: target[0] == REQUIRE_FLASK)
+    @target_handler(REQUIRE_FLASK)
     def require_flask_generate(
         self, target: RequireFlaskTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -430,7 +1432,7 @@ class PayloadGenerator:
             return None
         return ("", {}, [])
 
-    @register_generate_func(lambda self, target: target[0] == VARIABLE_OF)
+    @target_handler(VARIABLE_OF)
     def variable_of_generate(
         self, target: VariableOfTarget
     ) -> Union[PayloadGeneratorResult, None]:
@@ -442,6 +1444,7 @@ class PayloadGenerator:
         Returns:
             _type_: 生成结果
         """
+        self.record_context_dependency(context_value_dependency(target[1]))
         expressions = [
             (expr, precedence_index)
             for expr, (value, precedence_index) in self.context.items()
@@ -461,7 +1464,6 @@ class PayloadGenerator:
         ]
         return self.generate_by_list([(ONEOF, targets_list)])
 
-    @register_generate_func(lambda self, target: True)
     def common_generate(self, gen_req: Target) -> Union[PayloadGeneratorResult, None]:
         """为剩下所有类型的生成目标生成对应的payload, 遍历对应的expression_gen，拿到
         对应的生成目标列表并尝试使用这个列表生成payload
@@ -475,81 +1477,128 @@ class PayloadGenerator:
         gen_type, *args = gen_req
         if gen_type not in expression_gens or len(expression_gens[gen_type]) == 0:
             raise RuntimeError(f"Unknown type: {gen_type}")
+        if self.pruned_by_length_failure(gen_req):
+            return None
+        if self.budget_exhausted():
+            raise BudgetExhausted()
 
-        gens = expression_gens[gen_type].copy()
-        if self.options.detect_mode == DetectMode.FAST:
-            gens.sort(key=lambda gen: self.used_count[gen.__name__], reverse=True)
-        with optional_context(
-            gen_type
-            in [
-                STRING,
-                POSITIVE_INTEGER,
-                ZERO,
-                OS_POPEN_READ,
-                EVAL,
-            ],
-            gens,
-            lambda gens: pbar_manager.pbar(gens, "Rule"),
-        ) as gens:
-            for gen in gens:
-                logger.debug("Trying gen rule: %s", gen.__name__)
-                if isinstance(gens, Pbar):
-                    gens.update(description="Rule: " + gen.__name__)
-                gen_ret: List[Target] = gen(self.context, *args)
-                try:
-                    ret = self.generate_by_list(gen_ret)
-                except Exception as e:
-                    raise RuntimeError(f"Unknown error at {gen.__name__}") from e
-                if ret is None:
-                    continue
-                logger.debug("Using gen rule: %s", gen.__name__)
-                result = ret[0]
-                self.callback(
-                    CALLBACK_GENERATE_PAYLOAD,
-                    {
-                        "gen_type": gen_type,
-                        "args": args,
-                        "gen_ret": gen_ret,
-                        "payload": result,
-                    },
-                )
-                # 为了日志的简洁，仅打印一部分日志
-                if (
-                    gen_type in (POSITIVE_INTEGER, STRING) and result != str(args[0])
-                ) or (gen_type == ZERO and result != "0"):
-                    logger.info(
-                        "[green bold]Great![/] [green bold]{gen_name}[/] says "
-                        "[yellow bold]{gen_type}[/]"
-                        "[yellow]({args_repl})[/] can be [blue]{result}[/]".format(
-                            gen_type=gen_type,
-                            gen_name=rich_escape(gen.__name__),
-                            args_repl=rich_escape(", ".join(repr(arg) for arg in args)),
-                            result=rich_escape(result),
-                        ),
-                        extra={"markup": True, "highlighter": None},
-                    )
+        # 嵌套过深时退回到first策略，避免代价估计过低的递归规则导致栈溢出
+        best_first = (
+            self.options.search_strategy == SearchStrategy.BEST_FIRST
+            and len(self.generating) < self.best_first_max_depth
+        )
+        if best_first:
+            # best_first在找到结果之后还会继续尝试其他规则，规则之间互相引用时可能会
+            # 回到正在生成的目标上，此时放弃这一分支
+            target_id = self.cache.interner.intern(gen_req)
+            if target_id in self.generating:
+                with self.used_count_lock:
+                    self.cycle_hits += 1
+                return None
+            self.generating.add(target_id)
+        failure_epoch = self.failure_epoch()
+        claimed = None
+        speculative = not best_first and self.speculative()
+        if speculative:
+            # 其他线程正在生成同一个目标时等待其结果，避免重复检测
+            claimed = self.claim_target(gen_req)
+            if claimed is None and self.cached_within_budget(gen_req):
+                return self.cache_generate(gen_req)
 
-                elif gen_type in (
-                    EVAL_FUNC,
-                    EVAL,
-                    CONFIG,
-                    MODULE_OS,
-                    OS_POPEN_OBJ,
+        gens = expression_gens[gen_type].copy()
+        self.order_rules(gens)
+        self.push_dependency_frame()
+        deps = None
+        try:
+            with self.measure_target(gen_type) as record, optional_context(
+                gen_type
+                in [
+                    STRING,
+                    POSITIVE_INTEGER,
+                    ZERO,
                     OS_POPEN_READ,
-                ):
-                    logger.info(
-                        "[green bold]Great![/green bold] we generate "
-                        "[yellow bold]{gen_type}[/yellow bold]"
-                        "[yellow]({args_repl})[/yellow]".format(
-                            gen_type=gen_type,
-                            args_repl=rich_escape(", ".join(repr(arg) for arg in args)),
-                        ),
-                        extra={"markup": True, "highlighter": None},
-                    )
+                    EVAL,
+                ],
+                gens,
+                lambda gens: pbar_manager.pbar(gens, "Rule"),
+            ) as gens:
+                found = None
+                if best_first:
+                    found = self.search_rules_best_first(gens, args)
+                elif speculative:
+                    found = self.search_rules_speculative(gens, args)
+                else:
+                    # 直接在这里尝试规则而不是调用其他函数，以减少每层递归使用的栈帧
+                    for gen, gen_ret in self.expand_rules(gens, args):
+                        try:
+                            with self.measure_rule(gen) as rule_record:
+                                ret = self.generate_by_list(gen_ret)
+                                rule_record.success = ret is not None
+                        except (SpeculationAbandoned, BudgetExhausted):
+                            raise
+                        except Exception as e:
+                            raise RuntimeError(
+                                f"Unknown error at {gen.__name__}"
+                            ) from e
+                        if ret is not None:
+                            found = (gen, gen_ret, ret)
+                            break
+                record.success = found is not None
+            deps = self.pop_dependency_frame()
+            return self.commit_generation(gen_req, found, deps, failure_epoch)
+        finally:
+            if deps is None:
+                self.pop_dependency_frame()
+            if best_first:
+                self.generating.discard(target_id)
+            if claimed is not None:
+                self.release_target(gen_req, claimed)
+
+    def commit_generation(
+        self,
+        gen_req: Target,
+        found: Union[
+            Tuple[ExpressionGenerator, List[Target], PayloadGeneratorResult], None
+        ],
+        deps: set,
+        failure_epoch: Tuple[int, int],
+    ) -> Union[PayloadGeneratorResult, None]:
+        """记录一个生成目标的生成结果：打印日志，调用callback并写入缓存
 
-                self.cache_by_repr[gen_req] = ret
+        Args:
+            gen_req (Target): 生成目标
+            found (Union[Tuple[ExpressionGenerator, List[Target], PayloadGeneratorResult], None]):
+                成功的规则，规则展开的结果和生成结果，失败时为None
+            deps (set): 生成结果依赖的上下文
+            failure_epoch (Tuple[int, int]): 开始生成时的failure_epoch()
+
+        Returns:
+            Union[PayloadGeneratorResult, None]: 生成结果
+        """
+        gen_type, *args = gen_req
+        if found is not None:
+            gen, gen_ret, ret = found
+            self.log_rule_success(gen_type, args, gen, gen_ret, ret[0])
+            self.set_cached(gen_req, ret, deps)
+            token = getattr(self.speculation_state, "token", None)
+            with self.used_count_lock:
                 self.used_count[gen.__name__] += 1
-                return ret
+                if token is not None:
+                    token.used_count[gen.__name__] += 1
+            return ret
+        # 因为环或者长度预算而失败的结果不一定是最终结果，不进行缓存
+        # 只因为长度预算而失败时记录下这个预算，之后更小的预算会直接失败
+        # 已经有缓存结果时说明是在长度预算内重新生成，保留原来的结果
+        if self.failure_epoch() == failure_epoch:
+            if gen_req not in self.cache:
+                self.set_cached(gen_req, None, deps)
+        elif self.cycle_hits == failure_epoch[0]:
+            budget = self.length_budget()
+            if budget is not None:
+                target_id = self.cache.interner.intern(gen_req)
+                self.length_failures[target_id] = max(
+                    budget, self.length_failures.get(target_id, -1)
+                )
         if gen_type not in (
             CHAINED_ATTRIBUTE_ITEM,
             ATTRIBUTE,
@@ -573,10 +1622,501 @@ class PayloadGenerator:
                 ),
                 extra={"markup": True, "highlighter": None},
             )
+        return None
+
+    def try_rule(
+        self, gen: ExpressionGenerator, gen_ret: List[Target]
+    ) -> Union[PayloadGeneratorResult, None]:
+        """使用某个规则展开后的生成目标列表生成payload
+
+        Args:
+            gen (ExpressionGenerator): 规则
+            gen_ret (List[Target]): 规则展开的结果
+
+        Returns:
+            Union[PayloadGeneratorResult, None]: 生成结果
+        """
+        try:
+            with self.measure_rule(gen) as record:
+                ret = self.generate_by_list(gen_ret)
+                record.success = ret is not None
+            return ret
+        except (SpeculationAbandoned, BudgetExhausted):
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Unknown error at {gen.__name__}") from e
+
+    def expand_rules(self, gens, args):
+        """按顺序展开每一个规则，WAF函数支持批量检测时会先展开所有规则并提前检测
+
+        Args:
+            gens (Iterable[ExpressionGenerator]): 所有规则
+            args (list): 生成目标的参数
+
+        Yields:
+            Tuple[ExpressionGenerator, List[Target]]: 规则和规则展开的结果
+        """
+        if self.waf_func.batch_size > 1:
+            expanded = [(gen, gen(self.context_view, *args)) for gen in gens]
+            self.prefetch_targets_list([gen_ret for _, gen_ret in expanded])
+        else:
+            expanded = ((gen, gen(self.context_view, *args)) for gen in gens)
+        for gen, gen_ret in expanded:
+            logger.debug("Trying gen rule: %s", gen.__name__)
+            if isinstance(gens, Pbar):
+                gens.update(description="Rule: " + gen.__name__)
+            yield gen, gen_ret
+
+    def search_rules_speculative(self, gens, args):
+        """在线程池中同时尝试接下来的speculative_workers个规则，并按照规则原本的顺序
+        返回第一个通过WAF的规则
+        等待的规则还没有开始运行时会直接在当前线程运行，所以嵌套的并行尝试不会因为
+        线程池被占满而死锁
+        只有按顺序尝试时也会运行的规则(返回的规则以及它之前的规则)会被采纳，
+        其他规则写入的缓存和规则使用次数会被撤销
+
+        Args:
+            gens (Iterable[ExpressionGenerator]): 所有规则
+            args (list): 生成目标的参数
+
+        Returns:
+            Union[Tuple[ExpressionGenerator, List[Target], PayloadGeneratorResult], None]:
+                规则，规则展开的结果和生成结果
+        """
+        parent_token = getattr(self.speculation_state, "token", None)
+        if parent_token is not None and parent_token.is_abandoned():
+            raise SpeculationAbandoned()
+        with self.speculation_executor() as executor:
+            return self.run_speculations(executor, gens, args, parent_token)
+
+    @contextmanager
+    def speculation_executor(self):
+        """取得并行尝试使用的线程池，最外层的并行尝试结束时关闭线程池
+
+        Yields:
+            ThreadPoolExecutor: 线程池
+        """
+        with self.speculation_lock:
+            if self.executor is None:
+                # 等待其他线程的线程不会运行新的规则，所以线程池需要比同时尝试的规则数更大
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.options.speculative_workers * 4,
+                    thread_name_prefix="fenjing-speculative",
+                )
+            self.executor_users += 1
+            executor = self.executor
+        try:
+            yield executor
+        finally:
+            with self.speculation_lock:
+                self.executor_users -= 1
+                if self.executor_users == 0:
+                    self.executor = None
+                else:
+                    executor = None
+            if executor is not None:
+                # 被放弃但是仍在运行的规则会在下一次检测WAF时中止，不需要等待
+                executor.shutdown(wait=False)
+
+    def run_speculations(
+        self,
+        executor: ThreadPoolExecutor,
+        gens,
+        args,
+        parent_token: Union[SpeculationToken, None],
+    ):
+        """search_rules_speculative的实现
+
+        Args:
+            executor (ThreadPoolExecutor): 线程池
+            gens (Iterable[ExpressionGenerator]): 所有规则
+            args (list): 生成目标的参数
+            parent_token (Union[SpeculationToken, None]): 当前线程所在的尝试
 
-        self.cache_by_repr[gen_req] = None
+        Returns:
+            Union[Tuple[ExpressionGenerator, List[Target], PayloadGeneratorResult], None]:
+                规则，规则展开的结果和生成结果
+        """
+        workers = self.options.speculative_workers
+        gens_iter = iter(gens)
+        pending = deque()
+
+        def submit_next():
+            gen = next(gens_iter, None)
+            if gen is not None:
+                token = SpeculationToken(parent_token)
+                future = executor.submit(
+                    self.speculate_rule, gen, args, token, self.length_budget()
+                )
+                future.add_done_callback(lambda _: token.started.set())
+                pending.append((gen, future, token))
+
+        for _ in range(workers):
+            submit_next()
+        try:
+            while pending:
+                gen, future, token = pending.popleft()
+                if isinstance(gens, Pbar):
+                    gens.update(description="Rule: " + gen.__name__)
+                if future.cancel() or not self.wait_speculation(future, token):
+                    self.abandon_speculation(future, token)
+                    gen_ret = gen(self.context_view, *args)
+                    ret = self.try_rule(gen, gen_ret)
+                else:
+                    try:
+                        gen_ret, ret, deps = future.result()
+                    except BaseException:
+                        self.discard_speculation(token)
+                        raise
+                    self.merge_dependencies(deps)
+                    self.accept_speculation(token)
+                if ret is not None:
+                    return gen, gen_ret, ret
+                submit_next()
+        finally:
+            # 已经开始运行的规则会在下一次检测WAF时中止
+            for _, future, token in pending:
+                future.cancel()
+                self.abandon_speculation(future, token)
+        return None
+
+    def abandon_speculation(self, future: Future, token: SpeculationToken):
+        """放弃一次尝试，其写入的缓存会在它结束之后被撤销"""
+        token.abandoned = True
+        future.add_done_callback(lambda _: self.discard_speculation(token))
+
+    def accept_speculation(self, token: SpeculationToken):
+        """把被采纳的尝试写入的缓存和增加的规则使用次数合并到上层的尝试中"""
+        parent = token.parent
+        if parent is None:
+            return
+        with self.used_count_lock:
+            for name, count in token.used_count.items():
+                parent.used_count[name] += count
+        parent.cache_writes += token.cache_writes
+
+    def discard_speculation(self, token: SpeculationToken):
+        """撤销没有被采纳的尝试写入的缓存和增加的规则使用次数"""
+        with self.used_count_lock:
+            for name, count in token.used_count.items():
+                self.used_count[name] -= count
+            token.used_count.clear()
+        with self.speculation_lock:
+            for target_id in token.cache_writes:
+                self.cache.discard_id(target_id)
+                for dep in self.cache_deps.pop(target_id, ()):
+                    self.dependents[dep].discard(target_id)
+            token.cache_writes = []
+
+    def wait_for_thread(self, thread: int, waiter: Callable[[], Any]) -> bool:
+        """在不会产生死锁时等待另一个线程
+
+        Args:
+            thread (int): 被等待的线程
+            waiter (Callable[[], Any]): 实际进行等待的函数
+
+        Returns:
+            bool: 是否进行了等待，等待会导致死锁时返回False
+        """
+        current = threading.get_ident()
+        with self.speculation_lock:
+            node = thread
+            while node is not None:
+                if node == current:
+                    return False
+                node = self.waits_for.get(node)
+            self.waits_for[current] = thread
+        try:
+            waiter()
+        finally:
+            with self.speculation_lock:
+                self.waits_for.pop(current, None)
+        return True
+
+    def wait_speculation(self, future: Future, token: SpeculationToken) -> bool:
+        """等待一个正在运行的规则
+
+        Args:
+            future (Future): 规则对应的future
+            token (SpeculationToken): 规则对应的标记
+
+        Returns:
+            bool: 规则是否运行完成，等待会导致死锁时返回False
+        """
+        # 规则已经开始运行，很快就会记录运行它的线程
+        token.started.wait()
+        if future.done():
+            return True
+        return self.wait_for_thread(token.thread, lambda: wait_futures([future]))
+
+    def claim_target(self, gen_req: Target) -> Union[threading.Event, None]:
+        """标记当前线程开始生成某个目标，如果其他线程正在生成这个目标则等待其完成
+
+        Args:
+            gen_req (Target): 生成目标
+
+        Returns:
+            Union[threading.Event, None]: 由当前线程负责生成时返回对应的事件，否则返回None
+        """
+        target_id = self.cache.interner.intern(gen_req)
+        with self.speculation_lock:
+            entry = self.inflight.get(target_id)
+            if entry is None:
+                event = threading.Event()
+                self.inflight[target_id] = (threading.get_ident(), event)
+                return event
+        self.wait_for_thread(entry[0], entry[1].wait)
         return None
 
+    def release_target(self, gen_req: Target, event: threading.Event):
+        """标记当前线程已经完成某个目标的生成
+
+        Args:
+            gen_req (Target): 生成目标
+            event (threading.Event): claim_target返回的事件
+        """
+        target_id = self.cache.interner.intern(gen_req)
+        with self.speculation_lock:
+            self.inflight.pop(target_id, None)
+        event.set()
+
+    def speculate_rule(
+        self,
+        gen: ExpressionGenerator,
+        args,
+        token: SpeculationToken,
+        budget: Union[int, None] = None,
+    ):
+        """在线程池中展开并尝试一个规则
+
+        Args:
+            gen (ExpressionGenerator): 规则
+            args (list): 生成目标的参数
+            token (SpeculationToken): 这次尝试对应的标记
+            budget (Union[int, None], optional): 提交规则的线程中的长度预算
+
+        Returns:
+            Tuple[List[Target], Union[PayloadGeneratorResult, None], set]:
+                规则展开的结果，生成结果和生成结果依赖的上下文
+        """
+        token.thread = threading.get_ident()
+        token.started.set()
+        self.speculation_state.token = token
+        self.push_dependency_frame()
+        stack = self.length_budget_stack()
+        saved_stack = stack[:]
+        if budget is not None:
+            stack[:] = [budget]
+        try:
+            logger.debug("Trying gen rule: %s", gen.__name__)
+            gen_ret: List[Target] = gen(self.context_view, *args)
+            ret = self.try_rule(gen, gen_ret)
+        finally:
+            deps = self.pop_dependency_frame()
+            self.speculation_state.token = None
+            stack[:] = saved_stack
+        return gen_ret, ret, deps
+
+    def search_rules_best_first(self, gens, args):
+        """展开所有规则并按照估计的代价（payload长度以及WAF检测次数）从小到大尝试
+        找到第一个结果之后，继续尝试至多search_budget个估计的长度比当前结果更短的规则，
+        并返回其中最短的结果
+
+        已经缓存的子目标按照缓存结果的长度估计，所以这是在复用缓存的前提下的启发式搜索，
+        并不保证找到的是所有可能结果中最短的
+
+        Args:
+            gens (Iterable[ExpressionGenerator]): 所有规则
+            args (list): 生成目标的参数
+
+        Returns:
+            Union[Tuple[ExpressionGenerator, List[Target], PayloadGeneratorResult], None]:
+                规则，规则展开的结果和生成结果
+        """
+        candidates = self.rank_rules(gens, args)
+        self.prefetch_targets_list([item[4] for item in candidates])
+
+        best, budget = None, self.options.search_budget
+        for _, _, length, gen, gen_ret in candidates:
+            if best is not None:
+                if budget <= 0:
+                    break
+                if length >= len(best[2][0]):
+                    continue
+                budget -= 1
+            logger.debug("Trying gen rule: %s", gen.__name__)
+            try:
+                ret = self.try_rule(gen, gen_ret)
+            except BudgetExhausted:
+                if best is None:
+                    raise
+                break
+            if ret is not None and (best is None or len(ret[0]) < len(best[2][0])):
+                best = (gen, gen_ret, ret)
+        return best
+
+    def rank_rules(self, gens, args) -> List[Tuple]:
+        """展开所有规则并按照估计的代价从小到大排序，去掉一定无法生成的规则
+
+        Args:
+            gens (Iterable[ExpressionGenerator]): 所有规则
+            args (list): 生成目标的参数
+
+        Returns:
+            List[Tuple]: (代价, 序号, 估计的长度, 规则, 规则展开的结果)的列表
+        """
+        candidates = []
+        for gen in gens:
+            if isinstance(gens, Pbar):
+                gens.update(description="Rule: " + gen.__name__)
+            gen_ret: List[Target] = gen(self.context_view, *args)
+            length = self.estimate_targets_length(gen_ret)
+            if length == float("inf"):
+                continue
+            score = length + self.waf_cost_weight * self.estimate_targets_probes(
+                gen_ret
+            )
+            candidates.append((score, len(candidates), length, gen, gen_ret))
+        candidates.sort(key=lambda item: item[:2])
+        return candidates
+
+    def log_rule_success(self, gen_type, args, gen, gen_ret, result: str):
+        """规则生成成功时调用callback并打印日志"""
+        logger.debug("Using gen rule: %s", gen.__name__)
+        self.callback(
+            CALLBACK_GENERATE_PAYLOAD,
+            {
+                "gen_type": gen_type,
+                "args": args,
+                "gen_ret": gen_ret,
+                "payload": result,
+            },
+        )
+        # 为了日志的简洁，仅打印一部分日志
+        if (gen_type in (POSITIVE_INTEGER, STRING) and result != str(args[0])) or (
+            gen_type == ZERO and result != "0"
+        ):
+            logger.info(
+                "[green bold]Great![/] [green bold]{gen_name}[/] says "
+                "[yellow bold]{gen_type}[/]"
+                "[yellow]({args_repl})[/] can be [blue]{result}[/]".format(
+                    gen_type=gen_type,
+                    gen_name=rich_escape(gen.__name__),
+                    args_repl=rich_escape(", ".join(repr(arg) for arg in args)),
+                    result=rich_escape(result),
+                ),
+                extra={"markup": True, "highlighter": None},
+            )
+
+        elif gen_type in (
+            EVAL_FUNC,
+            EVAL,
+            CONFIG,
+            MODULE_OS,
+            OS_POPEN_OBJ,
+            OS_POPEN_READ,
+        ):
+            logger.info(
+                "[green bold]Great![/green bold] we generate "
+                "[yellow bold]{gen_type}[/yellow bold]"
+                "[yellow]({args_repl})[/yellow]".format(
+                    gen_type=gen_type,
+                    args_repl=rich_escape(", ".join(repr(arg) for arg in args)),
+                ),
+                extra={"markup": True, "highlighter": None},
+            )
+
+    def estimate_length(self, target: Target) -> float:
+        """估计生成目标对应payload的长度，无法生成时返回inf
+        只使用本地的信息（缓存，上下文等），不会调用WAF函数
+
+        没有长度预算时已经缓存的生成目标总是直接使用缓存，返回的是缓存结果的长度，
+        它不是这个生成目标所有可能结果长度的下界；有长度预算时超出预算的缓存结果会被
+        重新生成，所以只使用结构上的下界，保证剪枝不会去掉预算内的结果
+
+        Args:
+            target (Target): 生成目标
+
+        Returns:
+            float: payload长度的估计
+        """
+        kind = target[0]
+        if kind in (LITERAL, JINJA_CONTEXT_VAR, FLASK_CONTEXT_VAR):
+            return len(target[1])
+        if kind in (
+            WITH_CONTEXT_VAR,
+            REQUIRE_PYTHON3,
+            REQUIRE_PYTHON3_SUBVERSION,
+            REQUIRE_FLASK,
+            WHITESPACE,
+        ):
+            return 0
+        if kind == UNSATISFIED:
+            return float("inf")
+        if kind == EXPRESSION:
+            return self.estimate_targets_length(target[2])
+        if kind == ENCLOSE_UNDER:
+            return self.estimate_length(target[2])
+        if kind in (ENCLOSE, WRAP):
+            sub_targets = target[1] if isinstance(target[1], list) else [target[1]]
+            return self.estimate_targets_length(sub_targets) + 2
+        if kind == ONEOF:
+            return min(
+                (self.estimate_targets_length(req) for req in target[1]),
+                default=float("inf"),
+            )
+        if kind == GENERATED_EXPR:
+            result = self.generated_exprs.get(target[1])
+            return len(result[0]) if result else float("inf")
+        if kind == VARIABLE_OF:
+            self.record_context_dependency(context_value_dependency(target[1]))
+            return min(
+                (
+                    len(expr)
+                    for expr, (value, _) in self.context.items()
+                    if value == target[1]
+                ),
+                default=float("inf"),
+            )
+        if target in self.cache:
+            result = self.get_cached(target)
+            if result is None:
+                return float("inf")
+            if self.length_budget() is None:
+                return len(result[0])
+        if kind in (ATTRIBUTE, ITEM, CLASS_ATTRIBUTE):
+            # 至少需要`.a`或`[a]`之类的部分
+            return self.estimate_length(target[1]) + 2
+        return 1
+
+    def estimate_targets_length(self, targets: List[Target]) -> float:
+        """估计生成目标列表对应payload的长度，见estimate_length"""
+        return sum(self.estimate_length(target) for target in targets)
+
+    def estimate_targets_probes(self, targets: List[Target]) -> int:
+        """估计生成目标列表需要的WAF检测次数，每个没有缓存的非字面量目标算作一次
+
+        Args:
+            targets (List[Target]): 生成目标列表
+
+        Returns:
+            int: 估计的检测次数
+        """
+        probes = 1
+        for target in targets:
+            kind = target[0]
+            if kind in self.local_target_kinds:
+                continue
+            if kind == EXPRESSION:
+                probes += self.estimate_targets_probes(target[2])
+            elif kind == ONEOF:
+                probes += min(
+                    (self.estimate_targets_probes(req) for req in target[1]), default=0
+                )
+            elif target not in self.cache:
+                probes += 1
+        return probes
+
     def generate(self, gen_type, *args) -> Union[str, None]:
         """提供给用户的生成接口，接收一个生成目标的类型和参数
 
@@ -587,7 +2127,7 @@ class PayloadGenerator:
         Returns:
             Union[str, None]: 生成结果
         """
-        result = self.generate_by_list([(gen_type, *args)])
+        result = self.generate_detailed(gen_type, *args)
         if result is None:
             return None
         s, _, _ = result
@@ -600,14 +2140,626 @@ class PayloadGenerator:
             gen_type (str): 生成目标的类型
             *args: 生成目标的参数
 
+        Raises:
+            GenerationBudgetExhausted: 选项中的时间或WAF检测次数预算用完时仍然没有找到结果
+
         Returns:
-            Union[PayloadGeneratorResult, None]: 生成结果（包含使用的上下文变量）
+            Union[PayloadGeneratorResult, None]: 生成结果（包含使用的上下文变量），
+                预算用完时为已经找到的最好结果
         """
-        result = self.generate_by_list([(gen_type, *args)])
-        if result is None:
+        with self.budget_scope() as budget:
+            try:
+                result = self.run_engine_within_length(gen_type, *args)
+            except BudgetExhausted:
+                # 嵌套在外层的预算中时交给外层处理
+                if budget is None:
+                    raise
+                result = None
+        if budget is not None and budget.exhausted is not None:
+            if result is None:
+                raise self.budget_exhausted_error(budget)
+            logger.info(
+                "Generation budget exhausted (%s), using the best result found",
+                budget.exhausted,
+                extra={"highlighter": None},
+            )
+        return result
+
+    def run_engine_within_length(
+        self, gen_type, *args
+    ) -> Union[PayloadGeneratorResult, None]:
+        """在max_length内生成，无法生成时退回到不限制长度的生成结果
+
+        退回时使用的是搜索策略在不限制长度时找到的结果，first策略下是第一个通过WAF的
+        结果，不一定是最短的
+        """
+        pruned_hits = self.pruned_hits
+        result = self.run_engine(gen_type, *args)
+        if (
+            result is None
+            and self.pruned_hits != pruned_hits
+            and not self.budget_exhausted()
+        ):
+            # 超出长度预算时退回到不限制长度的生成结果
+            logger.warning(
+                "Cannot generate %s within %d characters, ignoring max_length",
+                gen_type,
+                self.max_length,
+                extra={"highlighter": None},
+            )
+            max_length, self.max_length = self.max_length, None
+            try:
+                result = self.run_engine(gen_type, *args)
+            finally:
+                self.max_length = max_length
+        return result
+
+    def run_engine(self, gen_type, *args) -> Union[PayloadGeneratorResult, None]:
+        """使用选项中的生成引擎生成一个生成目标"""
+        if self.options.generation_engine == GenerationEngine.ITERATIVE:
+            return self.create_task([(gen_type, *args)]).run()
+        return self.generate_by_list([(gen_type, *args)])
+
+    def rule_sub_targets(self, targets: List[Target], found: List[Target]):
+        """找出生成目标列表中需要使用规则生成的子目标，不会调用WAF函数
+
+        Args:
+            targets (List[Target]): 规则展开的结果
+            found (List[Target]): 找到的子目标会加入到这个列表中
+        """
+        stack = [targets]
+        while stack:
+            for target in stack.pop():
+                kind = target[0]
+                if kind == EXPRESSION:
+                    stack.append(target[2])
+                elif kind == ENCLOSE_UNDER:
+                    stack.append([target[2]])
+                elif kind in (ENCLOSE, WRAP):
+                    stack.append(
+                        target[1] if isinstance(target[1], list) else [target[1]]
+                    )
+                elif kind == ONEOF:
+                    stack.extend(target[1])
+                elif kind in expression_gens and kind not in target_handlers:
+                    found.append(target)
+
+    def first_rule_sub_targets(self, target: Target) -> List[Target]:
+        """按照规则的顺序展开生成目标，返回第一个可用规则中需要使用规则生成的子目标
+
+        Args:
+            target (Target): 生成目标
+
+        Returns:
+            List[Target]: 子目标
+        """
+        gens = expression_gens.get(target[0], [])[:]
+        self.order_rules(gens)
+        found: List[Target] = []
+        for gen in gens:
+            gen_ret = gen(self.context_view, *target[1:])
+            if not gen_ret or any(sub[0] == UNSATISFIED for sub in gen_ret):
+                continue
+            self.rule_sub_targets(gen_ret, found)
+            break
+        return found
+
+    def plan_shared_targets(
+        self, targets: List[Target], depth: int = 8
+    ) -> List[Target]:
+        """找出多个生成目标共同需要的子目标，按照依赖的顺序排列
+
+        每个生成目标只展开按顺序第一个可用的规则，也就是first策略最先尝试的规则，
+        避免事先生成实际上用不到的子目标
+
+        Args:
+            targets (List[Target]): 生成目标列表
+            depth (int, optional): 展开的层数
+
+        Returns:
+            List[Target]: 共享的子目标，被依赖的子目标排在前面
+        """
+        intern = self.cache.interner.intern
+        owners: DefaultDict[int, set] = defaultdict(set)
+        levels: Dict[int, Tuple[int, Target]] = {}
+        root_ids = {intern(target) for target in targets}
+        for index, root in enumerate(targets):
+            frontier, seen = [root], {intern(root)}
+            for level in range(depth):
+                next_frontier = []
+                for target in frontier:
+                    for sub in self.first_rule_sub_targets(target):
+                        sub_id = intern(sub)
+                        if sub_id in seen:
+                            continue
+                        seen.add(sub_id)
+                        owners[sub_id].add(index)
+                        if level >= levels.get(sub_id, (-1,))[0]:
+                            levels[sub_id] = (level, sub)
+                        next_frontier.append(sub)
+                frontier = next_frontier
+        shared = [
+            levels[sub_id]
+            for sub_id, indexes in owners.items()
+            if (len(indexes) > 1 or sub_id in root_ids)
+            and sub_id not in self.cache.cache
+        ]
+        # 展开层数更深的子目标更可能被其他子目标依赖，先生成
+        shared.sort(key=lambda item: item[0], reverse=True)
+        return [target for _, target in shared]
+
+    def iter_generate_many(
+        self, targets: Iterable[Target], plan_depth: int = 8
+    ) -> Iterator[BatchGenerationResult]:
+        """批量生成多个生成目标，每个目标生成完成之后立即返回其结果
+
+        生成之前会先生成多个目标共同需要的子目标，之后所有目标都会直接使用缓存中的结果
+
+        Args:
+            targets (Iterable[Target]): 生成目标列表
+            plan_depth (int, optional): 寻找共享子目标时展开的层数，为0时不寻找
+
+        Yields:
+            BatchGenerationResult: 按照输入的顺序返回每个生成目标的结果
+        """
+        targets = list(targets)
+        if plan_depth > 0 and len(targets) > 1:
+            start = time.perf_counter()
+            shared = self.plan_shared_targets(targets, plan_depth)
+            for target in shared:
+                try:
+                    self.generate_detailed(*target)
+                except GenerationBudgetExhausted:
+                    pass
+            logger.debug(
+                "Generated %d shared sub-targets in %.2fs",
+                len(shared),
+                time.perf_counter() - start,
+            )
+        for target in targets:
+            start = time.perf_counter()
+            try:
+                result = self.generate_detailed(*target)
+            except GenerationBudgetExhausted as exhausted:
+                yield BatchGenerationResult(
+                    target, None, time.perf_counter() - start, exhausted
+                )
+                continue
+            yield BatchGenerationResult(target, result, time.perf_counter() - start)
+
+    def generate_many(
+        self, targets: Iterable[Target], plan_depth: int = 8
+    ) -> List[BatchGenerationResult]:
+        """批量生成多个生成目标，参数见iter_generate_many
+
+        Returns:
+            List[BatchGenerationResult]: 每个生成目标的结果
+        """
+        return list(self.iter_generate_many(targets, plan_depth))
+
+    def create_task(self, targets: List[Target]) -> "GenerationTask":
+        """创建一个在显式的栈上运行的生成过程，其可以在等待WAF检测结果时暂停
+
+        Args:
+            targets (List[Target]): 生成目标的列表
+
+        Returns:
+            GenerationTask: 生成过程
+        """
+        return GenerationTask(self, targets)
+
+    # 以下是迭代式的生成引擎，和上面的递归实现有相同的语义
+    # 每个生成过程是一个python生成器，其通过yield向GenerationTask发出请求：
+    # ("call", 生成器): 运行另一个生成过程并取得其结果
+    # ("waf", payload列表): 所有payload都通过WAF时得到True
+    # ("prefetch", payload列表): 提前检测这些payload，结果会被之后的("waf", ...)使用
+
+    def iter_generate_by_list(self, targets: List[Target]):
+        """generate_by_list的迭代版本"""
+        targets = self.unwrap_whitespace(targets)
+        budget = self.length_budget()
+        if budget is not None:
+            bounds = [self.estimate_length(target) for target in targets]
+            remaining = sum(bounds)
+            if self.prune_length(0, remaining, budget):
+                return None
+        parts, contexts, tree = [], [], []
+        generated, committed = 0, 0
+        for i, target in enumerate(targets):
+            if budget is not None:
+                remaining -= bounds[i]
+                self.length_budget_stack().append(int(budget - committed - remaining))
+            try:
+                kind = target[0]
+                if kind in iterative_target_handlers:
+                    result = yield (
+                        "call",
+                        iterative_target_handlers[kind](self, target),
+                    )
+                elif kind in target_handlers:
+                    result = target_handlers[kind](self, target)
+                elif self.cached_within_budget(target):
+                    result = self.cache_generate(target)
+                else:
+                    result = yield ("call", self.iter_common_generate(target))
+            finally:
+                if budget is not None:
+                    self.length_budget_stack().pop()
+            if result is None:
+                return None
+            s, c, subs = result
+            parts.append(s)
+            if c:
+                contexts.append(c)
+            tree.append((target, subs))
+            if budget is not None:
+                generated += len(s)
+                committed = generated + self.contexts_length(contexts)
+                if self.prune_length(committed, remaining, budget):
+                    return None
+        str_result = "".join(parts)
+        passed = yield ("waf", [str_result])
+        if not passed:
             return None
+        return str_result, merge_used_context(contexts), tree
+
+    @iterative_target_handler(LITERAL)
+    def iter_literal_generate(self, target: LiteralTarget):
+        """literal_generate的迭代版本"""
+        words = literal_words(target[1])
+        if words:
+            passed = yield ("waf", words)
+            if not passed:
+                return None
+        return (target[1], {}, [])
+
+    @iterative_target_handler(EXPRESSION)
+    def iter_expression_generate(self, target: ExpressionTarget):
+        """expression_generate的迭代版本"""
+        result = yield ("call", self.iter_generate_by_list(target[2]))
+        return result
+
+    @iterative_target_handler(ENCLOSE_UNDER)
+    def iter_enclose_under_generate(self, target: EncloseUnderTarget):
+        """enclose_under_generate的迭代版本"""
+        result = yield ("call", self.iter_generate_by_list([target[2]]))
+        if not result:
+            return None
+        result_precedence = tree_precedence(result[2])
+        assert result_precedence is not None, result[0] + repr(result[2])
+        should_enclose = (
+            result_precedence <= target[1]
+            if result_precedence == precedence["mod"]
+            else result_precedence < target[1]
+        )
+        if should_enclose:
+            result = yield ("call", self.iter_generate_by_list([(ENCLOSE, target[2])]))
+        return result
+
+    @iterative_target_handler(ONEOF)
+    def iter_oneof_generate(self, target: OneofTarget):
+        """oneof_generate的迭代版本"""
+        _, alternative_targets = target
+        yield ("prefetch", self.collect_literal_probes(alternative_targets))
+        if self.options.search_strategy == SearchStrategy.BEST_FIRST:
+            best, budget = None, self.options.search_budget
+            for length, _, req in self.rank_alternatives(alternative_targets):
+                if length == float("inf"):
+                    break
+                if best is not None:
+                    if budget <= 0 or length >= len(best[0]):
+                        break
+                    budget -= 1
+                try:
+                    ret = yield ("call", self.iter_generate_by_list(req))
+                except BudgetExhausted:
+                    if best is None:
+                        raise
+                    break
+                if ret is not None and (best is None or len(ret[0]) < len(best[0])):
+                    best = ret
+            return best
+        for req in alternative_targets:
+            ret = yield ("call", self.iter_generate_by_list(req))
+            if ret is not None:
+                return ret
+        return None
+
+    @iterative_target_handler(VARIABLE_OF)
+    def iter_variable_of_generate(self, target: VariableOfTarget):
+        """variable_of_generate的迭代版本"""
+        self.record_context_dependency(context_value_dependency(target[1]))
+        targets_list: List[List[Target]] = [
+            [
+                (
+                    EXPRESSION,
+                    precedence_index,
+                    [(LITERAL, expr), (WITH_CONTEXT_VAR, expr)],
+                )
+            ]
+            for expr, (value, precedence_index) in self.context.items()
+            if value == target[1]
+        ]
+        if not targets_list:
+            return None
+        result = yield ("call", self.iter_generate_by_list([(ONEOF, targets_list)]))
+        return result
+
+    def iter_common_generate(self, gen_req: Target):
+        """common_generate的迭代版本，不支持speculative_workers，也不显示进度条"""
+        gen_type, *args = gen_req
+        if gen_type not in expression_gens or len(expression_gens[gen_type]) == 0:
+            raise RuntimeError(f"Unknown type: {gen_type}")
+        if self.pruned_by_length_failure(gen_req):
+            return None
+        if self.budget_exhausted():
+            raise BudgetExhausted()
+        best_first = (
+            self.options.search_strategy == SearchStrategy.BEST_FIRST
+            and len(self.generating) < self.best_first_max_depth
+        )
+        if best_first:
+            target_id = self.cache.interner.intern(gen_req)
+            if target_id in self.generating:
+                with self.used_count_lock:
+                    self.cycle_hits += 1
+                return None
+            self.generating.add(target_id)
+        failure_epoch = self.failure_epoch()
+
+        gens = expression_gens[gen_type].copy()
+        self.order_rules(gens)
+        self.push_dependency_frame()
+        deps = None
+        try:
+            with self.measure_target(gen_type) as record:
+                found = None
+                if best_first:
+                    candidates = self.rank_rules(gens, args)
+                    yield (
+                        "prefetch",
+                        self.collect_literal_probes([c[4] for c in candidates]),
+                    )
+                    budget = self.options.search_budget
+                    for _, _, length, gen, gen_ret in candidates:
+                        if found is not None:
+                            if budget <= 0:
+                                break
+                            if length >= len(found[2][0]):
+                                continue
+                            budget -= 1
+                        try:
+                            ret = yield ("call", self.iter_try_rule(gen, gen_ret))
+                        except BudgetExhausted:
+                            if found is None:
+                                raise
+                            break
+                        if ret is not None and (
+                            found is None or len(ret[0]) < len(found[2][0])
+                        ):
+                            found = (gen, gen_ret, ret)
+                else:
+                    if self.waf_func.batch_size > 1:
+                        expanded = [
+                            (gen, gen(self.context_view, *args)) for gen in gens
+                        ]
+                        yield (
+                            "prefetch",
+                            self.collect_literal_probes([ret for _, ret in expanded]),
+                        )
+                    else:
+                        expanded = (
+                            (gen, gen(self.context_view, *args)) for gen in gens
+                        )
+                    for gen, gen_ret in expanded:
+                        ret = yield ("call", self.iter_try_rule(gen, gen_ret))
+                        if ret is not None:
+                            found = (gen, gen_ret, ret)
+                            break
+                record.success = found is not None
+            deps = self.pop_dependency_frame()
+            return self.commit_generation(gen_req, found, deps, failure_epoch)
+        finally:
+            if deps is None:
+                self.pop_dependency_frame()
+            if best_first:
+                self.generating.discard(target_id)
+
+    def iter_try_rule(self, gen: ExpressionGenerator, gen_ret: List[Target]):
+        """try_rule的迭代版本"""
+        logger.debug("Trying gen rule: %s", gen.__name__)
+        try:
+            with self.measure_rule(gen) as record:
+                result = yield ("call", self.iter_generate_by_list(gen_ret))
+                record.success = result is not None
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Unknown error at {gen.__name__}") from e
         return result
 
     def delete_from_cache(self, gen_type, *args):
-        if (gen_type, *args) in self.cache_by_repr:
-            del self.cache_by_repr[(gen_type, *args)]
+        if (gen_type, *args) in self.cache:
+            del self.cache[(gen_type, *args)]
+
+
+class GenerationTask:
+    """在显式的栈上运行的生成过程，不会随着生成目标的嵌套而递归调用python函数
+    生成过程需要检测payload时会暂停，调用方可以使用任意方式（比如批量并发请求）
+    得到检测结果之后再继续运行：
+
+        task = payload_gen.create_task([(STRING, "abc")])
+        payloads = task.step()
+        while payloads is not None:
+            payloads = task.resume(waf.check_many(payloads))
+        result = task.result
+
+    同一个PayloadGenerator同时只应该运行一个GenerationTask
+    """
+
+    def __init__(self, payload_gen: PayloadGenerator, targets: List[Target]):
+        self.payload_gen = payload_gen
+        self.stack = [payload_gen.iter_generate_by_list(targets)]
+        self.result: Union[PayloadGeneratorResult, None] = None
+        self.done = False
+        # 批量检测没有收益时不会提前检测
+        self.prefetch = payload_gen.waf_func.batch_size > 1
+        self.pending: Union[Tuple[str, List[str]], None] = None
+        # 生成过程自己的依赖栈和统计栈，运行时替换掉当前线程的栈
+        self.frames: Dict[str, list] = {
+            "dependency": [],
+            "stats": [],
+            "length_budget": [],
+        }
+        self.send_value: Any = None
+        self.throw_value: Union[BaseException, None] = None
+
+    def step(self) -> Union[List[str], None]:
+        """运行生成过程，直到其需要WAF检测的结果
+
+        Returns:
+            Union[List[str], None]: 需要检测的payload，生成过程结束时返回None
+        """
+        if self.pending is not None:
+            raise RuntimeError("Please call .resume() with the verdicts first")
+        with self._task_frames():
+            return self._run_until_pending()
+
+    @contextmanager
+    def _task_frames(self):
+        states = [
+            (self.payload_gen.dependency_state, "frames", self.frames["dependency"]),
+            (self.payload_gen.stats_state, "stack", self.frames["stats"]),
+            (
+                self.payload_gen.length_budget_state,
+                "stack",
+                self.frames["length_budget"],
+            ),
+        ]
+        saved = [getattr(state, name, None) for state, name, _ in states]
+        for state, name, frames in states:
+            setattr(state, name, frames)
+        try:
+            yield
+        finally:
+            for (state, name, _), frames in zip(states, saved):
+                if frames is None:
+                    delattr(state, name)
+                else:
+                    setattr(state, name, frames)
+
+    def resume(self, verdicts: List[bool]) -> Union[List[str], None]:
+        """提供step返回的payload的检测结果，并继续运行生成过程
+
+        Args:
+            verdicts (List[bool]): 与payload一一对应的检测结果
+
+        Returns:
+            Union[List[str], None]: 下一批需要检测的payload，生成过程结束时返回None
+        """
+        if self.pending is None:
+            raise RuntimeError("There is no pending payload")
+        kind, payloads = self.pending
+        self.pending = None
+        with self._task_frames():
+            self.payload_gen.record_waf_calls(len(verdicts))
+        if kind == "waf":
+            self.send_value = all(verdicts)
+            if self.send_value:
+                self.payload_gen.record_passed(payloads)
+        else:
+            prefetched = self.payload_gen.prefetched_verdicts
+            if len(prefetched) > self.payload_gen.prefetched_verdicts_size:
+                prefetched.clear()
+            prefetched.update(zip(payloads, verdicts))
+        return self.step()
+
+    def run(self) -> Union[PayloadGeneratorResult, None]:
+        """使用PayloadGenerator的WAF函数运行生成过程直到结束
+
+        Returns:
+            Union[PayloadGeneratorResult, None]: 生成结果
+        """
+        payloads = self.step()
+        while payloads is not None:
+            kind, _ = self.pending
+            if kind == "waf":
+                verdicts = []
+                for payload in payloads:
+                    verdicts.append(self.payload_gen.waf_func(payload))
+                    if not verdicts[-1]:
+                        break
+            else:
+                waf_func = self.payload_gen.waf_func
+                verdicts = []
+                for i in range(0, len(payloads), waf_func.batch_size):
+                    verdicts += waf_func.check_many(
+                        payloads[i : i + waf_func.batch_size]
+                    )
+            payloads = self.resume(verdicts)
+        return self.result
+
+    def _run_until_pending(self) -> Union[List[str], None]:
+        while self.stack:
+            top = self.stack[-1]
+            try:
+                if self.throw_value is not None:
+                    exception, self.throw_value = self.throw_value, None
+                    request = top.throw(exception)
+                else:
+                    value, self.send_value = self.send_value, None
+                    request = top.send(value)
+            except StopIteration as e:
+                self.stack.pop()
+                self.send_value = e.value
+                continue
+            except Exception as e:  # pylint: disable=broad-except
+                self.stack.pop()
+                if not self.stack:
+                    raise
+                self.throw_value = e
+                continue
+            kind, argument = request
+            if kind == "call":
+                self.stack.append(argument)
+            elif kind == "waf":
+                payloads = self._unresolved(argument)
+                if payloads is None:
+                    self.send_value = False
+                elif payloads and self.payload_gen.budget_exhausted():
+                    self.throw_value = BudgetExhausted()
+                elif payloads:
+                    self.pending = (kind, payloads)
+                    return payloads
+                else:
+                    self.send_value = True
+            elif kind == "prefetch":
+                payloads = [
+                    payload
+                    for payload in dict.fromkeys(argument)
+                    if payload not in self.payload_gen.prefetched_verdicts
+                ]
+                if (
+                    self.prefetch
+                    and payloads
+                    and not self.payload_gen.budget_exhausted()
+                ):
+                    self.pending = (kind, payloads)
+                    return payloads
+            else:
+                raise RuntimeError(f"Unknown request: {kind}")
+        self.done = True
+        self.result = self.send_value
+        return None
+
+    def _unresolved(self, payloads: List[str]) -> Union[List[str], None]:
+        """使用提前检测的结果，返回还需要检测的payload，已知有payload无法通过时返回None"""
+        prefetched = self.payload_gen.prefetched_verdicts
+        unresolved = []
+        for payload in payloads:
+            if payload in prefetched:
+                if not prefetched.pop(payload):
+                    return None
+            elif payload not in self.payload_gen.passed_payloads:
+                unresolved.append(payload)
+        return unresolved
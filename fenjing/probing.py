@@ -0,0 +1,151 @@
+"""并发地发送互不依赖的探测请求
+
+WafFuncGen在检测WAF时会发送几百个互不依赖的请求，ProbeRunner使用有上限的线程池
+同时发送它们，并按照输入的顺序返回结果，让后续的统计和判断与逐个发送时相同。
+同一个主机上同时进行的请求数还会受到全局的限制，避免多个ProbeRunner一起压垮目标。
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, TypeVar, Union
+from urllib.parse import urlparse
+
+from .pbar import pbar_manager
+from .submitter import HTTPResponse, Submitter
+
+logger = logging.getLogger("probing")
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# 主机 -> (限制的请求数, 信号量)
+host_semaphores: Dict[str, tuple] = {}
+host_semaphores_lock = threading.Lock()
+
+
+def submitter_host(submitter: Submitter) -> Union[str, None]:
+    """取得submitter提交请求的主机
+
+    Args:
+        submitter (Submitter): submitter
+
+    Returns:
+        Union[str, None]: 主机，不是通过url提交时返回None
+    """
+    url = getattr(submitter, "url", None)
+    if not isinstance(url, str):
+        return None
+    return urlparse(url).netloc or None
+
+
+def host_semaphore(host: str, limit: int) -> threading.BoundedSemaphore:
+    """取得限制某个主机上同时进行的请求数的信号量，同一个主机和限制共享同一个信号量
+
+    Args:
+        host (str): 主机
+        limit (int): 同时进行的请求数
+
+    Returns:
+        threading.BoundedSemaphore: 信号量
+    """
+    with host_semaphores_lock:
+        entry = host_semaphores.get(host)
+        if entry is None or entry[0] != limit:
+            entry = (limit, threading.BoundedSemaphore(limit))
+            host_semaphores[host] = entry
+        return entry[1]
+
+
+class ProbeRunner:
+    """使用有上限的线程池发送探测请求，workers不大于1时和逐个发送完全相同"""
+
+    def __init__(
+        self,
+        submitter: Submitter,
+        workers: int = 1,
+        host_limit: Union[int, None] = None,
+    ):
+        """
+        Args:
+            submitter (Submitter): 发送请求的submitter，workers大于1时需要是线程安全的
+            workers (int, optional): 同时发送的请求数
+            host_limit (Union[int, None], optional): 同一个主机上同时进行的请求数，
+                所有ProbeRunner共享这个限制，为None时不限制
+        """
+        self.submitter = submitter
+        self.workers = max(1, workers)
+        self.semaphore = None
+        host = submitter_host(submitter)
+        if host_limit is not None and host is not None:
+            self.semaphore = host_semaphore(host, max(1, host_limit))
+
+    @contextmanager
+    def _host_slot(self):
+        if self.semaphore is None:
+            yield
+            return
+        with self.semaphore:
+            yield
+
+    @contextmanager
+    def _pbar(self, items: List, description: Union[str, None]):
+        if description is None:
+            yield items
+            return
+        with pbar_manager.pbar(items, description) as pbar:
+            yield pbar
+
+    def _call(self, func: Callable[[T], R], item: T) -> R:
+        with self._host_slot():
+            return func(item)
+
+    def map(
+        self,
+        func: Callable[[T], R],
+        items: Sequence[T],
+        description: Union[str, None],
+    ) -> List[R]:
+        """对每一项调用func，调用之间不能互相依赖
+
+        Args:
+            func (Callable[[T], R]): 进行探测的函数
+            items (Sequence[T]): 需要探测的项
+            description (Union[str, None]): 进度条的描述，为None时不显示进度条
+
+        Returns:
+            List[R]: 和items一一对应的结果
+        """
+        items = list(items)
+        with self._pbar(items, description) as pbar:
+            if self.workers <= 1 or len(items) <= 1:
+                return [self._call(func, item) for item in pbar]
+            results: List[R] = [None] * len(items)  # type: ignore
+            with ThreadPoolExecutor(
+                max_workers=min(self.workers, len(items)),
+                thread_name_prefix="fenjing-probe",
+            ) as executor:
+                futures = {
+                    executor.submit(self._call, func, item): i
+                    for i, item in enumerate(items)
+                }
+                for completed, future in enumerate(as_completed(futures), 1):
+                    results[futures[future]] = future.result()
+                    if description is not None:
+                        pbar.update(completed=completed)
+            return results
+
+    def submit_all(
+        self, payloads: Sequence[str], description: str
+    ) -> List[Union[HTTPResponse, None]]:
+        """提交一系列payload
+
+        Args:
+            payloads (Sequence[str]): payload
+            description (str): 进度条的描述
+
+        Returns:
+            List[Union[HTTPResponse, None]]: 和payloads一一对应的提交结果
+        """
+        return self.map(self.submitter.submit, payloads, description)
@@ -0,0 +1,194 @@
+"""分析响应中回显的payload有哪些部分被改写
+
+先找到payload在响应中最长的回显开头作为锚点，然后从锚点开始同时扫描payload和响应：
+相同的部分直接跳过，遇到不同时在一个固定大小的窗口中寻找payload后续内容重新出现的
+位置，两者之间的部分就是被删除或者替换的片段。相邻的两处改写会被合并到同一个片段中，
+所以最后还会在片段内部重新对齐，把它拆分成多个被改写的片段。
+
+定位锚点只需要O(log m)次str.find，比对回显区域时每个字符只需要常数次比较，
+片段内部的对齐只和MAX_PIECE有关，整个过程不递归，所以可以直接处理很大的页面。
+"""
+
+import html
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+# 锚点的最短长度，更短的回显可能只是巧合
+MIN_ANCHOR = 3
+# 重新对齐时使用的payload片段的长度
+RESYNC_ANCHOR = 4
+# 被改写的片段和替换之后内容的最大长度
+MAX_PIECE = 32
+
+
+class Replacement(NamedTuple):
+    """payload中被改写的一个片段"""
+
+    # payload中被改写的片段
+    piece: str
+    # 响应中对应的内容，被删除时为空字符串
+    replacement: str
+
+
+def longest_prefix_echo(resp_text: str, payload: str) -> int:
+    """找出payload在响应中出现的最长的开头
+
+    Args:
+        resp_text (str): HTTP响应正文
+        payload (str): payload
+
+    Returns:
+        int: 最长的开头的长度
+    """
+    # 更长的开头出现时更短的开头一定出现，所以可以二分查找
+    low, high = 0, len(payload)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if payload[:middle] in resp_text:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def split_span(piece: str, replacement: str) -> List[Replacement]:
+    """把重新对齐得到的一个片段拆分成多个被改写的片段
+
+    两处改写之间回显的内容比RESYNC_ANCHOR短时无法在它们之间重新对齐，两处改写
+    和中间回显的内容会被合并成一个片段，比如删除eval时"evalxeval"对应"x"。
+    这里在片段内部重新对齐，要求每个被改写的部分都被删除或者替换为同一个字符串，
+    并选择被改写的字符最少的方案，这样普通的替换(比如eval替换为hacker)不会被拆开
+
+    Args:
+        piece (str): payload中的片段
+        replacement (str): 响应中对应的内容
+
+    Returns:
+        List[Replacement]: 拆分之后的片段，无法拆分时只有原来的片段
+    """
+    n, m = len(piece), len(replacement)
+    # 只删除时回显的内容一定是片段的子序列
+    echoed = iter(piece)
+    markers = (
+        [""] if replacement and all(char in echoed for char in replacement) else []
+    )
+    markers += [
+        replacement[:size]
+        for size in range(1, m // 2 + 1)
+        if replacement.count(replacement[:size]) >= 2
+    ]
+    best_cost, best_blocks = (n, 1), [Replacement(piece, replacement)]
+    for marker in markers:
+        blocks = align_blocks(piece, replacement, marker)
+        if blocks is None:
+            continue
+        cost = (sum(len(block.piece) for block in blocks), len(blocks))
+        if cost < best_cost:
+            best_cost, best_blocks = cost, blocks
+    return best_blocks
+
+
+def align_blocks(
+    piece: str, replacement: str, marker: str
+) -> Union[List[Replacement], None]:
+    """在片段内部对齐，被改写的部分都替换为marker，其余部分原样回显
+
+    Args:
+        piece (str): payload中的片段
+        replacement (str): 响应中对应的内容
+        marker (str): 被改写的部分替换之后的内容
+
+    Returns:
+        Union[List[Replacement], None]: 被改写的字符最少的方案，无法对齐时返回None
+    """
+    n, m, size = len(piece), len(replacement), len(marker)
+    infinity = (n + 1, n + 1)
+    # free[i][j]: 对齐piece[i:]和replacement[j:]的最小代价(被改写的字符数, 改写次数)
+    # echo[i][j]: 同上，但是下一个字符必须是回显的，避免两次改写直接相连
+    free = [[infinity] * (m + 1) for _ in range(n + 1)]
+    echo = [[infinity] * (m + 1) for _ in range(n + 1)]
+    choice: Dict[Tuple[int, int], int] = {}
+    free[n][m] = echo[n][m] = (0, 0)
+    for i in range(n - 1, -1, -1):
+        for j in range(m, -1, -1):
+            if j < m and piece[i] == replacement[j]:
+                echo[i][j] = free[i + 1][j + 1]
+            free[i][j] = echo[i][j]
+            if not replacement.startswith(marker, j):
+                continue
+            for end in range(i + 1, n + 1):
+                deleted, count = echo[end][j + size]
+                cost = (deleted + end - i, count + 1)
+                if cost < free[i][j]:
+                    free[i][j], choice[(i, j)] = cost, end
+    if free[0][0] == infinity:
+        return None
+    blocks, i, j, after_block = [], 0, 0, False
+    while i < n:
+        if after_block or free[i][j] == echo[i][j]:
+            i, j, after_block = i + 1, j + 1, False
+        else:
+            end = choice[(i, j)]
+            blocks.append(Replacement(piece[i:end], marker))
+            i, j, after_block = end, j + size, True
+    return blocks
+
+
+def find_replacements(resp_text: str, payload: str) -> List[Replacement]:
+    """对比HTTP响应和payload，找出回显中被删除或者替换的片段
+
+    payload末尾无法重新对齐的部分可能只是被截断，不会被当作被改写的片段，
+    HTML转义导致的变化也会被忽略
+
+    Args:
+        resp_text (str): HTTP响应正文
+        payload (str): payload
+
+    Returns:
+        List[Replacement]: 按照在payload中的顺序排列的被改写的片段
+    """
+    anchor = longest_prefix_echo(resp_text, payload)
+    if anchor < MIN_ANCHOR or anchor == len(payload):
+        return []
+    i, j = anchor, resp_text.find(payload[:anchor]) + anchor
+    result: List[Replacement] = []
+    while i < len(payload):
+        if j < len(resp_text) and payload[i] == resp_text[j]:
+            i, j = i + 1, j + 1
+            continue
+        # 寻找payload中跳过piece_size个字符之后的内容在响应中最近的位置
+        best = None
+        for piece_size in range(min(MAX_PIECE, len(payload) - i - 1) + 1):
+            start = i + piece_size
+            resync = payload[start : start + RESYNC_ANCHOR]
+            position = resp_text.find(resync, j, j + MAX_PIECE + len(resync))
+            if position == -1:
+                continue
+            cost = piece_size + position - j
+            if best is None or cost < best[0]:
+                best = (cost, piece_size, position)
+        if best is None:
+            # 剩下的部分没有回显，可能是被截断了
+            break
+        _, piece_size, position = best
+        piece, replacement = payload[i : i + piece_size], resp_text[j:position]
+        if piece and html.unescape(replacement) != piece:
+            result += [
+                block
+                for block in split_span(piece, replacement)
+                if html.unescape(block.replacement) != block.piece
+            ]
+        i, j = i + piece_size, position
+    return result
+
+
+def find_replaced_pieces(resp_text: str, payload: str) -> List[str]:
+    """从HTTP响应的正文和对应的payload中分析出可能被替换的关键字
+
+    Args:
+        resp_text (str): HTTP响应正文
+        payload (str): payload
+
+    Returns:
+        List[str]: 可能被替换的关键字
+    """
+    return [replacement.piece for replacement in find_replacements(resp_text, payload)]
@@ -6,6 +6,7 @@ import traceback
 import time
 import socket
 import ssl
+import threading
 import re
 import warnings
 import urllib3
@@ -129,6 +130,8 @@ class TCPRequester:
         self.interval = interval
         self.retry_times = retry_times
         self.last_request_time: Union[float, None] = None
+        # 多个线程同时发送请求时保证请求之间的间隔
+        self.interval_lock = threading.Lock()
 
     def _get_socket(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -160,11 +163,12 @@ class TCPRequester:
         return data
 
     def _request_once(self, request: bytes):
-        if self.last_request_time:
-            duration = time.perf_counter() - self.last_request_time
-            if duration < self.interval:
-                time.sleep(self.interval - duration)
-        self.last_request_time = time.perf_counter()
+        with self.interval_lock:
+            if self.last_request_time:
+                duration = time.perf_counter() - self.last_request_time
+                if duration < self.interval:
+                    time.sleep(self.interval - duration)
+            self.last_request_time = time.perf_counter()
 
         try:
             sock = self._get_socket()
@@ -263,6 +267,8 @@ class HTTPRequester:
         self.session.headers.update({"User-Agent": user_agent})
         self.session.verify = not no_verify_ssl
         self.last_request_time = 0
+        # 多个线程同时发送请求时保证请求之间的间隔
+        self.interval_lock = threading.Lock()
         self.extra_params = {}
         self.extra_data = {}
 
@@ -291,9 +297,12 @@ class HTTPRequester:
         Returns:
             Union[Response, None]: 返回的响应
         """
-        duration = time.perf_counter() - self.last_request_time
-        if duration < self.interval:
-            time.sleep(self.interval - duration)
+        # 在锁内等待并占用发送的时间，其他线程的请求会在这之后至少间隔interval
+        with self.interval_lock:
+            duration = time.perf_counter() - self.last_request_time
+            if duration < self.interval:
+                time.sleep(self.interval - duration)
+            self.last_request_time = time.perf_counter()
 
         if "timeout" not in kwargs:
             kwargs["timeout"] = self.timeout
@@ -333,7 +342,8 @@ class HTTPRequester:
                 extra={"markup": True, "highlighter": None},
             )
 
-        self.last_request_time = time.perf_counter()
+        with self.interval_lock:
+            self.last_request_time = max(self.last_request_time, time.perf_counter())
         return resp
 
     def request(self, **kwargs):
@@ -0,0 +1,244 @@
+"""基于相似度的响应指纹
+
+WafFuncGen原本比较响应正文的hash，页面中任何动态的内容(CSRF token，时间戳等)
+都会让同一个WAF页面得到不同的hash。这里先把响应中看起来是动态生成的内容替换掉，
+再去掉大多数响应共有的页面模板(相同的开头和结尾)，只对中间变化的部分按照字符的
+shingle计算64位的SimHash。SimHash对重复的内容不敏感，所以指纹中还记录了内容的长度，
+长度接近并且SimHash的汉明距离不超过阈值的两个指纹被认为是同一个页面。
+
+指纹是普通的整数(长度 << 64 | SimHash)，可以保存到文件中，页面模板需要和指纹一起保存。
+"""
+
+import hashlib
+import os
+import re
+from typing import Iterable, List, Tuple
+
+# 看起来是动态生成的内容：UUID，hex和base64形式的token，时间和日期，以及很长的数字
+# 回显的payload中也可能含有数字，所以只替换数字比较多或者同时含有大小写字母和数字的内容
+DYNAMIC_TOKEN_RE = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    + r"|(?=[a-fA-F]*[0-9])(?=[0-9]*[a-fA-F])[0-9a-fA-F]{16,}"
+    + r"|(?=(?:[a-z0-9+/_=-]*[A-Z]){2})(?=(?:[A-Z0-9+/_=-]*[a-z]){2})"
+    + r"(?=(?:[A-Za-z+/_=-]*[0-9]){2})[A-Za-z0-9+/_=-]{20,}"
+    + r"|[0-9]{4}-[0-9]{2}-[0-9]{2}|[0-9]{1,2}:[0-9]{2}(?::[0-9]{2})?"
+    + r"|[0-9]{8,}"
+)
+SHINGLE_SIZE = 3
+FINGERPRINT_BITS = 64
+# 两个页面的内容长度最多相差的比例，以及较短的页面最多相差的字符数
+LENGTH_RATIO = 0.1
+LENGTH_SLACK = 2
+
+
+def normalize(text: str) -> str:
+    """替换掉响应中动态生成的内容
+
+    Args:
+        text (str): 响应正文
+
+    Returns:
+        str: 替换之后的正文
+    """
+    return DYNAMIC_TOKEN_RE.sub("\0", text)
+
+
+def simhash(text: str) -> int:
+    """计算文本的64位SimHash
+
+    Args:
+        text (str): 文本
+
+    Returns:
+        int: 64位的SimHash
+    """
+    if len(text) <= SHINGLE_SIZE:
+        shingles = [text]
+    else:
+        shingles = [
+            text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)
+        ]
+    # 每个shingle的hash写成二进制字符串，按列统计为1的数量，比逐位计算快得多
+    rows = [
+        format(
+            int.from_bytes(
+                hashlib.blake2b(
+                    shingle.encode(errors="surrogatepass"), digest_size=8
+                ).digest(),
+                "big",
+            ),
+            "064b",
+        )
+        for shingle in shingles
+    ]
+    result = 0
+    for bit, column in enumerate(zip(*rows)):
+        if column.count("1") * 2 > len(rows):
+            result |= 1 << (FINGERPRINT_BITS - 1 - bit)
+    return result
+
+
+def common_affix(texts: List[str], reverse: bool = False) -> str:
+    """大多数文本共有的最长的开头(或结尾)
+
+    排序之后共有同一个开头的文本是连续的，所以只需要比较每个窗口的第一个和最后一个文本
+
+    Args:
+        texts (List[str]): 互不相同的文本
+        reverse (bool, optional): 为True时求结尾
+
+    Returns:
+        str: 至少一半(并且至少两个)的文本共有的开头(或结尾)
+    """
+    if len(texts) < 2:
+        return ""
+    if reverse:
+        return common_affix([text[::-1] for text in texts])[::-1]
+    texts = sorted(texts)
+    window = max(2, (len(texts) + 1) // 2)
+    return max(
+        (
+            os.path.commonprefix([texts[i], texts[i + window - 1]])
+            for i in range(len(texts) - window + 1)
+        ),
+        key=len,
+    )
+
+
+def distance(a: int, b: int) -> int:
+    """两个指纹的SimHash之间的汉明距离
+
+    Args:
+        a (int): 指纹
+        b (int): 指纹
+
+    Returns:
+        int: 汉明距离
+    """
+    return bin((a ^ b) & ((1 << FINGERPRINT_BITS) - 1)).count("1")
+
+
+class ResponseFingerprinter:
+    """计算和比较响应的指纹"""
+
+    def __init__(self, threshold: int = 3, template: Tuple[str, str] = ("", "")):
+        """
+        Args:
+            threshold (int, optional): 认为两个指纹相同的最大汉明距离
+            template (Tuple[str, str], optional): 页面模板的开头和结尾
+        """
+        self.threshold = threshold
+        self.template = template
+
+    def learn_template(self, texts: Iterable[str]):
+        """从一系列响应中学习页面模板，即大多数不同的页面共有的开头和结尾
+
+        WAF页面通常和正常的页面完全不同，所以只使用大多数页面共有的部分作为模板
+
+        Args:
+            texts (Iterable[str]): 响应正文，需要至少两种不同的页面
+        """
+        # 只有一种页面时无法区分模板和内容，不去掉任何内容
+        normalized = list(set(normalize(text) for text in texts))
+        if len(normalized) < 2:
+            self.template = ("", "")
+            return
+        prefix = common_affix(normalized)
+        suffix = common_affix(
+            [text[len(prefix) :] for text in normalized if text.startswith(prefix)],
+            reverse=True,
+        )
+        self.template = (prefix, suffix)
+
+    def strip_template(self, text: str) -> str:
+        """去掉响应中的页面模板和动态生成的内容
+
+        Args:
+            text (str): 响应正文
+
+        Returns:
+            str: 剩下的部分
+        """
+        text = normalize(text)
+        prefix, suffix = self.template
+        if prefix and text.startswith(prefix):
+            text = text[len(prefix) :]
+        if suffix and text.endswith(suffix):
+            text = text[: len(text) - len(suffix)]
+        return text
+
+    def fingerprint(self, text: str) -> int:
+        """计算响应的指纹
+
+        Args:
+            text (str): 响应正文
+
+        Returns:
+            int: 指纹
+        """
+        content = self.strip_template(text)
+        return len(content) << FINGERPRINT_BITS | simhash(content)
+
+    def similar(self, a: int, b: int) -> bool:
+        """两个指纹是否是同一个页面
+
+        Args:
+            a (int): 指纹
+            b (int): 指纹
+
+        Returns:
+            bool: 是否相同
+        """
+        length_a, length_b = a >> FINGERPRINT_BITS, b >> FINGERPRINT_BITS
+        if abs(length_a - length_b) > max(
+            LENGTH_SLACK, max(length_a, length_b) * LENGTH_RATIO
+        ):
+            return False
+        return distance(a, b) <= self.threshold
+
+    def matches(self, fingerprint: int, fingerprints: Iterable[int]) -> bool:
+        """指纹是否和一系列指纹中的某一个相同
+
+        Args:
+            fingerprint (int): 指纹
+            fingerprints (Iterable[int]): 一系列指纹
+
+        Returns:
+            bool: 是否相同
+        """
+        return any(self.similar(fingerprint, other) for other in fingerprints)
+
+    def clusters(self, fingerprints: Iterable[int]) -> List[Tuple[int, int]]:
+        """将相同的指纹归为一类
+
+        Args:
+            fingerprints (Iterable[int]): 一系列指纹
+
+        Returns:
+            List[Tuple[int, int]]: 每一类第一个指纹和这一类的数量
+        """
+        result: List[Tuple[int, int]] = []
+        for fingerprint in fingerprints:
+            for i, (representative, count) in enumerate(result):
+                if self.similar(fingerprint, representative):
+                    result[i] = (representative, count + 1)
+                    break
+            else:
+                result.append((fingerprint, 1))
+        return result
+
+    def frequent(self, fingerprints: Iterable[int], min_count: int = 2) -> List[int]:
+        """出现了至少min_count次的指纹
+
+        Args:
+            fingerprints (Iterable[int]): 一系列指纹
+            min_count (int, optional): 最少出现的次数
+
+        Returns:
+            List[int]: 每一类中第一个出现的指纹
+        """
+        return [
+            representative
+            for representative, count in self.clusters(fingerprints)
+            if count >= min_count
+        ]
@@ -0,0 +1,162 @@
+"""跨运行持久化的规则排序
+
+记录每个规则成功和失败的次数以及尝试时消耗的WAF检测次数，并按照成功概率
+从大到小排列规则，概率相同时先尝试检测开销小的规则。
+统计数据保存在本地的JSON文件中，读取时会按照距离上次保存的时间进行指数衰减，
+让过时的统计数据逐渐失去影响。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+logger = logging.getLogger("rule_ordering")
+
+
+@dataclass
+class RuleRecord:
+    """一个规则的历史统计数据，衰减之后可以是小数"""
+
+    successes: float = 0.0
+    failures: float = 0.0
+    waf_calls: float = 0.0
+
+
+class RuleOrdering:
+    """学习到的规则排序，可以通过Options.rule_ordering传给PayloadGenerator"""
+
+    file_version = 1
+    # 没有历史数据时假设的成功和失败次数
+    prior_successes = 1.0
+    prior_failures = 1.0
+
+    def __init__(
+        self,
+        path: Union[str, Path, None] = None,
+        half_life: float = 7 * 24 * 3600,
+    ):
+        """
+        Args:
+            path (Union[str, Path, None], optional): 保存统计数据的文件，为None时不保存
+            half_life (float, optional): 统计数据衰减一半所需的秒数，默认为7天
+        """
+        self.path = Path(path) if path is not None else None
+        self.half_life = half_life
+        self.rules: Dict[str, RuleRecord] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls, path: Union[str, Path], half_life: float = 7 * 24 * 3600
+    ) -> "RuleOrdering":
+        """从文件中读取统计数据，文件不存在或者损坏时返回空的统计数据
+
+        Args:
+            path (Union[str, Path]): 保存统计数据的文件
+            half_life (float, optional): 统计数据衰减一半所需的秒数
+
+        Returns:
+            RuleOrdering: 读取到的规则排序
+        """
+        ordering = cls(path, half_life)
+        assert ordering.path is not None
+        if not ordering.path.exists():
+            return ordering
+        try:
+            data = json.loads(ordering.path.read_text())
+            if data.get("version") != cls.file_version:
+                raise ValueError(f"Unsupported version {data.get('version')!r}")
+            elapsed = max(0.0, time.time() - float(data["saved_at"]))
+            ordering.rules = {
+                name: RuleRecord(**record) for name, record in data["rules"].items()
+            }
+        except (ValueError, KeyError, TypeError) as exc:
+            logger.warning(
+                "Ignoring broken rule stats file %s: %r",
+                ordering.path.as_posix(),
+                exc,
+            )
+            ordering.rules = {}
+            return ordering
+        ordering.decay(elapsed)
+        return ordering
+
+    def save(self, path: Union[str, Path, None] = None):
+        """将统计数据保存到文件中
+
+        Args:
+            path (Union[str, Path, None], optional): 保存的文件，默认为读取时的文件
+        """
+        output_path = Path(path) if path is not None else self.path
+        if output_path is None:
+            raise ValueError("No path to save the rule stats")
+        with self.lock:
+            data = {
+                "version": self.file_version,
+                "saved_at": time.time(),
+                "rules": {name: asdict(record) for name, record in self.rules.items()},
+            }
+        # 先写入临时文件再替换，避免中途退出时损坏已有的统计数据
+        temp_path = output_path.with_name(output_path.name + ".tmp")
+        temp_path.write_text(json.dumps(data, indent=2))
+        os.replace(temp_path, output_path)
+
+    def decay(self, elapsed: float):
+        """按照经过的时间衰减所有统计数据
+
+        Args:
+            elapsed (float): 经过的秒数
+        """
+        if self.half_life <= 0:
+            return
+        factor = 0.5 ** (elapsed / self.half_life)
+        with self.lock:
+            for record in self.rules.values():
+                record.successes *= factor
+                record.failures *= factor
+                record.waf_calls *= factor
+
+    def record(self, rule: str, success: bool, waf_calls: int):
+        """记录一次规则的尝试
+
+        Args:
+            rule (str): 规则的名字
+            success (bool): 是否成功
+            waf_calls (int): 尝试期间进行的WAF检测次数
+        """
+        with self.lock:
+            record = self.rules.get(rule)
+            if record is None:
+                record = self.rules[rule] = RuleRecord()
+            if success:
+                record.successes += 1
+            else:
+                record.failures += 1
+            record.waf_calls += waf_calls
+
+    def score(self, rule: str) -> Tuple[float, float]:
+        """规则的得分，先比较估计的成功概率，概率相同时比较每次尝试的WAF检测次数
+
+        WAF检测次数包括了规则展开后的子目标的检测次数，成功的规则往往因此显得昂贵，
+        所以只用它区分成功概率相同的规则，而不是直接用概率除以开销
+
+        Args:
+            rule (str): 规则的名字
+
+        Returns:
+            Tuple[float, float]: 得分，越大越应该先尝试
+        """
+        record = self.rules.get(rule)
+        if record is None:
+            record = RuleRecord()
+        attempts = record.successes + record.failures
+        probability = (record.successes + self.prior_successes) / (
+            attempts + self.prior_successes + self.prior_failures
+        )
+        cost = (record.waf_calls + 1) / (attempts + 1)
+        return probability, -cost
@@ -1,19 +1,26 @@
-import random
 import string
 
 # pylint: disable=wildcard-import,unused-wildcard-import,missing-function-docstring,unused-argument
-from ..rules_utils import targets_from_pattern
+from ..rules_utils import targets_from_pattern, context_random
 from ..payload_gen import expression_gen, precedence
 
 from ..const import *
 
 
-def randomcase(s):
-    return "".join(c.lower() if random.random() < 0.5 else c.upper() for c in s)
+def randomcase(s, context=None):
+    rule_random = context_random(context)
+    return "".join(c.lower() if rule_random.random() < 0.5 else c.upper() for c in s)
 
 
-brainrot_varname = random.choice(BRAINROT_VARNAMES)
-is_brainrot_enabled = random.random() < 0.5
+def brainrot_varname(context):
+    """每个PayloadGenerator随机决定是否使用brainrot变量名以及使用哪一个，不使用时返回None"""
+    rule_random = context_random(context)
+    varname = rule_random.decide(
+        "brainrot_varname", lambda rng: rng.choice(BRAINROT_VARNAMES)
+    )
+    enabled = rule_random.decide("brainrot_enabled", lambda rng: rng.random() < 0.5)
+    return varname if enabled else None
+
 
 var_attrs = [
     (FLASK_CONTEXT_VAR, "g", "pop"),
@@ -34,7 +41,8 @@ var_attrs = [
 
 @expression_gen
 def gen_builtins_dict_brainrot(context):
-    if not is_brainrot_enabled:
+    varname = brainrot_varname(context)
+    if varname is None:
         return [(UNSATISFIED,)]
     return [
         (
@@ -42,7 +50,7 @@ def gen_builtins_dict_brainrot(context):
             (
                 EXPRESSION,
                 precedence["attribute"],
-                [(LITERAL, brainrot_varname + ".__eq__")],
+                [(LITERAL, varname + ".__eq__")],
             ),
             (ATTRIBUTE, "__globals__"),
             (ITEM, "__builtins__"),
@@ -52,7 +60,8 @@ def gen_builtins_dict_brainrot(context):
 
 @expression_gen
 def gen_builtins_dict_brainrot2(context):
-    if not is_brainrot_enabled:
+    varname = brainrot_varname(context)
+    if varname is None:
         return [(UNSATISFIED,)]
     return [
         (
@@ -62,7 +71,7 @@ def gen_builtins_dict_brainrot2(context):
                 precedence["called_filter"],
                 targets_from_pattern(
                     "NAME|attr(EQ)",
-                    {"NAME": (LITERAL, brainrot_varname), "EQ": (STRING, "__eq__")},
+                    {"NAME": (LITERAL, varname), "EQ": (STRING, "__eq__")},
                 ),
             ),
             (ATTRIBUTE, "__globals__"),
@@ -104,8 +113,9 @@ def gen_builtins_dict_varattrs(context):
 
 @expression_gen
 def gen_builtins_dict_undefined(context):
+    rule_random = context_random(context)
     funcs_attrs = [
-        ("".join(random.choices(string.ascii_lowercase, k=3)), "__eq__")
+        ("".join(rule_random.choices(string.ascii_lowercase, k=3)), "__eq__")
         for _ in range(10)
     ]
     alternatives = [
@@ -253,7 +263,8 @@ def gen_config_self(context):
 def gen_module_os_brainrotsys(context):
     # [] cannot used for undefined
     # e['__eq__'] would raise exception
-    if not is_brainrot_enabled:
+    varname = brainrot_varname(context)
+    if varname is None:
         return [(UNSATISFIED,)]
     brainrot_var = (
         ONEOF,
@@ -262,7 +273,7 @@ def gen_module_os_brainrotsys(context):
                 (
                     EXPRESSION,
                     precedence["attribute"],
-                    [(LITERAL, brainrot_varname + ".__eq__")],
+                    [(LITERAL, varname + ".__eq__")],
                 )
             ],
             [
@@ -271,7 +282,7 @@ def gen_module_os_brainrotsys(context):
                     precedence["called_filter"],
                     targets_from_pattern(
                         "NAME|attr(EQ)",
-                        {"NAME": (LITERAL, brainrot_varname), "EQ": (STRING, "__eq__")},
+                        {"NAME": (LITERAL, varname), "EQ": (STRING, "__eq__")},
                     ),
                 )
             ],
@@ -3,6 +3,7 @@ from typing import (
     Any,
     Callable,
     Mapping,
+    Sequence,
     Tuple,
     List,
     Tuple,
@@ -19,7 +20,7 @@ if sys.version_info >= (3, 8):
     EncloseUnderTarget = Tuple[Literal["enclose_under"], int, "Target"]
     EncloseTarget = Tuple[Literal["enclose"], "Target"]
     UnsatisfiedTarget = Tuple[Literal["unsatisfied"],]
-    OneofTarget = Tuple[Literal["oneof"], List[List["Target"]]]
+    OneofTarget = Tuple[Literal["oneof"], Sequence[List["Target"]]]
     GeneratedExprTarget = Tuple[Literal["generated_expr"], "Target"]
     ListifyTarget = Tuple[Literal["listify"], "Target"]
 
@@ -1,9 +1,15 @@
+from collections.abc import Sequence as SequenceABC
 from typing import (
+    Any,
+    Callable,
     List,
     Dict,
+    Tuple,
     Union,
 )
+import random
 import re
+import threading
 
 from .const import *
 from .rules_types import Target
@@ -176,9 +182,94 @@ def transform_int_chars_unicode(int_chars):
     ]
 
 
+class WhitespaceAlternatives(SequenceABC):
+    """unwrap_whitespace产生的oneof备选项，将target_list中的whitespace target依次替换为
+    WHITESPACES_AND_EMPTY中的每一个空白字符
+    备选项只会在被访问时生成，生成之后会被保存，重复遍历时不会再分配新的列表
+    """
+
+    __slots__ = ("target_list", "alternatives")
+
+    def __init__(self, target_list: List[Target]):
+        self.target_list = target_list
+        self.alternatives: List[Union[List[Target], None]] = [None] * len(
+            WHITESPACES_AND_EMPTY
+        )
+
+    def __len__(self):
+        return len(self.alternatives)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        alternative = self.alternatives[index]
+        if alternative is None:
+            whitespace = (LITERAL, WHITESPACES_AND_EMPTY[index])
+            alternative = [
+                whitespace if target == (WHITESPACE,) else target
+                for target in self.target_list
+            ]
+            self.alternatives[index] = alternative
+        return alternative
+
+    def __eq__(self, other):
+        if isinstance(other, WhitespaceAlternatives):
+            return self.target_list == other.target_list
+        return isinstance(other, list) and list(self) == other
+
+    # 和list一样不可哈希
+    __hash__ = None  # type: ignore
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class RuleRandom(random.Random):
+    """规则使用的随机数生成器，每个PayloadGenerator有一个，通过上下文传给规则
+    除了普通的随机数之外，还可以记住只需要决定一次的随机选择
+    """
+
+    def __init__(self, seed=None):
+        super().__init__(seed)
+        self.decisions: Dict[str, Any] = {}
+        self.decisions_lock = threading.Lock()
+
+    def decide(self, name: str, choose: Callable[["RuleRandom"], Any]) -> Any:
+        """进行一次只需要决定一次的随机选择，之后返回相同的结果
+
+        Args:
+            name (str): 选择的名字
+            choose (Callable[[RuleRandom], Any]): 进行选择的函数
+
+        Returns:
+            Any: 选择的结果
+        """
+        with self.decisions_lock:
+            if name not in self.decisions:
+                self.decisions[name] = choose(self)
+            return self.decisions[name]
+
+
+# 没有设置seed，或者上下文不是PayloadGenerator提供的时候(比如直接调用规则)使用的随机数生成器
+default_rule_random = RuleRandom()
+
+
+def context_random(context) -> RuleRandom:
+    """取得规则使用的随机数生成器
+
+    Args:
+        context (Mapping): 传给规则的上下文
+
+    Returns:
+        RuleRandom: 随机数生成器
+    """
+    rule_random = getattr(context, "random", None)
+    return rule_random if rule_random is not None else default_rule_random
+
+
 def unwrap_whitespace(target_list: List[Target]) -> List[Target]:
     """替换target_list中的whitespace target为实际的literal
-    会被payloadgen调用而不是被expression_gen调用
+    会被payloadgen调用而不是被expression_gen调用，其中的备选项按需生成
 
     Args:
         target_list (List[Target]): 输入的target list
@@ -188,16 +279,41 @@ def unwrap_whitespace(target_list: List[Target]) -> List[Target]:
     """
     if all(target != (WHITESPACE,) for target in target_list):
         return target_list
-    alternatives = []
-    for whitespace in WHITESPACES_AND_EMPTY:
-        alternative = []
-        for target in target_list:
-            if target == (WHITESPACE,):
-                alternative.append((LITERAL, whitespace))
-            else:
-                alternative.append(target)
-        alternatives.append(alternative)
-    return [(ONEOF, alternatives)]
+    return [(ONEOF, WhitespaceAlternatives(target_list))]
+
+
+class WhitespaceUnwrapper:
+    """带缓存的unwrap_whitespace，同一个target_list对象会得到同一个结果
+    每个PayloadGenerator有一个，可以在多个线程中使用
+    """
+
+    def __init__(self, size: int = 10000):
+        """
+        Args:
+            size (int, optional): 最多缓存的结果数量，超过时清空缓存
+        """
+        # id(target_list) -> (target_list, 结果)，保存target_list的引用以防止id被复用
+        self.cache: Dict[int, Tuple[List[Target], List[Target]]] = {}
+        self.size = size
+        self.lock = threading.Lock()
+
+    def __call__(self, target_list: List[Target]) -> List[Target]:
+        with self.lock:
+            entry = self.cache.get(id(target_list))
+            if entry is not None and entry[0] is target_list:
+                return entry[1]
+        result = unwrap_whitespace(target_list)
+        if result is target_list:
+            return result
+        with self.lock:
+            # 其他线程可能同时处理了同一个target_list，使用先保存的结果
+            entry = self.cache.get(id(target_list))
+            if entry is not None and entry[0] is target_list:
+                return entry[1]
+            if len(self.cache) >= self.size:
+                self.cache.clear()
+            self.cache[id(target_list)] = (target_list, result)
+        return result
 
 
 def removeprefix_string(text: str, prefix: str) -> str:
@@ -3,7 +3,9 @@
 import logging
 import subprocess
 import html
+import hashlib
 import re
+import types
 
 from contextlib import contextmanager
 from pathlib import Path
@@ -59,9 +61,64 @@ def shell_tamperer(shell_cmd: str) -> Tamperer:
             )
         return out
 
+    setattr(tamperer, "tamperer_key", f"shell:{shell_cmd}")
     return tamperer
 
 
+def internal_tamperer(tamperer: Tamperer) -> Tamperer:
+    """标记fenjing内部根据检测结果添加的tamperer，这类tamperer不参与tamperers_key
+
+    Args:
+        tamperer (Tamperer): 需要标记的tamperer
+
+    Returns:
+        Tamperer: 标记后的tamperer
+    """
+    setattr(tamperer, "tamperer_internal", True)
+    return tamperer
+
+
+def tamperer_key(tamperer: Tamperer) -> str:
+    """生成tamperer的键，同一个tamperer在不同的运行之间的键相同
+
+    shell tamperer使用其命令，其他tamperer使用名字和字节码
+
+    Args:
+        tamperer (Tamperer): tamperer
+
+    Returns:
+        str: 键
+    """
+    key = getattr(tamperer, "tamperer_key", None)
+    if key is not None:
+        return key
+    name = getattr(tamperer, "__qualname__", type(tamperer).__qualname__)
+    name = f"{getattr(tamperer, '__module__', '')}.{name}"
+    code = getattr(tamperer, "__code__", None)
+    if code is None:
+        return name
+    # 嵌套的code object的repr中有内存地址，不能用来生成键
+    consts = [c for c in code.co_consts if not isinstance(c, types.CodeType)]
+    digest = hashlib.sha256(code.co_code + repr(consts).encode()).hexdigest()
+    return f"{name}:{digest[:16]}"
+
+
+def tamperers_key(tamperers: List[Tamperer]) -> List[str]:
+    """生成一组tamperer的键，忽略fenjing内部添加的tamperer
+
+    Args:
+        tamperers (List[Tamperer]): tamperer列表
+
+    Returns:
+        List[str]: 每个tamperer的键
+    """
+    return [
+        tamperer_key(tamperer)
+        for tamperer in tamperers
+        if not getattr(tamperer, "tamperer_internal", False)
+    ]
+
+
 def update_content_length(request: bytes) -> bytes:
     """更新请求体长度
 
@@ -0,0 +1,136 @@
+"""使用Aho-Corasick自动机在线性时间内查找一系列子串
+
+添加子串之后自动机会在下一次查找时重新构建，查找的时间只和文本的长度有关，
+和子串的数量无关。
+"""
+
+from collections import deque
+from typing import Dict, Iterable, List, Union
+
+
+class SubstringMatcher:
+    """查找文本中包含了哪些给定的子串"""
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.patterns: List[str] = []
+        self._pattern_set = set()
+        # 自动机的状态：goto表，失配指针，以及到达该状态时匹配到的子串(包括后缀)
+        self._goto: List[Dict[str, int]] = []
+        self._fail: List[int] = []
+        self._output: List[List[str]] = []
+        self._dirty = True
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __contains__(self, pattern: str):
+        return pattern in self._pattern_set
+
+    def add(self, pattern: str) -> bool:
+        """添加一个子串
+
+        Args:
+            pattern (str): 子串，不能为空
+
+        Returns:
+            bool: 子串之前是否不存在
+        """
+        if not pattern:
+            raise ValueError("Pattern should not be empty")
+        if pattern in self._pattern_set:
+            return False
+        self.patterns.append(pattern)
+        self._pattern_set.add(pattern)
+        self._dirty = True
+        return True
+
+    def remove(self, pattern: str) -> bool:
+        """删除一个子串
+
+        Args:
+            pattern (str): 子串
+
+        Returns:
+            bool: 子串之前是否存在
+        """
+        if pattern not in self._pattern_set:
+            return False
+        self.patterns.remove(pattern)
+        self._pattern_set.remove(pattern)
+        self._dirty = True
+        return True
+
+    def _build(self):
+        goto: List[Dict[str, int]] = [{}]
+        output: List[List[str]] = [[]]
+        for pattern in self.patterns:
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append(pattern)
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                if fail[next_state] == next_state:
+                    fail[next_state] = 0
+                output[next_state] = output[next_state] + output[fail[next_state]]
+        self._goto, self._fail, self._output = goto, fail, output
+        self._dirty = False
+
+    def _scan(self, text: str, first_only: bool) -> List[str]:
+        if self._dirty:
+            self._build()
+        goto, fail, output = self._goto, self._fail, self._output
+        found: List[str] = []
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                if first_only:
+                    return output[state][:1]
+                found.extend(output[state])
+        return found
+
+    def search(self, text: str) -> Union[str, None]:
+        """查找文本中的第一个子串
+
+        Args:
+            text (str): 文本
+
+        Returns:
+            Union[str, None]: 最先结束的子串，没有时返回None
+        """
+        if not self.patterns:
+            return None
+        found = self._scan(text, first_only=True)
+        return found[0] if found else None
+
+    def findall(self, text: str) -> List[str]:
+        """查找文本中出现的所有子串，不重复
+
+        Args:
+            text (str): 文本
+
+        Returns:
+            List[str]: 出现的子串，按照结束的位置排序
+        """
+        if not self.patterns:
+            return []
+        return list(dict.fromkeys(self._scan(text, first_only=False)))
@@ -0,0 +1,204 @@
+"""保存WAF函数对每个payload的判断，可以在多个线程和进程之间共享
+
+判断按照命名空间分开保存，WafFuncGen使用目标的位置和WAF的特征作为命名空间，
+所以同一个进程中的多个任务(比如webui的多个任务线程或者mcp_server的多个会话)，
+以及使用同一个SQLite文件的多个进程，在检测同一个目标时可以共享已经得到的判断。
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+logger = logging.getLogger("verdict_store")
+
+
+class VerdictStore:
+    """保存WAF判断的基类，子类需要是线程安全的"""
+
+    def get(self, namespace: str, payload: str) -> Union[bool, None]:
+        """取得保存的判断
+
+        Args:
+            namespace (str): 命名空间
+            payload (str): payload
+
+        Returns:
+            Union[bool, None]: payload能否通过WAF，没有保存时返回None
+        """
+        raise NotImplementedError()
+
+    def put(self, namespace: str, payload: str, verdict: bool):
+        """保存判断
+
+        Args:
+            namespace (str): 命名空间
+            payload (str): payload
+            verdict (bool): payload能否通过WAF
+        """
+        raise NotImplementedError()
+
+
+class DictVerdictStore(VerdictStore):
+    """直接使用一个dict保存判断，忽略命名空间，比如WafProfile中的判断"""
+
+    def __init__(self, verdicts: Union[Dict[str, bool], None] = None):
+        self.verdicts = verdicts if verdicts is not None else {}
+
+    def get(self, namespace: str, payload: str) -> Union[bool, None]:
+        return self.verdicts.get(payload)
+
+    def put(self, namespace: str, payload: str, verdict: bool):
+        self.verdicts[payload] = verdict
+
+
+class MemoryVerdictStore(VerdictStore):
+    """在内存中保存最近使用的判断"""
+
+    def __init__(self, maxsize: int = 200000, ttl: Union[float, None] = None):
+        """
+        Args:
+            maxsize (int, optional): 最多保存的判断数量
+            ttl (Union[float, None], optional): 判断的有效期，单位为秒，为None时不会过期
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # (命名空间, payload) -> (判断, 保存的时间)
+        self.verdicts: "OrderedDict[Tuple[str, str], Tuple[bool, float]]" = (
+            OrderedDict()
+        )
+        self.lock = threading.Lock()
+
+    def get(self, namespace: str, payload: str) -> Union[bool, None]:
+        key = (namespace, payload)
+        with self.lock:
+            entry = self.verdicts.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self.verdicts[key]
+                return None
+            self.verdicts.move_to_end(key)
+            return entry[0]
+
+    def put(self, namespace: str, payload: str, verdict: bool):
+        with self.lock:
+            self.verdicts[(namespace, payload)] = (verdict, time.time())
+            self.verdicts.move_to_end((namespace, payload))
+            while len(self.verdicts) > self.maxsize:
+                self.verdicts.popitem(last=False)
+
+
+class SqliteVerdictStore(VerdictStore):
+    """在SQLite文件中保存判断，多个进程可以同时读写同一个文件
+
+    数据库使用WAL模式和内存映射读取，每个线程使用单独的连接，
+    最近使用的判断还会缓存在内存中
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        ttl: Union[float, None] = 7 * 24 * 3600,
+        memory_size: int = 50000,
+    ):
+        """
+        Args:
+            path (Union[str, Path]): SQLite文件
+            ttl (Union[float, None], optional): 判断的有效期，单位为秒，为None时不会过期
+            memory_size (int, optional): 在内存中缓存的判断数量
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.memory = MemoryVerdictStore(memory_size, ttl)
+        self.local = threading.local()
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            + "namespace TEXT NOT NULL, payload TEXT NOT NULL, "
+            + "verdict INTEGER NOT NULL, created_at REAL NOT NULL, "
+            + "PRIMARY KEY (namespace, payload)) WITHOUT ROWID"
+        )
+
+    def connection(self) -> sqlite3.Connection:
+        """当前线程使用的连接
+
+        Returns:
+            sqlite3.Connection: 连接
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path.as_posix(), timeout=30, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA mmap_size=67108864")
+            self.local.connection = connection
+        return connection
+
+    def get(self, namespace: str, payload: str) -> Union[bool, None]:
+        verdict = self.memory.get(namespace, payload)
+        if verdict is not None:
+            return verdict
+        try:
+            row = (
+                self.connection()
+                .execute(
+                    "SELECT verdict, created_at FROM verdicts "
+                    + "WHERE namespace = ? AND payload = ?",
+                    (namespace, payload),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as exc:
+            logger.warning("Failed to read verdict store: %r", exc)
+            return None
+        if row is None:
+            return None
+        if self.ttl is not None and time.time() - row[1] > self.ttl:
+            return None
+        verdict = bool(row[0])
+        self.memory.put(namespace, payload, verdict)
+        return verdict
+
+    def put(self, namespace: str, payload: str, verdict: bool):
+        self.memory.put(namespace, payload, verdict)
+        try:
+            self.connection().execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+                (namespace, payload, int(verdict), time.time()),
+            )
+        except sqlite3.Error as exc:
+            logger.warning("Failed to write verdict store: %r", exc)
+
+
+class ChainedVerdictStore(VerdictStore):
+    """依次从多个位置读取判断，并将判断写入所有位置
+
+    比如同时使用WafProfile中的判断和共享的判断，在一个位置找到的判断会被补充到
+    它之前的位置中
+    """
+
+    def __init__(self, *stores: VerdictStore):
+        self.stores = stores
+
+    def get(self, namespace: str, payload: str) -> Union[bool, None]:
+        for i, store in enumerate(self.stores):
+            verdict = store.get(namespace, payload)
+            if verdict is not None:
+                for previous in self.stores[:i]:
+                    previous.put(namespace, payload, verdict)
+                return verdict
+        return None
+
+    def put(self, namespace: str, payload: str, verdict: bool):
+        for store in self.stores:
+            store.put(namespace, payload, verdict)
+
+
+# 同一个进程中的webui任务和mcp_server会话共享的判断
+# 长时间运行时目标的WAF可能会变化，所以判断只在一段时间内有效
+shared_verdict_store = MemoryVerdictStore(ttl=3600)
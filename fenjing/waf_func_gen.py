@@ -2,16 +2,16 @@
 
 """
 
+import hashlib
+import json
 import logging
 import random
 import string
-import traceback
 import time
 import re
 
 from copy import copy
-from collections import Counter, namedtuple
-from functools import lru_cache
+from collections import namedtuple
 from typing import Dict, Callable, Tuple, Union, List, Sequence
 from rich.markup import escape as rich_escape
 
@@ -20,155 +20,177 @@ from .const import (
     DetectMode,
     ReplacedKeywordStrategy,
     DetectWafKeywords,
+    BannedSubstringLearning,
     DANGEROUS_KEYWORDS,
     RENDER_ERROR_KEYWORDS,
     WafFunc,
 )
-from .submitter import Submitter
+from .submitter import Submitter, internal_tamperer, tamperers_key
 from .options import Options
 from .pbar import pbar_manager
+from .probing import ProbeRunner
+from .group_testing import find_banned, group_size
+from .waf_profile import WafProfile, WafProfileStore, endpoint_of
+from .verdict_store import VerdictStore, DictVerdictStore, ChainedVerdictStore
+from .response_fingerprint import ResponseFingerprinter
+from .replacement_diff import find_replaced_pieces
+from .keyword_matcher import KeywordMatcher
+from .waf_oracle import BatchWafFunc, LearnedBlacklistWaf, ensure_batch_waf
 
 logger = logging.getLogger("waf_func_gen")
 Result = namedtuple("Result", "payload_generate_func input_field")
 
-dangerous_keywords = copy(DANGEROUS_KEYWORDS)
+# 足够简单的payload，目标没有完全回显时可以确定被waf了
+SIMPLE_PAYLOAD_RE = re.compile(r"^[a-zA-Z0-9-_'\"!%=\+\-\*\/\[\], .()]+$")
+# 合并检测时分隔payload的随机字符串的长度
+PACKED_SEPARATOR_LENGTH = 6
+# 合并检测时每次交给WAF函数检测的payload数量
+PACKED_BATCH_SIZE = 32
+# 还没有合并检测过时每次合并的payload数量
+PACKED_INITIAL_SIZE = 16
+JINJA_DELIMITERS = ["{{", "}}", "{%", "%}", "{#", "#}"]
 
-random.shuffle(dangerous_keywords)
+dangerous_keywords = copy(DANGEROUS_KEYWORDS)
 
 
-def grouped_payloads(size=3, sep="") -> List[str]:
+def grouped_payloads(
+    size=3, sep="", keywords: Union[List[str], None] = None
+) -> List[str]:
     """将所有payload按照size个一组拼接在一起
     即：['a', 'b', 'c', 'd'] -> ['ab', 'cd']
 
     Args:
         size (int, optional): 拼接的size. Defaults to 3.
+        keywords (Union[List[str], None], optional): 需要拼接的payload，默认为所有危险的关键字
 
     Returns:
         List[str]: 拼接结果
     """
+    if keywords is None:
+        keywords = dangerous_keywords
     return [
-        sep.join(dangerous_keywords[i : i + size])  # flake8: noqa
-        for i in range(0, len(dangerous_keywords), size)
+        sep.join(keywords[i : i + size])  # flake8: noqa
+        for i in range(0, len(keywords), size)
     ]
 
 
-def removeprefix_string(text: str, prefix: str) -> str:
-    """兼容python 3.9及以下的removeprefix函数
+def self_contained(payload: str) -> bool:
+    """payload是否不会和拼接在一起的其他payload组成新的模板语法
 
     Args:
-        text (str): text
-        prefix (str): 需要去除的prefix
+        payload (str): payload
 
     Returns:
-        str: 处理结果
+        bool: 是否可以和其他payload合并检测
     """
-    if text.startswith(prefix):
-        return text[len(prefix) :]
-    return text
+    for start, end in [("{{", "}}"), ("{%", "%}")]:
+        if payload.startswith(start) and payload.endswith(end) and len(payload) >= 4:
+            payload = payload[2:-2]
+            break
+    return not any(delimiter in payload for delimiter in JINJA_DELIMITERS)
 
 
-def get_next_p(b: str) -> List[int]:
-    """KMP算法中，获取字符串B的next数组的算法过程
+def pack_payloads(
+    payloads: Sequence[str], max_length: int, separator_length: int, max_count: int
+) -> List[List[str]]:
+    """将payload分组，每组和分隔符拼接之后的长度不超过max_length
 
     Args:
-        b (str): 字符串B，KMP匹配的目标
+        payloads (Sequence[str]): payload
+        max_length (int): 拼接之后的最大长度，单个payload超出时单独作为一组
+        separator_length (int): 分隔符的长度
+        max_count (int): 每组最多的payload数量
 
     Returns:
-        List[int]: next数组，定义与KMP相同
+        List[List[str]]: 分组的结果
     """
-    answer = []
-    for i, c in enumerate(b):
-        if i == 0:
-            answer.append(-1)
-            continue
-        p = answer[i - 1]
-        while p >= 0 and b[p + 1] != c:
-            assert answer[p] < p
-            p = answer[p]
-
-        if c == b[p + 1]:
-            answer.append(p + 1)
-        else:
-            answer.append(p)
-    return answer
+    packs: List[List[str]] = []
+    current: List[str] = []
+    length = separator_length
+    for payload in payloads:
+        if current and (
+            length + len(payload) + separator_length > max_length
+            or len(current) >= max_count
+        ):
+            packs.append(current)
+            current, length = [], separator_length
+        current.append(payload)
+        length += len(payload) + separator_length
+    if current:
+        packs.append(current)
+    return packs
 
 
-def kmp(a: str, b: str) -> Tuple[int, Union[int, None]]:
-    """KMP算法，在A中寻找B的最长匹配子串
+def split_packed_echo(text: str, separators: List[str]) -> List[Union[str, None]]:
+    """从响应中按照顺序找出每两个分隔符之间的回显
 
     Args:
-        a (str): KMP中的字符串A
-        b (str): KMP中的字符串B
+        text (str): 响应正文
+        separators (List[str]): 分隔符，比payload多一个
 
     Returns:
-        Tuple[int, Union[int, None]]: 最长匹配子串的结尾长度和位置
+        List[Union[str, None]]: 每个payload的回显，分隔符没有回显时为None
     """
-    logger.debug("kmp(len(a)=%d, len(b)=%d)", len(a), len(b))
-    if b == "":
-        return 0, None
-    next_p = get_next_p(b)
-    max_answer, max_answer_pos = 0, None
-    j = -1
-    for i, c in enumerate(a):
-        while j >= 0 and b[j + 1] != c:
-            assert next_p[j] < j
-            j = next_p[j]
-        if c == b[j + 1]:
-            j += 1
-        if j + 1 > max_answer:
-            max_answer = j + 1
-            max_answer_pos = i
-
-        if j == len(b) - 1:
-            j = -1
-        logger.debug("%d, %s, %d", i, c, j)
-    return max_answer, max_answer_pos
-
-
-def find_pieces(resp_text, payload):
-    """从HTTP响应的正文和对应的payload中分析出可能被替换的关键字
+    echoes: List[Union[str, None]] = []
+    position = 0
+    for left, right in zip(separators, separators[1:]):
+        start = text.find(left, position)
+        end = text.find(right, start + len(left)) if start != -1 else -1
+        if end == -1:
+            echoes.append(None)
+            continue
+        echoes.append(text[start + len(left) : end])
+        position = end
+    return echoes
 
-    Args:
-        resp_text (str): HTTP响应正文
-        payload (str): payload
 
-    Returns:
-        List[str]: 可能被替换的关键字
-    """
-    assert len(resp_text) < 1e5 and len(payload) < 1e5  # perf limit
-    logger.debug("find_pieces(%s, %s)", resp_text[:20], payload[:20])
-    max_answer, max_answer_pos = kmp(resp_text, payload)
-    logger.debug("%d, %s", max_answer, str(max_answer_pos))
-    if max_answer <= 2 or max_answer_pos is None:
-        logger.debug("max answer too low")
-        return []
-
-    resp_text_matched = resp_text[max_answer_pos - max_answer + 1 : max_answer_pos + 1]
-    resp_text_unmatched, payload_unmatched = (
-        resp_text[max_answer_pos + 1 :],
-        payload[len(resp_text_matched) :],
-    )
-    if payload_unmatched == "":
-        logger.debug("read payload done")
-        return []
+class PackedProbeWaf(BatchWafFunc):
+    """批量检测时把多个payload合并到同一个请求中的WAF函数"""
 
-    max_answer_unmatched, max_answer_pos_unmatched = kmp(
-        payload_unmatched, resp_text_unmatched
-    )
+    batch_size = PACKED_BATCH_SIZE
 
-    if max_answer_pos_unmatched is None:
-        return []
+    def __init__(
+        self,
+        waf_func: WafFunc,
+        check_many_func: Callable[[Sequence[str]], List[bool]],
+    ):
+        """
+        Args:
+            waf_func (WafFunc): 检测单个payload的WAF函数
+            check_many_func (Callable[[Sequence[str]], List[bool]]): 合并检测多个payload的函数
+        """
+        self.waf_func = waf_func
+        self.check_many_func = check_many_func
 
-    payload_unmatched_before = payload_unmatched[
-        : max_answer_pos_unmatched - max_answer_unmatched + 1
-    ]
-    resp_text_next = removeprefix_string(resp_text_unmatched, payload_unmatched_before)
-    payload_next = removeprefix_string(payload_unmatched, payload_unmatched_before)
+    def __call__(self, payload: str) -> bool:
+        return self.waf_func(payload)
 
-    assert len(resp_text_next) < len(resp_text) and len(payload_next) < len(payload)
-    return [
-        payload_unmatched_before,
-    ] + find_pieces(resp_text_next, payload_next)
+    def check_many(self, payloads: Sequence[str]) -> List[bool]:
+        return self.check_many_func(payloads)
+
+
+class ConcurrentProbeWaf(BatchWafFunc):
+    """批量检测时并发发送检测请求的WAF函数"""
+
+    def __init__(self, waf_func: WafFunc, probe_runner: ProbeRunner):
+        """
+        Args:
+            waf_func (WafFunc): 检测单个payload的WAF函数，需要是线程安全的
+            probe_runner (ProbeRunner): 并发发送请求的ProbeRunner
+        """
+        self.waf_func = waf_func
+        self.probe_runner = probe_runner
+        self.batch_size = probe_runner.workers
+
+    def __call__(self, payload: str) -> bool:
+        return self.waf_func(payload)
+
+    def check_many(self, payloads: Sequence[str]) -> List[bool]:
+        pending = list(dict.fromkeys(payloads))
+        verdicts = dict(
+            zip(pending, self.probe_runner.map(self.waf_func, pending, None))
+        )
+        return [verdicts[payload] for payload in payloads]
 
 
 def combine_waf(waf_funcs):
@@ -178,6 +200,28 @@ def combine_waf(waf_funcs):
     return new_waf_func
 
 
+def learn_banned_substrings(waf_func: WafFunc, options: Options) -> BatchWafFunc:
+    """按照选项在WAF函数前加上学习被禁止子串的一层
+
+    Args:
+        waf_func (WafFunc): WAF函数
+        options (Options): 选项
+
+    Returns:
+        BatchWafFunc: 包装后的WAF函数
+    """
+    if options.banned_substring_learning == BannedSubstringLearning.DISABLED:
+        return ensure_batch_waf(waf_func)
+    return LearnedBlacklistWaf(
+        waf_func,
+        verify_interval=(
+            LearnedBlacklistWaf.default_verify_interval
+            if options.banned_substring_learning == BannedSubstringLearning.VERIFY
+            else 0
+        ),
+    )
+
+
 class KeywordWafFuncGen:
     """
     根据指定的关键字生成对应的WAF函数
@@ -193,6 +237,7 @@ class KeywordWafFuncGen:
     ):
         self.submitter = submitter
         self.keywords = keywords
+        self.matcher = KeywordMatcher(keywords)
         self.callback: Callable[[str, Dict], None] = (
             callback if callback else (lambda x, y: None)
         )
@@ -200,9 +245,7 @@ class KeywordWafFuncGen:
 
     def _waf(self, payload: str):
         result = self.submitter.submit(payload)
-        return result is not None and all(
-            keyword not in result[1] for keyword in self.keywords
-        )
+        return result is not None and self.matcher.search(result[1]) is None
 
     def generate(self) -> WafFunc:
         return self._waf
@@ -211,7 +254,7 @@ class KeywordWafFuncGen:
 class WafFuncGen:
     """
     根据指定的Submitter(表单submitter或者路径submitter)生成对应的WAF函数
-    其会使用一系列经常被waf的payload进行测试，然后根据返回页面的哈希判断其他payload是否被waf
+    其会使用一系列经常被waf的payload进行测试，然后根据返回页面的指纹判断其他payload是否被waf
     """
 
     def __init__(
@@ -225,21 +268,34 @@ class WafFuncGen:
             callback if callback else (lambda x, y: None)
         )
         self.options = options if options else Options()
+        # 生成随机内容以及打乱关键字顺序使用的随机数生成器
+        self.random = random.Random(self.options.component_seed("waf_func_gen"))
+        self.dangerous_keywords = copy(dangerous_keywords)
+        self.random.shuffle(self.dangerous_keywords)
+        # 并发发送检测WAF时互不依赖的请求
+        self.probe_runner = ProbeRunner(
+            submitter,
+            workers=self.options.probe_workers,
+            host_limit=self.options.probe_host_limit,
+        )
+        self.waf_page_probe: Union[Tuple[str, int], None] = None
+        # 计算响应的指纹，忽略页面模板和动态生成的内容
+        self.fingerprinter = ResponseFingerprinter()
 
     def waf_page_hash(self) -> List[int]:
-        """使用危险的payload测试对应的input，得到一系列响应后，求出响应中最常见的几个hash
+        """使用危险的payload测试对应的input，得到一系列响应后，求出响应中最常见的几个指纹
 
         Returns:
-            List[int]: payload被waf后页面对应的hash
+            List[int]: payload被waf后页面对应的指纹
         """
         test_keywords = None
         if self.options.detect_mode == DetectMode.ACCURATE:
             test_keywords = [
                 "{{PAYLOAD}}PAYLOAD".replace("PAYLOAD", word)
-                for word in grouped_payloads(2)  # + dangerous_keywords
+                for word in grouped_payloads(2, keywords=self.dangerous_keywords)
             ] + [
                 wrapper.replace("PAYLOAD", word)
-                for word in grouped_payloads(8)
+                for word in grouped_payloads(8, keywords=self.dangerous_keywords)
                 for wrapper in [
                     "PAYLOAD",
                     "PAYLOADPAYLOAD",
@@ -251,75 +307,88 @@ class WafFuncGen:
         else:
             test_keywords = (
                 wrapper.replace("PAYLOAD", word)
-                for word in grouped_payloads(4)
+                for word in grouped_payloads(4, keywords=self.dangerous_keywords)
                 for wrapper in [
                     "PAYLOADPAYLOAD",
                     "{{PAYLOAD}}PAYLOAD",
                 ]
             )
-        hashes: List[int] = []
-        with pbar_manager.pbar(list(test_keywords), "waf_page_hash") as test_keywords:
-            for keyword in test_keywords:
-                result = self.subm.submit(keyword)
-                if result is None:
-                    logger.info(
-                        "Submit [yellow]failed[/] for [yellow]%s[/]",
-                        rich_escape(repr(keyword)),
-                        extra={"markup": True, "highlighter": None},
-                    )
-                    continue
-                status_code, text = result
-                logger.debug(
-                    "Fuzzing waf page hash [yellow]%s[/] with response [blue]%s[/]",
+        texts: List[Tuple[str, str]] = []
+        test_keywords = list(test_keywords)
+        results = self.probe_runner.submit_all(test_keywords, "waf_page_hash")
+        for keyword, result in zip(test_keywords, results):
+            if result is None:
+                logger.info(
+                    "Submit [yellow]failed[/] for [yellow]%s[/]",
                     rich_escape(repr(keyword)),
-                    repr(text) if len(text) < 100 else repr(text[:100]) + "......",
                     extra={"markup": True, "highlighter": None},
                 )
-                if status_code == 500 and "Internal Server Error" in text:
-                    continue
-                hashes.append(hash(text))
-
-        return [k for k, v in Counter(hashes).items() if v >= 2]
+                continue
+            status_code, text = result
+            logger.debug(
+                "Fuzzing waf page hash [yellow]%s[/] with response [blue]%s[/]",
+                rich_escape(repr(keyword)),
+                repr(text) if len(text) < 100 else repr(text[:100]) + "......",
+                extra={"markup": True, "highlighter": None},
+            )
+            if status_code == 500 and "Internal Server Error" in text:
+                continue
+            texts.append((keyword, text))
+
+        # 所有响应共有的开头和结尾是页面模板，计算指纹时去掉
+        self.fingerprinter.learn_template(text for _, text in texts)
+        probes = [
+            (keyword, self.fingerprinter.fingerprint(text)) for keyword, text in texts
+        ]
+        waf_hashes = self.fingerprinter.frequent(h for _, h in probes)
+        # 记录一个触发了waf页面的payload，用于之后确认保存的检测结果仍然有效
+        self.waf_page_probe = next(
+            (
+                (keyword, h)
+                for keyword, h in probes
+                if self.fingerprinter.matches(h, waf_hashes)
+            ),
+            None,
+        )
+        return waf_hashes
 
     def long_param_hash(self) -> List[int]:
         """测试目标是否会waf过长的payload
 
         Returns:
-            List[int]: 过长payload页面的hash
+            List[int]: 过长payload页面的指纹
         """
         logger.info("Fuzzing long payloads...", extra={"highlighter": None})
         keywords = [
-            "".join(random.choices(string.ascii_lowercase, k=5)) * 40 for _ in range(20)
+            "".join(self.random.choices(string.ascii_lowercase, k=5)) * 40
+            for _ in range(20)
         ]
         hashes = []
-        with pbar_manager.pbar(keywords, "long_param_hash") as keywords:
-            for keyword in keywords:
-                result = self.subm.submit(keyword)
-                if result is None:
-                    logger.info(
-                        "Submit failed, continue",
-                        extra={"highlighter": None},
-                    )
-                    continue
-                status_code, text = result
-                if status_code == 500:
-                    continue
-                hashes.append(hash(text))
-        hashes_uniq = list(set(hashes))
-        if len(hashes_uniq) <= 3:
+        for result in self.probe_runner.submit_all(keywords, "long_param_hash"):
+            if result is None:
+                logger.info(
+                    "Submit failed, continue",
+                    extra={"highlighter": None},
+                )
+                continue
+            status_code, text = result
+            if status_code == 500:
+                continue
+            hashes.append(self.fingerprinter.fingerprint(text))
+        if len(self.fingerprinter.clusters(hashes)) <= 3:
             logger.warning(
                 "[red bold]WAF ban long payloads[/]!, maybe you should try `--eval-args-payload`"
                 + " option to generate shorter payload.",
                 extra={"markup": True, "highlighter": None},
             )
             time.sleep(2)
-        return [k for k, v in Counter(hashes).items() if v >= 2]
+        return self.fingerprinter.frequent(hashes)
 
     def waf_keywords(self, waf_hashes: List[int]) -> List[str]:
         """根据Waf的hashes求出会被waf的keyword
 
         Args:
-            waf_hashes (List[int]): waf页面的hash
+            waf_hashes (List[int]): waf页面的指纹
 
         Returns:
             List[str]: 找到的被waf的keyword
@@ -343,7 +412,9 @@ class WafFuncGen:
                 status, text = result
                 if status == 500:
                     continue
-                if hash(text) in waf_hashes:
+                if self.fingerprinter.matches(
+                    self.fingerprinter.fingerprint(text), waf_hashes
+                ):
                     return False
             return True
 
@@ -369,24 +440,31 @@ class WafFuncGen:
                         )
 
         for _ in range(10):
-            kw = "".join(random.choices(string.ascii_lowercase, k=4))
+            kw = "".join(self.random.choices(string.ascii_lowercase, k=4))
             if keyword_passed(kw):
                 wrappers.append(kw + "PAYLOAD")
                 break
 
-        # we decide to test every keyword by batches
-        size = int(len(dangerous_keywords) ** 0.3) + 1
-        with pbar_manager.pbar(
-            range(0, len(dangerous_keywords), size), "waf_keywords"
-        ) as it:
-            for i in it:
-                l = dangerous_keywords[i : i + size]
-                random.shuffle(l)
-                if keyword_passed("".join(l)):
-                    continue
-                for word in l:
-                    if not keyword_passed(word):
-                        result.append(word)
+        # 把关键字拼接在一起分组检测，不通过的分组对半拆分，分组大小由禁止的比例决定
+        # 每一轮同时检测的分组数和并发的请求数相同
+        with pbar_manager.pbar(self.dangerous_keywords, "waf_keywords") as pbar:
+            testing_result = find_banned(
+                self.dangerous_keywords,
+                lambda groups: self.probe_runner.map(
+                    keyword_passed, ["".join(group) for group in groups], None
+                ),
+                initial_size=int(len(self.dangerous_keywords) ** 0.3) + 1,
+                groups_per_round=self.options.probe_workers,
+                on_progress=lambda resolved: pbar.update(completed=resolved),
+            )
+        logger.info(
+            "Tested keywords with [blue]%d[/] group tests, "
+            + "[blue]%d[/] saved compared to fixed batches",
+            testing_result.tests,
+            testing_result.baseline_tests - testing_result.tests,
+            extra={"markup": True, "highlighter": None},
+        )
+        result += testing_result.banned
         if result:
             logger.info(
                 "These keywords might get [yellow bold]banned[/]: [yellow]%s[/]",
@@ -401,57 +479,53 @@ class WafFuncGen:
         Returns:
             List[str]: 所有可能被替换的keyword
         """
-        extra = "".join(random.choices(string.ascii_lowercase, k=4))
+        extra = "".join(self.random.choices(string.ascii_lowercase, k=4))
         test_payloads = (
-            dangerous_keywords
+            self.dangerous_keywords
             if self.options.detect_mode == DetectMode.ACCURATE
-            else grouped_payloads(4, sep=extra)
+            else grouped_payloads(4, sep=extra, keywords=self.dangerous_keywords)
         )
         keywords = []
-        with pbar_manager.pbar(
-            list(test_payloads), "replaced_keyword"
-        ) as test_payloads:
-            for keyword in test_payloads:
-                # 如果extra的开头或结尾和payload的相同，被替换后可能会因为错误拼合导致检测失效
-                while extra[0] == keyword[0] or extra[-1] == keyword[-1]:
-                    extra = "".join(random.choices(string.ascii_lowercase, k=4))
-                payload = extra + keyword + extra
-                logger.debug(
-                    "Fuzzing keyword replacement: [yellow]%s[/]",
+        # 先按照顺序决定每个payload使用的extra，再同时提交它们
+        probes = []
+        for keyword in test_payloads:
+            # 如果extra的开头或结尾和payload的相同，被替换后可能会因为错误拼合导致检测失效
+            while extra[0] == keyword[0] or extra[-1] == keyword[-1]:
+                extra = "".join(self.random.choices(string.ascii_lowercase, k=4))
+            probes.append((keyword, extra, extra + keyword + extra))
+        results = self.probe_runner.submit_all(
+            [payload for _, _, payload in probes], "replaced_keyword"
+        )
+        for (keyword, extra, payload), result in zip(probes, results):
+            logger.debug(
+                "Fuzzing keyword replacement: [yellow]%s[/]",
+                rich_escape(repr(payload)),
+                extra={"markup": True, "highlighter": None},
+            )
+            if result is None:
+                logger.info(
+                    "Submit failed for [yellow]%s[/]",
                     rich_escape(repr(payload)),
                     extra={"markup": True, "highlighter": None},
                 )
-                result = self.subm.submit(payload)
-                if result is None:
+                continue
+
+            status_code, text = result
+            if status_code == 500:
+                continue
+            payload_replaced_keyword = find_replaced_pieces(text, payload)
+            if payload_replaced_keyword:
+                payload_replaced_keyword = list(set(payload_replaced_keyword))
+                if len(payload_replaced_keyword) > 10:
                     logger.info(
-                        "Submit failed for [yellow]%s[/]",
-                        rich_escape(repr(payload)),
-                        extra={"markup": True, "highlighter": None},
+                        "Replaced keywords found, ignore because it's too long (length=%d)",
+                        len(payload_replaced_keyword),
+                        extra={"highlighter": None},
                     )
-                    continue
-
-                status_code, text = result
-                if status_code == 500:
-                    continue
-                if len(text) > 5e4:
-                    continue
-                try:
-                    payload_replaced_keyword = find_pieces(text, payload)
-                except Exception:
-                    traceback.print_exc()
-                    continue
-                if payload_replaced_keyword:
-                    payload_replaced_keyword = list(set(payload_replaced_keyword))
-                    if len(payload_replaced_keyword) > 10:
-                        logger.info(
-                            "Replaced keywords found, ignore because it's too long (length=%d)",
-                            len(payload_replaced_keyword),
-                            extra={"highlighter": None},
-                        )
-                    else:
-                        keywords += payload_replaced_keyword
-                if keyword not in text and extra in text:
-                    keywords.append(keyword)
+                else:
+                    keywords += payload_replaced_keyword
+            if keyword not in text and extra in text:
+                keywords.append(keyword)
         keywords = list(set(keywords))
         if keywords:
             logger.info(
@@ -479,11 +553,49 @@ class WafFuncGen:
             payload = payload.replace(k, v)
         return payload
 
-    def generate(self) -> WafFunc:
-        """生成WAF函数
+    def endpoint_key(self) -> Union[str, None]:
+        """当前目标的键，用于保存检测结果和WAF的判断
+
+        Returns:
+            Union[str, None]: 键，无法确定提交的位置时为None
+        """
+        endpoint = endpoint_of(self.subm)
+        if endpoint is None:
+            return None
+        return WafProfileStore.make_key(
+            endpoint,
+            {
+                # 命令行可能直接传入字符串，统一转换为枚举的值
+                "detect_mode": DetectMode(self.options.detect_mode).value,
+                "detect_waf_keywords": DetectWafKeywords(
+                    self.options.detect_waf_keywords
+                ).value,
+                "replaced_keyword_strategy": ReplacedKeywordStrategy(
+                    self.options.replaced_keyword_strategy
+                ).value,
+                "tamperers": tamperers_key(self.subm.tamperers),
+            },
+        )
+
+    def submit_probe(self, payload: str) -> Union[int, None]:
+        """提交探测请求并返回响应的指纹
+
+        Args:
+            payload (str): payload
+
+        Returns:
+            Union[int, None]: 响应的指纹，请求失败时返回None
+        """
+        result = self.subm.submit(payload)
+        if result is None:
+            return None
+        return self.fingerprinter.fingerprint(result.text)
+
+    def fingerprint(self) -> WafProfile:
+        """检测WAF的特征
 
         Returns:
-            WafFunc: WAF函数
+            WafProfile: 检测结果
         """
         waf_hashes = self.waf_page_hash()
         waf_keywords = (
@@ -493,28 +605,149 @@ class WafFuncGen:
         )
         replaced_keyword = self.replaced_keyword()
         long_param_hashes = self.long_param_hash()
-        long_param_hashes = [h for h in long_param_hashes if h not in waf_hashes]
+        long_param_hashes = [
+            h
+            for h in long_param_hashes
+            if not self.fingerprinter.matches(h, waf_hashes)
+        ]
+        probes = {}
+        if self.waf_page_probe is not None:
+            probes[self.waf_page_probe[0]] = self.waf_page_probe[1]
+        normal_payload = "".join(self.random.choices(string.ascii_lowercase, k=8))
+        normal_hash = self.submit_probe(normal_payload)
+        if normal_hash is not None:
+            probes[normal_payload] = normal_hash
+        return WafProfile(
+            waf_hashes=waf_hashes,
+            waf_keywords=waf_keywords,
+            replaced_keywords=replaced_keyword,
+            long_param_hashes=long_param_hashes,
+            probes=probes,
+            template_prefix=self.fingerprinter.template[0],
+            template_suffix=self.fingerprinter.template[1],
+        )
+
+    def revalidate(self, profile: WafProfile) -> bool:
+        """重新发送保存的探测请求，确认检测结果仍然有效
+
+        Args:
+            profile (WafProfile): 保存的检测结果
+
+        Returns:
+            bool: 是否有效
+        """
+        if not profile.probes:
+            return False
+        self.fingerprinter.template = (profile.template_prefix, profile.template_suffix)
+        for payload, expected in profile.probes.items():
+            fingerprint = self.submit_probe(payload)
+            if fingerprint is None or not self.fingerprinter.similar(
+                fingerprint, expected
+            ):
+                return False
+        return True
+
+    def load_profile(self) -> WafProfile:
+        """读取保存的检测结果，没有保存或者已经失效时重新检测WAF
+
+        Returns:
+            WafProfile: 检测结果
+        """
+        key = self.endpoint_key()
+        store = self.options.waf_profiles
+        if key is None or store is None:
+            return self.fingerprint()
+        profile = store.get(key)
+        if profile is not None:
+            if self.revalidate(profile):
+                logger.info(
+                    "Using saved WAF profile with [blue]%d[/] verdicts",
+                    len(profile.verdicts),
+                    extra={"markup": True, "highlighter": None},
+                )
+                return profile
+            logger.info(
+                "Saved WAF profile is [yellow]outdated[/], fuzzing again",
+                extra={"markup": True, "highlighter": None},
+            )
+            store.discard(key)
+        profile = self.fingerprint()
+        store.put(key, profile)
+        return profile
+
+    def verdict_store(self, profile: WafProfile) -> Tuple[VerdictStore, str]:
+        """WAF函数保存判断使用的位置
+
+        判断总是保存在检测结果中，设置了Options.verdict_store时还会保存在其中，
+        命名空间由目标的位置、被waf的关键字和被替换的关键字决定，它们变化之后不会使用
+        之前的判断。WAF页面变化但这些特征不变时无法区分，需要依靠verdict_store的有效期
+
+        Args:
+            profile (WafProfile): 检测结果
+
+        Returns:
+            Tuple[VerdictStore, str]: 保存判断的位置以及命名空间
+        """
+        key = self.endpoint_key()
+        profile_verdicts = DictVerdictStore(profile.verdicts)
+        if self.options.verdict_store is None or key is None:
+            return profile_verdicts, ""
+        # 页面的指纹每次检测都可能略有不同，所以只使用关键字作为WAF的特征
+        waf_features = json.dumps(
+            [key, sorted(profile.waf_keywords), sorted(profile.replaced_keywords)]
+        )
+        namespace = hashlib.sha256(waf_features.encode()).hexdigest()
+        return (
+            ChainedVerdictStore(profile_verdicts, self.options.verdict_store),
+            namespace,
+        )
+
+    def generate(self) -> BatchWafFunc:
+        """生成WAF函数
+
+        Returns:
+            BatchWafFunc: WAF函数，支持使用check_many批量检测
+        """
+        profile = self.load_profile()
+        waf_hashes = profile.waf_hashes
+        waf_keywords = profile.waf_keywords
+        replaced_keyword = profile.replaced_keywords
+        long_param_hashes = profile.long_param_hashes
+        verdict_store, namespace = self.verdict_store(profile)
         if (
             self.options.replaced_keyword_strategy
             == ReplacedKeywordStrategy.DOUBLETAPPING
         ):
-            self.subm.add_tamperer(lambda s: self.doubletapping(s, replaced_keyword))
+            self.subm.add_tamperer(
+                internal_tamperer(lambda s: self.doubletapping(s, replaced_keyword))
+            )
 
         # 随着检测payload一起提交的附加内容
         # content: 内容本身，passed: 内容是否确认可以通过waf
         extra_content, extra_passed = (
-            "".join(random.choices(string.ascii_lowercase, k=4)),
+            "".join(self.random.choices(string.ascii_lowercase, k=4)),
             False,
         )
         while any(w in extra_content for w in replaced_keyword):
-            extra_content = "".join(random.choices(string.ascii_lowercase, k=4))
+            extra_content = "".join(self.random.choices(string.ascii_lowercase, k=4))
 
         # WAF函数，只有在payload一定可以通过WAF时才返回True
-        @lru_cache(10000)
+        # 结果会保存在verdict_store中，请求失败时的结果不会被保存
+        # probe_workers大于1时会被多个线程同时调用
         def waf_func(value):
+            verdict = verdict_store.get(namespace, value)
+            if verdict is None:
+                verdict = detect(value)
+                if verdict is not None:
+                    verdict_store.put(namespace, value, verdict)
+            return bool(verdict)
+
+        def detect(value) -> Union[bool, None]:
             nonlocal extra_content, extra_passed, replaced_keyword
-            payload = extra_content + value
             for _ in range(5):
+                # 其他线程可能同时更换extra_content，这里使用同一个值
+                extra = extra_content
+                payload = extra + value
                 if (
                     self.options.replaced_keyword_strategy
                     == ReplacedKeywordStrategy.AVOID
@@ -525,22 +758,19 @@ class WafFuncGen:
                 result = self.subm.submit(payload)
                 if result is None:
                     logger.debug("发送请求失败")
-                    return False
+                    return None
                 # status_code, text = result
                 # 遇到500时，判断是否是Jinja渲染错误，是则返回True
                 if result.status_code == 500:
                     logger.debug("目标渲染payload失败")
                     return any(w in result.text for w in RENDER_ERROR_KEYWORDS)
                 # payload过长
-                hash_text = hash(result.text)
-                if hash_text in long_param_hashes:
+                hash_text = self.fingerprinter.fingerprint(result.text)
+                if self.fingerprinter.matches(hash_text, long_param_hashes):
                     logger.debug("payload过长")
                     return False
                 # 无完全回显
-                if (
-                    re.match(r"^[a-zA-Z0-9-_'\"!%=\+\-\*\/\[\], .()]+$", payload)
-                    and payload not in result.text
-                ):
+                if SIMPLE_PAYLOAD_RE.match(payload) and payload not in result.text:
                     logger.debug("payload足够简单但却没有完全回显: %s", payload)
                     return False
                 # 含有被waf的keyword
@@ -554,11 +784,11 @@ class WafFuncGen:
                     )
                     return False
                 # 产生回显
-                if extra_content in result.text:
+                if extra in result.text:
                     logger.debug("payload产生回显")
                     return True
                 # 产生关键词替换
-                replaced_list = find_pieces(result.text, payload)
+                replaced_list = find_replaced_pieces(result.text, payload)
                 if replaced_list:
                     logger.debug(
                         "发现了新的关键词替换：%s",
@@ -588,15 +818,20 @@ class WafFuncGen:
                     return False
                 # 检测是否是extra_content导致的WAF
                 # 如果是的话更换extra_content并重新检测
-                extra_content_result = self.subm.submit(extra_content)
+                extra_content_result = self.subm.submit(extra)
                 if extra_content_result is None:
                     continue
                 if (
                     extra_content_result.status_code != 500
-                    and hash(extra_content_result.text) in waf_hashes
+                    and self.fingerprinter.matches(
+                        self.fingerprinter.fingerprint(extra_content_result.text),
+                        waf_hashes,
+                    )
                 ):
                     logger.debug("extra_content存在问题，重新检查")
-                    extra_content = "".join(random.choices(string.ascii_lowercase, k=4))
+                    extra_content = "".join(
+                        self.random.choices(string.ascii_lowercase, k=4)
+                    )
                     continue
                 extra_passed = True
                 logger.debug("回显失败，返回False")
@@ -604,4 +839,135 @@ class WafFuncGen:
             # 五次检测都失败，我们选择直接返回False
             return False
 
-        return waf_func
+        # 批量检测时逐个检测或者并发检测
+        single_waf = (
+            ConcurrentProbeWaf(waf_func, self.probe_runner)
+            if self.probe_runner.workers > 1
+            else ensure_batch_waf(waf_func)
+        )
+
+        max_length = self.options.packed_probe_length
+        # 目标限制了payload的长度时无法合并检测
+        if max_length is None or long_param_hashes:
+            return learn_banned_substrings(single_waf, self.options)
+
+        # 合并检测：目标会回显时，使用随机的分隔符把多个payload拼接起来，
+        # 通过每个payload两侧的分隔符是否回显判断它是否通过了WAF
+        echoes: Union[bool, None] = None
+        # 合并检测过的payload数量和其中导致整个页面被waf的数量，用于决定每次合并的数量
+        packed_total, packed_failed = 0, 0
+
+        def target_echoes() -> bool:
+            nonlocal echoes
+            if echoes is None:
+                marker = "".join(self.random.choices(string.ascii_lowercase, k=8))
+                result = self.subm.submit(marker)
+                if result is None:
+                    return False
+                echoes = marker in result.text
+                if not echoes:
+                    logger.info(
+                        "Target doesn't echo payloads, packed probes are disabled",
+                        extra={"highlighter": None},
+                    )
+            return echoes
+
+        def packable(value: str) -> bool:
+            return (
+                self_contained(value)
+                and not any(w in value for w in waf_keywords)
+                and not any(w in value for w in replaced_keyword)
+            )
+
+        def make_separators(values: List[str]) -> List[str]:
+            joined = "".join(values)
+            separators: List[str] = []
+            while len(separators) < len(values) + 1:
+                separator = "".join(
+                    self.random.choices(
+                        string.ascii_lowercase, k=PACKED_SEPARATOR_LENGTH
+                    )
+                )
+                if (
+                    separator in joined
+                    or separator in separators
+                    or any(w in separator for w in waf_keywords)
+                    or any(w in separator for w in replaced_keyword)
+                ):
+                    continue
+                separators.append(separator)
+            return separators
+
+        def detect_packed(values: List[str]) -> List[Union[bool, None]]:
+            nonlocal packed_failed
+            if len(values) == 1:
+                verdict = detect(values[0])
+                packed_failed += verdict is False
+                return [verdict]
+            separators = make_separators(values)
+            payload = separators[0] + "".join(
+                value + separator for value, separator in zip(values, separators[1:])
+            )
+            result = self.subm.submit(payload)
+            if result is None:
+                return [None] * len(values)
+            echoed = (
+                split_packed_echo(result.text, separators)
+                if result.status_code != 500
+                else []
+            )
+            if (
+                result.status_code == 500
+                or separators[0] not in result.text
+                or (
+                    None in echoed
+                    and self.fingerprinter.matches(
+                        self.fingerprinter.fingerprint(result.text), waf_hashes
+                    )
+                )
+            ):
+                # 其中有payload被waf或者渲染失败，拆分为两半分别检测
+                logger.debug("合并检测的页面被waf，拆分重新检测")
+                middle = len(values) // 2
+                return detect_packed(values[:middle]) + detect_packed(values[middle:])
+            verdicts: List[Union[bool, None]] = []
+            for value, echo in zip(values, echoed):
+                if echo is None:
+                    # 两侧的分隔符没有完整回显，单独检测
+                    verdicts.append(detect(value))
+                elif SIMPLE_PAYLOAD_RE.match(value) and echo != value:
+                    logger.debug("payload足够简单但却没有完全回显: %s", value)
+                    verdicts.append(False)
+                else:
+                    verdicts.append(True)
+            return verdicts
+
+        def waf_func_many(values: Sequence[str]) -> List[bool]:
+            nonlocal packed_total, packed_failed
+            pending = [
+                value
+                for value in dict.fromkeys(values)
+                if verdict_store.get(namespace, value) is None and packable(value)
+            ]
+            # 和分组检测相同，被waf的payload越少，每次合并的payload越多，
+            # 大部分payload都会被waf时拆分的请求反而更多，不再合并
+            while len(pending) > 1 and target_echoes():
+                max_count = group_size(
+                    (packed_failed + 1) / (packed_total + PACKED_INITIAL_SIZE + 1)
+                )
+                if max_count <= 1:
+                    break
+                assert max_length is not None
+                pack = pack_payloads(
+                    pending, max_length, PACKED_SEPARATOR_LENGTH, max_count
+                )[0]
+                pending = pending[len(pack) :]
+                packed_total += len(pack)
+                for value, verdict in zip(pack, detect_packed(pack)):
+                    if verdict is not None:
+                        verdict_store.put(namespace, value, verdict)
+            return single_waf.check_many(values)
+
+        return learn_banned_substrings(
+            PackedProbeWaf(waf_func, waf_func_many), self.options
+        )
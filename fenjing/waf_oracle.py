@@ -0,0 +1,232 @@
+"""支持批量检测的WAF函数
+
+PayloadGenerator会把ONEOF或者规则列表中可以事先确定的payload收集起来，
+通过check_many一次性交给WAF函数检测，底层的WAF函数可以借此实现流水线或者并发请求。
+只接受单个字符串的普通WAF函数会被WafFuncAdapter包装，行为和原来一致。
+"""
+
+import logging
+import threading
+from typing import List, Sequence, Union
+
+from .const import WafFunc
+from .substring_matcher import SubstringMatcher
+
+logger = logging.getLogger("waf_oracle")
+
+
+class BatchWafFunc:
+    """支持批量检测的WAF函数的基类，子类需要实现check_many"""
+
+    # 值得一次性提交的payload数量，为1时说明批量检测没有收益，调用方不应该提前检测
+    batch_size: int = 1
+
+    def __call__(self, payload: str) -> bool:
+        return self.check_many([payload])[0]
+
+    def check_many(self, payloads: Sequence[str]) -> List[bool]:
+        """检测一系列payload能否通过WAF
+
+        Args:
+            payloads (Sequence[str]): 需要检测的payload
+
+        Returns:
+            List[bool]: 和payloads一一对应的检测结果
+        """
+        raise NotImplementedError()
+
+
+class WafFuncAdapter(BatchWafFunc):
+    """将普通的WAF函数包装为支持批量检测的WAF函数，批量检测时逐个调用原函数"""
+
+    def __init__(self, waf_func: WafFunc, batch_size: int = 1):
+        self.waf_func = waf_func
+        self.batch_size = batch_size
+
+    def __call__(self, payload: str) -> bool:
+        return self.waf_func(payload)
+
+    def check_many(self, payloads: Sequence[str]) -> List[bool]:
+        return [self.waf_func(payload) for payload in payloads]
+
+
+class CombinedWafFunc(BatchWafFunc):
+    """只有所有WAF函数都认为payload可以通过时才返回True"""
+
+    def __init__(self, *waf_funcs: WafFunc):
+        self.waf_funcs = [ensure_batch_waf(waf_func) for waf_func in waf_funcs]
+        self.batch_size = min(waf_func.batch_size for waf_func in self.waf_funcs)
+
+    def __call__(self, payload: str) -> bool:
+        return all(waf_func(payload) for waf_func in self.waf_funcs)
+
+    def check_many(self, payloads: Sequence[str]) -> List[bool]:
+        results = [True] * len(payloads)
+        remaining = list(range(len(payloads)))
+        for waf_func in self.waf_funcs:
+            if not remaining:
+                break
+            verdicts = waf_func.check_many([payloads[i] for i in remaining])
+            for i, verdict in zip(remaining, verdicts):
+                results[i] = verdict
+            remaining = [i for i, verdict in zip(remaining, verdicts) if verdict]
+        return results
+
+
+class LearnedBlacklistWaf(BatchWafFunc):
+    """在WAF函数前学习被禁止的子串，在本地拒绝包含这些子串的payload
+
+    大部分WAF是子串黑名单，一个payload被拦截之后，所有包含同样子串的payload也会被拦截。
+    每当有payload被拦截时，这里会使用二分法检测它的前缀和后缀，找到一个仍然会被拦截的
+    最短子串，之后包含这个子串的payload不再交给WAF函数检测。
+
+    对于不是子串黑名单的WAF(比如同时出现两个关键字才会拦截)，可以设置verify_interval，
+    每隔若干次本地拒绝就交给WAF函数确认一次，结果不一致时删除对应的子串并不再学习它，
+    也可以将bypass设为True直接跳过这一层。
+
+    学习一个子串大约需要2*log2(payload长度)次额外检测，这些检测从probe_credit中扣除。
+    probe_credit一开始为probe_allowance，每次本地拒绝增加一次，不够时不再学习，
+    因此额外的检测次数最多比本地拒绝节省的检测次数多probe_allowance次。
+    """
+
+    # VERIFY模式下每隔多少次本地拒绝确认一次
+    default_verify_interval = 8
+    # 学习子串时可以预先使用的检测次数
+    default_probe_allowance = 32
+
+    def __init__(
+        self,
+        waf_func: WafFunc,
+        verify_interval: int = 0,
+        probe_allowance: Union[int, None] = None,
+    ):
+        """
+        Args:
+            waf_func (WafFunc): 实际的WAF函数
+            verify_interval (int, optional): 每隔多少次本地拒绝使用WAF函数确认一次，
+                为0时不确认
+            probe_allowance (Union[int, None], optional): 学习子串时可以预先使用的检测次数，
+                为None时使用default_probe_allowance
+        """
+        self.waf_func = ensure_batch_waf(waf_func)
+        self.batch_size = self.waf_func.batch_size
+        self.verify_interval = verify_interval
+        self.bypass = False
+        self.banned = SubstringMatcher()
+        # 确认过不能单独导致拦截的子串，不会再被学习
+        self.distrusted = set()
+        self.local_rejections = 0
+        # 学习子串还可以使用的检测次数
+        self.probe_credit = (
+            self.default_probe_allowance if probe_allowance is None else probe_allowance
+        )
+        self.lock = threading.Lock()
+
+    def match_banned(self, payload: str) -> Union[str, None]:
+        """返回payload中已经学习到的被禁止的子串
+
+        Args:
+            payload (str): payload
+
+        Returns:
+            Union[str, None]: 被禁止的子串，没有时返回None
+        """
+        with self.lock:
+            pattern = self.banned.search(payload)
+            if pattern is None:
+                return None
+            self.local_rejections += 1
+            if (
+                self.verify_interval
+                and self.local_rejections % self.verify_interval == 0
+            ):
+                # 交给WAF函数确认
+                return None
+            # 本地拒绝节省了一次检测
+            self.probe_credit += 1
+            return pattern
+
+    def check_many(self, payloads: Sequence[str]) -> List[bool]:
+        if self.bypass:
+            return self.waf_func.check_many(payloads)
+        results = [False] * len(payloads)
+        remaining = [
+            i
+            for i, payload in enumerate(payloads)
+            if self.match_banned(payload) is None
+        ]
+        verdicts = self.waf_func.check_many([payloads[i] for i in remaining])
+        for i, verdict in zip(remaining, verdicts):
+            results[i] = verdict
+            if verdict:
+                self.distrust(payloads[i])
+            else:
+                self.learn(payloads[i])
+        return results
+
+    def distrust(self, payload: str):
+        """payload通过了WAF，删除其中所有已经学习到的子串"""
+        with self.lock:
+            wrong_patterns = self.banned.findall(payload)
+            for pattern in wrong_patterns:
+                self.banned.remove(pattern)
+                self.distrusted.add(pattern)
+        if wrong_patterns:
+            logger.debug("Learned banned substrings %r are wrong", wrong_patterns)
+
+    def learn(self, payload: str):
+        """找到被拦截的payload中仍然会被拦截的最短子串，并将其记录下来
+
+        Args:
+            payload (str): 被拦截的payload
+        """
+        # 两次二分法最多使用的检测次数，先从probe_credit中扣除，学习结束后退还没用完的
+        cost = 2 * (len(payload) - 1).bit_length()
+        with self.lock:
+            if self.banned.search(payload) is not None:
+                return
+            if cost > self.probe_credit:
+                logger.debug("Not enough probe credit to learn from %r", payload)
+                return
+            self.probe_credit -= cost
+        probes = 0
+        # payload[:right]被拦截，payload[:passed]可以通过
+        passed, right = 0, len(payload)
+        while right - passed > 1:
+            middle = (passed + right) // 2
+            probes += 1
+            if self.waf_func(payload[:middle]):
+                passed = middle
+            else:
+                right = middle
+        # payload[left:right]被拦截，payload[passed:right]可以通过
+        left, passed = 0, right
+        while passed - left > 1:
+            middle = (left + passed) // 2
+            probes += 1
+            if self.waf_func(payload[middle:right]):
+                passed = middle
+            else:
+                left = middle
+        pattern = payload[left:right]
+        with self.lock:
+            self.probe_credit += cost - probes
+            if not pattern:
+                return
+            if pattern in self.distrusted or not self.banned.add(pattern):
+                return
+        logger.debug("Learned banned substring %r", pattern)
+
+
+def ensure_batch_waf(waf_func: WafFunc) -> BatchWafFunc:
+    """确保WAF函数支持check_many，普通函数会被WafFuncAdapter包装
+
+    Args:
+        waf_func (WafFunc): WAF函数
+
+    Returns:
+        BatchWafFunc: 支持批量检测的WAF函数
+    """
+    if isinstance(waf_func, BatchWafFunc):
+        return waf_func
+    return WafFuncAdapter(waf_func)
@@ -0,0 +1,205 @@
+"""跨运行持久化的WAF检测结果
+
+WafFuncGen.generate每次都需要发送几百个请求检测WAF的特征，对同一个目标重复运行时
+这些结果基本不会改变。WafProfileStore按照目标的URL、方法、参数和相关的选项保存
+检测结果以及WAF函数对每个payload的判断，在有效期内重新运行时只需要重新发送几个
+探测请求确认目标没有变化，就可以直接开始生成payload。
+结果保存在本地的JSON文件中。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Union
+from urllib.parse import urljoin
+
+from .submitter import Submitter
+
+logger = logging.getLogger("waf_profile")
+
+
+@dataclass
+class WafProfile:
+    """一个目标的WAF检测结果"""
+
+    # waf页面的指纹
+    waf_hashes: List[int] = field(default_factory=list)
+    # 会被waf的关键字
+    waf_keywords: List[str] = field(default_factory=list)
+    # 会被替换的关键字，WAF函数发现新的替换时会加入这里
+    replaced_keywords: List[str] = field(default_factory=list)
+    # 过长payload页面的指纹
+    long_param_hashes: List[int] = field(default_factory=list)
+    # 用于确认目标没有变化的探测请求：payload -> 响应的指纹
+    probes: Dict[str, int] = field(default_factory=dict)
+    # 计算指纹时去掉的页面模板的开头和结尾
+    template_prefix: str = ""
+    template_suffix: str = ""
+    # WAF函数对每个payload的判断
+    verdicts: Dict[str, bool] = field(default_factory=dict)
+    # 检测的时间
+    created_at: float = field(default_factory=time.time)
+
+
+def endpoint_of(submitter: Submitter) -> Union[List[str], None]:
+    """取得submitter提交payload的位置：URL，方法以及参数名
+
+    Args:
+        submitter (Submitter): submitter
+
+    Returns:
+        Union[List[str], None]: 提交的位置，不是通过URL提交时返回None
+    """
+    url = getattr(submitter, "url", None)
+    if not isinstance(url, str):
+        return None
+    form = getattr(submitter, "form", None)
+    if form is not None:
+        url, method = urljoin(url, form["action"]), form["method"]
+    else:
+        method = getattr(submitter, "method", "GET")
+    target = getattr(submitter, "target_field", None) or getattr(submitter, "key", None)
+    return [url, str(method).upper(), str(target) if target is not None else ""]
+
+
+class WafProfileStore:
+    """保存的WAF检测结果，可以通过Options.waf_profiles传给WafFuncGen"""
+
+    file_version = 2
+    # 每个检测结果最多保存的WAF判断数量，超出时丢弃最早的判断
+    max_verdicts = 50000
+
+    def __init__(
+        self,
+        path: Union[str, Path, None] = None,
+        ttl: float = 24 * 3600,
+    ):
+        """
+        Args:
+            path (Union[str, Path, None], optional): 保存检测结果的文件，为None时不保存
+            ttl (float, optional): 检测结果的有效期，单位为秒，默认为1天
+        """
+        self.path = Path(path) if path is not None else None
+        self.ttl = ttl
+        self.profiles: Dict[str, WafProfile] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Union[str, Path], ttl: float = 24 * 3600) -> "WafProfileStore":
+        """从文件中读取检测结果，文件不存在或者损坏时返回空的结果
+
+        Args:
+            path (Union[str, Path]): 保存检测结果的文件
+            ttl (float, optional): 检测结果的有效期
+
+        Returns:
+            WafProfileStore: 读取到的检测结果
+        """
+        store = cls(path, ttl)
+        assert store.path is not None
+        if not store.path.exists():
+            return store
+        try:
+            data = json.loads(store.path.read_text())
+            if data.get("version") != cls.file_version:
+                raise ValueError(f"Unsupported version {data.get('version')!r}")
+            store.profiles = {
+                key: WafProfile(**profile) for key, profile in data["profiles"].items()
+            }
+        except (ValueError, KeyError, TypeError) as exc:
+            logger.warning(
+                "Ignoring broken WAF profile file %s: %r",
+                store.path.as_posix(),
+                exc,
+            )
+            store.profiles = {}
+        return store
+
+    def save(self, path: Union[str, Path, None] = None):
+        """将检测结果保存到文件中，过期的结果不会被保存
+
+        Args:
+            path (Union[str, Path, None], optional): 保存的文件，默认为读取时的文件
+        """
+        output_path = Path(path) if path is not None else self.path
+        if output_path is None:
+            raise ValueError("No path to save the WAF profiles")
+        with self.lock:
+            profiles = {}
+            for key, profile in self.profiles.items():
+                if self.expired(profile):
+                    continue
+                profile_data = asdict(profile)
+                verdicts = list(profile_data["verdicts"].items())
+                profile_data["verdicts"] = dict(verdicts[-self.max_verdicts :])
+                profiles[key] = profile_data
+            data = {"version": self.file_version, "profiles": profiles}
+        # 先写入临时文件再替换，避免中途退出时损坏已有的检测结果
+        temp_path = output_path.with_name(output_path.name + ".tmp")
+        temp_path.write_text(json.dumps(data))
+        os.replace(temp_path, output_path)
+
+    @staticmethod
+    def make_key(endpoint: List[str], settings: Dict[str, Any]) -> str:
+        """根据提交的位置和影响检测结果的选项生成检测结果的键
+
+        Args:
+            endpoint (List[str]): 提交的位置，见endpoint_of
+            settings (Dict[str, Any]): 影响检测结果的选项，需要可以转换为JSON
+
+        Returns:
+            str: 键
+        """
+        return json.dumps([endpoint, settings], sort_keys=True)
+
+    def expired(self, profile: WafProfile) -> bool:
+        """检测结果是否已经过期
+
+        Args:
+            profile (WafProfile): 检测结果
+
+        Returns:
+            bool: 是否过期
+        """
+        return time.time() - profile.created_at > self.ttl
+
+    def get(self, key: str) -> Union[WafProfile, None]:
+        """取得没有过期的检测结果
+
+        Args:
+            key (str): 键
+
+        Returns:
+            Union[WafProfile, None]: 检测结果，不存在或者过期时返回None
+        """
+        with self.lock:
+            profile = self.profiles.get(key)
+            if profile is None:
+                return None
+            if self.expired(profile):
+                del self.profiles[key]
+                return None
+            return profile
+
+    def put(self, key: str, profile: WafProfile):
+        """保存检测结果
+
+        Args:
+            key (str): 键
+            profile (WafProfile): 检测结果
+        """
+        with self.lock:
+            self.profiles[key] = profile
+
+    def discard(self, key: str):
+        """删除检测结果，比如确认目标已经变化时
+
+        Args:
+            key (str): 键
+        """
+        with self.lock:
+            self.profiles.pop(key, None)
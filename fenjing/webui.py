@@ -30,8 +30,9 @@ from .const import (
 )
 from .cracker import Cracker
 from .options import Options
+from .verdict_store import shared_verdict_store
 from .form import get_form, Form
-from .full_payload_gen import FullPayloadGen
+from .full_payload_gen import FullPayloadGen, generate_or_fail
 from .requester import HTTPRequester
 from .scan_url import yield_form
 from .submitter import Submitter, FormSubmitter, PathSubmitter, JsonSubmitter
@@ -324,7 +325,9 @@ class InteractiveTaskThread(threading.Thread):
 
     def run(self):
         self.messages.append("开始生成payload")
-        payload, will_print = self.full_payload_gen.generate(OS_POPEN_READ, self.cmd)
+        payload, will_print = generate_or_fail(
+            self.full_payload_gen, OS_POPEN_READ, self.cmd
+        )
         if not payload:
             self.messages.append("payload生成失败")
             return
@@ -354,7 +357,7 @@ def parse_options(request_form) -> Options:
     Returns:
         Options: 对应的option
     """
-    options = Options()
+    options = Options(verdict_store=shared_verdict_store)
     if request_form.get("detect_mode", None):
         options.detect_mode = DetectMode(request_form.get("detect_mode", None))
     if request_form.get("environment", None):
@@ -7,11 +7,12 @@ import sys
 sys.path.append("..")
 import unittest
 import os
+import json
 import tempfile
 
 import click
 
-from fenjing import cli, waf_func_gen, options
+from fenjing import cli, waf_func_gen, options, const
 import tempfile
 
 SLEEP_INTERVAL = float(os.environ.get("SLEEP_INTERVAL", 0.01))
@@ -302,6 +303,58 @@ class TestCLI(unittest.TestCase):
                 }
             )
 
+    def test_crack_learn_banned_substrings(self):
+        for learning in [
+            const.BannedSubstringLearning.ENABLED,
+            const.BannedSubstringLearning.VERIFY,
+        ]:
+            self.crack_test(
+                {
+                    "url": VULUNSERVER_ADDR + "/static_waf",
+                    "method": "GET",
+                    "inputs": "name",
+                    "exec_cmd": "ls /",
+                    "interval": SLEEP_INTERVAL,
+                    "learn_banned_substrings": learning,
+                }
+            )
+
+    def test_crack_keywords_stats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            keywords_path = os.path.join(directory, "keywords.txt")
+            stats_path = os.path.join(directory, "stats.json")
+            with open(keywords_path, "w") as f:
+                f.write("__\n")
+            self.crack_keywords_test(
+                {
+                    "keywords_file": keywords_path,
+                    "command": "ls /",
+                    "stats_output": stats_path,
+                }
+            )
+            with open(stats_path) as f:
+                stats = json.load(f)
+            self.assertGreater(stats["total"]["waf_calls"], 0)
+            self.assertTrue(stats["rules"])
+
+    def test_crack_keywords_rule_stats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            keywords_path = os.path.join(directory, "keywords.txt")
+            rule_stats_path = os.path.join(directory, "rules.json")
+            with open(keywords_path, "w") as f:
+                f.write("__\n")
+            for _ in range(2):
+                self.crack_keywords_test(
+                    {
+                        "keywords_file": keywords_path,
+                        "command": "ls /",
+                        "rule_stats_file": rule_stats_path,
+                    }
+                )
+            with open(rule_stats_path) as f:
+                rule_stats = json.load(f)
+            self.assertTrue(rule_stats["rules"])
+
     def test_crack_request_basic(self):
         protocol, sep, addr = VULUNSERVER_ADDR.partition("://")
         host, sep, port = addr.partition(":")
@@ -9,10 +9,33 @@ from fenjing.requester import HTTPRequester
 import unittest
 from fenjing.const import TemplateEnvironment, ReplacedKeywordStrategy, AutoFix500Code
 from fenjing.cracker import Cracker
+from fenjing.waf_func_gen import WafFuncGen
+from fenjing.group_testing import find_banned
+from fenjing.waf_profile import WafProfile, WafProfileStore
+from fenjing.verdict_store import (
+    ChainedVerdictStore,
+    DictVerdictStore,
+    MemoryVerdictStore,
+    SqliteVerdictStore,
+)
+from fenjing.response_fingerprint import ResponseFingerprinter
+from fenjing.replacement_diff import find_replacements, Replacement
+from fenjing.keyword_matcher import KeywordMatcher
 from fenjing.options import Options
-from fenjing.submitter import FormSubmitter, PathSubmitter, Submitter, HTTPResponse
+from fenjing.submitter import (
+    FormSubmitter,
+    PathSubmitter,
+    Submitter,
+    HTTPResponse,
+    internal_tamperer,
+    shell_tamperer,
+)
 from fenjing import const
+import logging
 import os
+import tempfile
+import threading
+import time
 
 VULUNSERVER_ADDR = os.environ.get("VULUNSERVER_ADDR", "http://127.0.0.1:5000")
 SLEEP_INTERVAL = float(os.environ.get("SLEEP_INTERVAL", 0.01))
@@ -23,9 +46,10 @@ class WrappedSubmitter(Submitter):
         super().__init__()
         self.subm = subm
         self.blacklist = blacklist
+        self.matcher = KeywordMatcher(blacklist)
 
     def submit_raw(self, raw_payload):
-        if any(w in raw_payload for w in self.blacklist):
+        if self.matcher.search(raw_payload) is not None:
             return HTTPResponse(status_code=200, text="Nope")
         return self.subm.submit(raw_payload)
 
@@ -620,6 +644,18 @@ class TestRandomCharsWaf(TestBase):
         self.setup_remote_waf("/random_chars_waf")
 
 
+class TestCsrfTokenWAF(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.blacklist = None
+        self.setup_remote_waf("/csrf_token_waf")
+
+    def test_waf_page_hash(self):
+        # 每个页面都带有不同的token和时间戳，但是waf页面仍然可以被识别
+        waf_func_gen = WafFuncGen(self.subm)
+        self.assertEqual(len(waf_func_gen.waf_page_hash()), 1)
+
+
 class TestWeirdWAF(TestBase):
     def setUp(self):
         super().setUp()
@@ -704,6 +740,20 @@ class TestReplacedWAFDoubleTapping(TestBase):
         )
 
 
+class TestGenerationBudget(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.setup_local_waf(["_", "'", '"', "."])
+        self.cracker_options.waf_call_budget = 5
+
+    def test_waf(self):
+        cracker = Cracker(self.subm, options=self.cracker_options)
+        # 预算用完时当作失败的尝试，而不是抛出异常
+        with self.assertLogs("payload_gen", logging.WARNING) as logs:
+            self.assertIsNone(cracker.crack())
+        self.assertTrue(any("waf_calls" in line for line in logs.output))
+
+
 class TestJinjaEnv(TestBase):
     def setUp(self):
         super().setUp()
@@ -717,3 +767,369 @@ class TestFix500(TestBase):
         self.setup_remote_waf("/jinja_env_waf")
         self.cracker_options.environment = TemplateEnvironment.FLASK
         self.cracker_options.autofix_500 = AutoFix500Code.ENABLED
+
+
+class TestConcurrentProbing(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.setup_remote_waf("/replace_waf")
+        self.cracker_options.probe_workers = 8
+        self.cracker_options.probe_host_limit = 4
+
+
+class TestConcurrentProbingKeywords(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.setup_local_waf(['"', "'", "_", ".", "+", "~", "{{", "class"])
+        self.cracker_options.detect_waf_keywords = const.DetectWafKeywords.FULL
+        self.cracker_options.probe_workers = 8
+
+
+class TestConcurrentProbingResult(TestBase):
+    def detect(self, probe_workers):
+        options = Options(
+            detect_waf_keywords=const.DetectWafKeywords.FULL,
+            seed=42,
+            probe_workers=probe_workers,
+        )
+        waf_func_gen = WafFuncGen(self.subm, options=options)
+        waf_hashes = waf_func_gen.waf_page_hash()
+        return (
+            sorted(waf_hashes),
+            sorted(waf_func_gen.waf_keywords(waf_hashes)),
+            sorted(waf_func_gen.replaced_keyword()),
+        )
+
+    def test_waf(self):
+        self.setup_local_waf(["_", "class", "globals"])
+        sequential = self.detect(1)
+        self.assertIn("class", sequential[1])
+        self.assertEqual(self.detect(8), sequential)
+
+    def test_check_many(self):
+        self.setup_local_waf(["_", "class", "globals"])
+        payloads = ["{{7*7}}", "{{lipsum.__globals__}}", "{{7*7}}", "{{cycler}}"]
+        results = []
+        for probe_workers in (1, 4):
+            waf_func = WafFuncGen(
+                self.subm, options=Options(probe_workers=probe_workers)
+            ).generate()
+            results.append(waf_func.check_many(payloads))
+        # 并发检测时生成器会批量提前检测
+        self.assertEqual(waf_func.batch_size, 4)
+        self.assertEqual(results[0], [True, False, True, True])
+        self.assertEqual(results[1], results[0])
+
+    def test_interval(self):
+        requester = HTTPRequester(interval=0.05)
+        starts = []
+        request = requester.session.request
+
+        def record(**kwargs):
+            starts.append(time.perf_counter())
+            return request(**kwargs)
+
+        requester.session.request = record
+        threads = [
+            threading.Thread(
+                target=requester.request,
+                kwargs={"method": "GET", "url": VULUNSERVER_ADDR},
+            )
+            for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        starts.sort()
+        # 多个线程同时发送请求时仍然遵守请求间隔
+        for before, after in zip(starts, starts[1:]):
+            self.assertGreaterEqual(after - before, 0.045)
+
+
+class TestPackedProbes(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.setup_remote_waf("/static_waf")
+        self.cracker_options.packed_probe_length = 200
+
+
+class TestPackedProbesResult(TestBase):
+    candidates = (
+        [f"abc{i}" for i in range(20)]
+        + [f"{{%print({i}*{i})%}}" for i in range(10)]
+        + [f"{{{{{i}}}}}" for i in range(5)]
+        + [f"eval{i}" for i in range(5)]
+    )
+
+    def check(self, remote_uri, packed_probe_length):
+        submits = []
+        subm = FormSubmitter(
+            url=VULUNSERVER_ADDR,
+            form=get_form(action=remote_uri, inputs=["name"], method="GET"),
+            target_field="name",
+            requester=HTTPRequester(interval=SLEEP_INTERVAL),
+            callback=lambda kind, data: submits.append(data),
+        )
+        options = Options(packed_probe_length=packed_probe_length, seed=1)
+        waf_func = WafFuncGen(subm, options=options).generate()
+        submits.clear()
+        return waf_func.check_many(self.candidates), len(submits)
+
+    def test_waf(self):
+        verdicts, submits = self.check("/replace_waf", None)
+        packed_verdicts, packed_submits = self.check("/replace_waf", 200)
+        self.assertEqual(packed_verdicts, verdicts)
+        self.assertLess(packed_submits * 5, submits)
+        # 页面被waf时拆分检测，结果和逐个检测相同
+        verdicts, _ = self.check("/static_waf", None)
+        packed_verdicts, _ = self.check("/static_waf", 200)
+        self.assertEqual(packed_verdicts, verdicts)
+
+
+class TestGroupTesting(unittest.TestCase):
+    keywords = list(const.DANGEROUS_KEYWORDS)
+
+    def groups_passed(self, banned):
+        def groups_passed(groups):
+            return [all(word not in banned for word in group) for group in groups]
+
+        return groups_passed
+
+    def test_banned(self):
+        for banned in [[], ["class"], self.keywords[::7], self.keywords[::2]]:
+            for groups_per_round in [1, 8]:
+                result = find_banned(
+                    self.keywords,
+                    self.groups_passed(banned),
+                    initial_size=5,
+                    groups_per_round=groups_per_round,
+                )
+                self.assertEqual(result.banned, banned)
+
+    def test_fewer_tests(self):
+        result = find_banned(self.keywords, self.groups_passed(["class"]), 5)
+        self.assertLess(result.tests, result.baseline_tests)
+        self.assertLess(result.tests, 20)
+
+    def test_joined_artifact(self):
+        # 两个关键字拼接之后才会被禁止，不应该认为其中的任何一个被禁止
+        def groups_passed(groups):
+            return ["classglobals" not in "".join(group) for group in groups]
+
+        result = find_banned(["os", "class", "globals", "mro"], groups_passed, 4)
+        self.assertEqual(result.banned, [])
+
+
+class TestWafProfile(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.submits = []
+        self.subm = FormSubmitter(
+            url=VULUNSERVER_ADDR,
+            form=get_form(action="/static_waf", inputs=["name"], method="GET"),
+            target_field="name",
+            requester=HTTPRequester(interval=SLEEP_INTERVAL),
+            callback=lambda kind, data: self.submits.append(data),
+        )
+        self.profile_path = os.path.join(tempfile.mkdtemp(), "profiles.json")
+
+    def generate(self):
+        options = Options(waf_profiles=WafProfileStore.load(self.profile_path))
+        self.submits.clear()
+        waf_func = WafFuncGen(self.subm, options=options).generate()
+        return options.waf_profiles, waf_func
+
+    def test_waf(self):
+        store, waf_func = self.generate()
+        fingerprint_submits = len(self.submits)
+        self.assertFalse(waf_func("{{lipsum.__globals__}}"))
+        self.assertTrue(waf_func("{%print(7*7)%}"))
+        store.save()
+
+        store, waf_func = self.generate()
+        # 只发送了确认检测结果仍然有效的探测请求
+        self.assertLessEqual(len(self.submits), 2)
+        self.assertLess(len(self.submits), fingerprint_submits)
+        self.assertFalse(waf_func("{{lipsum.__globals__}}"))
+        self.assertTrue(waf_func("{%print(7*7)%}"))
+        self.assertLessEqual(len(self.submits), 2)
+
+        # 目标变化之后重新检测
+        (profile,) = store.profiles.values()
+        profile.probes = {payload: 0 for payload in profile.probes}
+        store.save()
+        store, waf_func = self.generate()
+        self.assertGreater(len(self.submits), 2)
+        self.assertEqual(len(store.profiles), 1)
+
+    def test_shared_verdicts(self):
+        verdict_store = SqliteVerdictStore(
+            os.path.join(tempfile.mkdtemp(), "verdicts.db")
+        )
+        for i in range(2):
+            self.submits.clear()
+            options = Options(verdict_store=verdict_store)
+            waf_func = WafFuncGen(self.subm, options=options).generate()
+            submits = len(self.submits)
+            self.assertTrue(waf_func("{%print(7*7)%}"))
+            if i == 0:
+                self.assertGreater(len(self.submits), submits)
+            else:
+                # 第二次直接使用第一次保存的判断
+                self.assertEqual(len(self.submits), submits)
+
+    def test_tamperers_key(self):
+        options = Options()
+        key = WafFuncGen(self.subm, options=options).endpoint_key()
+        self.subm.add_tamperer(shell_tamperer("tr a-z A-Z"))
+        upper_key = WafFuncGen(self.subm, options=options).endpoint_key()
+        self.assertNotEqual(upper_key, key)
+        self.subm.tamperers[-1] = shell_tamperer("rev")
+        self.assertNotEqual(
+            WafFuncGen(self.subm, options=options).endpoint_key(), upper_key
+        )
+        self.subm.tamperers[-1] = shell_tamperer("tr a-z A-Z")
+        self.assertEqual(
+            WafFuncGen(self.subm, options=options).endpoint_key(), upper_key
+        )
+        # fenjing内部添加的tamperer不影响键
+        self.subm.add_tamperer(internal_tamperer(lambda s: s + s))
+        self.assertEqual(
+            WafFuncGen(self.subm, options=options).endpoint_key(), upper_key
+        )
+
+    def test_expired(self):
+        store = WafProfileStore(self.profile_path, ttl=60)
+        store.put("key", WafProfile(created_at=time.time() - 120))
+        store.put("fresh", WafProfile(verdicts={"a": True}))
+        self.assertIsNone(store.get("key"))
+        store.save()
+        store = WafProfileStore.load(self.profile_path, ttl=60)
+        self.assertEqual(list(store.profiles), ["fresh"])
+        self.assertEqual(store.get("fresh").verdicts, {"a": True})
+
+
+class TestVerdictStore(unittest.TestCase):
+    def test_memory(self):
+        store = MemoryVerdictStore(maxsize=2)
+        store.put("a", "x", True)
+        store.put("a", "y", False)
+        self.assertTrue(store.get("a", "x"))
+        store.put("a", "z", True)
+        self.assertIsNone(store.get("a", "y"))
+        self.assertIsNone(store.get("b", "x"))
+        self.assertTrue(store.get("a", "x"))
+        expired = MemoryVerdictStore(ttl=-1)
+        expired.put("a", "x", True)
+        self.assertIsNone(expired.get("a", "x"))
+
+    def test_chained(self):
+        profile_verdicts, shared = {}, MemoryVerdictStore()
+        store = ChainedVerdictStore(DictVerdictStore(profile_verdicts), shared)
+        store.put("a", "x", True)
+        self.assertEqual(profile_verdicts, {"x": True})
+        self.assertTrue(shared.get("a", "x"))
+        shared.put("a", "y", False)
+        self.assertFalse(store.get("a", "y"))
+        # 在共享的位置找到的判断会被补充到检测结果中
+        self.assertEqual(profile_verdicts, {"x": True, "y": False})
+
+    def test_sqlite(self):
+        path = os.path.join(tempfile.mkdtemp(), "verdicts.db")
+        store = SqliteVerdictStore(path)
+
+        def put_many(start):
+            for i in range(start, start + 50):
+                store.put("a", str(i), i % 2 == 0)
+
+        threads = [threading.Thread(target=put_many, args=(i * 50,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 另一个实例(比如另一个进程)可以读到保存的判断
+        other = SqliteVerdictStore(path)
+        for i in range(200):
+            self.assertEqual(other.get("a", str(i)), i % 2 == 0)
+        self.assertIsNone(other.get("b", "0"))
+        self.assertIsNone(SqliteVerdictStore(path, ttl=-1).get("a", "0"))
+
+
+class TestResponseFingerprint(unittest.TestCase):
+    page = (
+        "<html><form><input name='csrf' value='{}'></form>"
+        + "<p>{}</p><footer>{}</footer></html>"
+    )
+
+    def render(self, content, i):
+        return self.page.format(f"a8f5f167f44f4964e6c998dee827110c{i}", content, i)
+
+    def test_dynamic_tokens(self):
+        fingerprinter = ResponseFingerprinter()
+        waf_pages = [self.render("Nope", 1700000000 + i) for i in range(3)]
+        fingerprinter.learn_template(
+            waf_pages + [self.render("Hello, abc", 1700000100)]
+        )
+        fingerprints = [fingerprinter.fingerprint(page) for page in waf_pages]
+        self.assertEqual(len(fingerprinter.frequent(fingerprints)), 1)
+        self.assertFalse(
+            fingerprinter.matches(
+                fingerprinter.fingerprint(self.render("Hello, 49", 1700000200)),
+                fingerprints,
+            )
+        )
+
+    def test_similar(self):
+        fingerprinter = ResponseFingerprinter()
+        text = "Your request was blocked by the firewall, please contact admin. " * 4
+        self.assertTrue(
+            fingerprinter.similar(
+                fingerprinter.fingerprint(text),
+                fingerprinter.fingerprint(text.replace("admin", "admins", 1)),
+            )
+        )
+        self.assertFalse(
+            fingerprinter.similar(
+                fingerprinter.fingerprint(text),
+                fingerprinter.fingerprint("Hello, " + text[::-1]),
+            )
+        )
+
+
+class TestReplacementDiff(unittest.TestCase):
+    def test_replacements(self):
+        self.assertEqual(
+            find_replacements("Hello, abcdxyzwfooXXXxyzw", "abcdclassxyzwfooevalxyzw"),
+            [Replacement("class", ""), Replacement("eval", "XXX")],
+        )
+        # HTML转义和截断都不是替换
+        self.assertEqual(find_replacements("Hello, qwer&#39;qwer", "qwer'qwer"), [])
+        self.assertEqual(find_replacements("Hello, qwerclass", "qwerclassqwer"), [])
+        self.assertEqual(find_replacements("Hello, world", "abcdclass"), [])
+
+    def test_adjacent_replacements(self):
+        # 两处改写之间的回显太短，无法直接重新对齐
+        self.assertEqual(
+            find_replacements("Hello, abcdxzzzz", "abcdevalxevalzzzz"),
+            [Replacement("eval", ""), Replacement("eval", "")],
+        )
+        self.assertEqual(
+            find_replacements("Hello, abcd.classzzzz", "abcd''.__class__zzzz"),
+            [Replacement("''", ""), Replacement("__", ""), Replacement("__", "")],
+        )
+        self.assertEqual(
+            find_replacements("Hello, abcdhixhizzzz", "abcdevalxevalzzzz"),
+            [Replacement("eval", "hi"), Replacement("eval", "hi")],
+        )
+        # 普通的替换不会因为碰巧相同的字符被拆开
+        self.assertEqual(
+            find_replacements("Hello, abcdhackerzzzz", "abcdevalzzzz"),
+            [Replacement("eval", "hacker")],
+        )
+
+    def test_large_page(self):
+        page = "a" * 200000 + "Hello, abcdxyzw" + "b" * 200000
+        self.assertEqual(
+            find_replacements(page, "abcdclassxyzw"), [Replacement("class", "")]
+        )
@@ -13,6 +13,7 @@ import logging
 import os
 
 from fenjing import FullPayloadGen, const, options
+from fenjing.keyword_matcher import keyword_waf_func
 import unittest
 import random
 import jinja2
@@ -31,7 +32,7 @@ def get_full_payload_gen(
     autofix_500=fenjing.const.AutoFix500Code.DISABLED,
 ):
     return FullPayloadGen(
-        lambda x: all(word not in x for word in blacklist),
+        keyword_waf_func(blacklist),
         options=options.Options(
             detect_mode=detect_mode,
             environment=environment,
@@ -92,6 +93,91 @@ class FullPayloadGenTestCaseSimple(unittest.TestCase):
         for word in self.blacklist:
             self.assertNotIn(word, payload)
 
+    def test_generate_many(self):
+        targets = [
+            (const.OS_POPEN_READ, "echo fen  jing;"),
+            (const.OS_POPEN_READ, "echo many  payloads;"),
+            (const.STRING, "__dunder__"),
+        ]
+        results = self.full_payload_gen.generate_many(targets)
+        self.assertEqual([result.target for result in results], targets)
+        expected_texts = ["fen jing", "many payloads", "__dunder__"]
+        for result, expected in zip(results, expected_texts):
+            assert result.payload is not None, f"{result.target=}"
+            self.assertGreaterEqual(result.elapsed, 0)
+            resp = self.subm.submit(result.payload)
+            assert resp is not None
+            self.assertIn(expected, resp.text, f"{result.payload=}")
+            for word in self.blacklist:
+                self.assertNotIn(word, result.payload)
+
+
+class FullPayloadGenTestCaseBudget(unittest.TestCase):
+    def test_exhausted(self):
+        blacklist = ["'", '"', "_", "+", "[", "0", "1"]
+        full_payload_gen = FullPayloadGen(
+            lambda x: all(word not in x for word in blacklist),
+            options=options.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                waf_call_budget=5,
+            ),
+        )
+        with self.assertRaises(fenjing.payload_gen.GenerationBudgetExhausted):
+            full_payload_gen.generate(const.OS_POPEN_READ, "ls /")
+        full_payload_gen.options.waf_call_budget = None
+        payload, _ = full_payload_gen.generate(const.OS_POPEN_READ, "ls /")
+        self.assertIsNotNone(payload)
+
+
+class FullPayloadGenTestCaseMaxLength(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.blacklist = [
+            "'",
+            '"',
+            "_",
+            "os",
+            "popen",
+            "class",
+            "+",
+            "request",
+            "[",
+            "attr",
+        ]
+        self.subm = FormSubmitter(
+            url=VULUNSERVER_ADDR,
+            form=get_form(action="/", inputs=["name"], method="GET"),
+            target_field="name",
+            requester=HTTPRequester(interval=0.01),
+        )
+
+    def generate(self, max_length):
+        full_payload_gen = FullPayloadGen(
+            keyword_waf_func(self.blacklist),
+            options=options.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                max_length=max_length,
+            ),
+        )
+        payload, _ = full_payload_gen.generate(const.OS_POPEN_READ, "echo fen  jing;")
+        assert payload is not None
+        return payload
+
+    def test_max_length(self):
+        unlimited = self.generate(None)
+        # 最外层的结构和{%set%}语句也计入长度
+        payload = self.generate(415)
+        self.assertLess(len(payload), len(unlimited))
+        self.assertLessEqual(len(payload), 415)
+        resp = self.subm.submit(payload)
+        assert resp is not None
+        self.assertIn("fen jing", resp.text, f"{payload=}")
+
+    def test_too_short(self):
+        with self.assertLogs(fenjing.full_payload_gen.logger, logging.WARNING):
+            payload = self.generate(150)
+        self.assertGreater(len(payload), 150)
+
 
 class FullPayloadGenTestCaseHard(FullPayloadGenTestCaseSimple):
     def setUp(self) -> None:
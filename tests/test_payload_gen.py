@@ -3,12 +3,37 @@ import sys  # noqa
 sys.path.append("..")  # noqa
 
 import unittest
+import json
+import os
+import tempfile
 import fenjing
 import string
+import random
+import threading
 
 
-from fenjing.payload_gen import PayloadGenerator, expression_gens
-from fenjing.rules_utils import precedence
+from fenjing.payload_gen import (
+    GenerationBudgetExhausted,
+    PayloadGenerator,
+    SpeculationToken,
+    TargetCache,
+    expression_gens,
+    merge_used_context,
+    target_handler,
+    target_handlers,
+)
+from fenjing.waf_oracle import BatchWafFunc, CombinedWafFunc, LearnedBlacklistWaf
+from fenjing.substring_matcher import SubstringMatcher
+from fenjing.keyword_matcher import KeywordMatcher, keyword_waf_func, trie_pattern
+from fenjing.generation_stats import GenerationStats
+from fenjing.rule_ordering import RuleOrdering
+from fenjing.context_vars import prepare_context_vars
+from fenjing.rules_utils import (
+    RuleRandom,
+    WhitespaceUnwrapper,
+    precedence,
+    unwrap_whitespace,
+)
 from fenjing.wordlist import CHAR_PATTERNS
 from fenjing import const
 import logging
@@ -19,11 +44,8 @@ fenjing.payload_gen.logger.setLevel(logging.ERROR)
 
 
 def get_payload_gen(blacklist, context):
-    def waf_func(x):
-        return all(word not in x for word in blacklist)
-
     return PayloadGenerator(
-        waf_func,
+        keyword_waf_func(blacklist),
         context,
         options=fenjing.Options(python_version=fenjing.const.PythonVersion.PYTHON3),
     )
@@ -353,6 +375,759 @@ class PayloadGenTestCaseHard(unittest.TestCase):
         )
 
 
+class PayloadGenTestCaseBestFirst(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.payload_gen = PayloadGenerator(
+            lambda x: all(word not in x for word in ["'", '"', "_", "+"]),
+            {},
+            options=fenjing.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                search_strategy=fenjing.const.SearchStrategy.BEST_FIRST,
+            ),
+        )
+
+    def test_string(self):
+        for target_string in ["a", "__globals__", "ls /;"]:
+            result = self.payload_gen.generate(const.STRING, target_string)
+            self.assertIsNotNone(result, target_string)
+            self.assertEqual(
+                Template("{{" + result + "}}").render(), target_string, result
+            )
+            self.assertLessEqual(
+                self.payload_gen.estimate_length((const.STRING, target_string)),
+                len(result),
+            )
+
+    def test_os_popen_read(self):
+        self.assertIsNotNone(
+            self.payload_gen.generate(const.OS_POPEN_READ, "echo fen  jing;")
+        )
+
+    def test_estimate_length(self):
+        self.assertEqual(
+            self.payload_gen.estimate_length(
+                (const.EXPRESSION, 0, [(const.LITERAL, "ab"), (const.WHITESPACE,)])
+            ),
+            2,
+        )
+        self.assertEqual(
+            self.payload_gen.estimate_length(
+                (const.ONEOF, [[(const.LITERAL, "abc")], [(const.LITERAL, "a")]])
+            ),
+            1,
+        )
+        self.assertEqual(
+            self.payload_gen.estimate_length((const.UNSATISFIED,)), float("inf")
+        )
+
+
+class PayloadGenTestCaseSpeculative(unittest.TestCase):
+    def test_same_result(self):
+        blacklist = ["'", '"', "_", "+", "[", "0", "1", "2", "os"]
+        speculative_gen = PayloadGenerator(
+            lambda x: all(word not in x for word in blacklist),
+            {},
+            options=fenjing.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                speculative_workers=4,
+            ),
+        )
+        plain_gen = get_payload_gen(blacklist, {})
+        targets = [
+            (const.STRING, "__globals__"),
+            (const.INTEGER, 114514),
+            (const.OS_POPEN_READ, "ls /"),
+        ]
+        for target in targets:
+            self.assertEqual(
+                speculative_gen.generate(*target), plain_gen.generate(*target)
+            )
+        # 线程池在最外层的并行尝试结束时关闭
+        self.assertIsNone(speculative_gen.executor)
+        for thread in threading.enumerate():
+            if thread.name.startswith("fenjing-speculative"):
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+
+    def test_fast_mode(self):
+        blacklist = ["'", '"', "_", "+", "[", "0", "1", "2", "os"]
+        gens = [
+            PayloadGenerator(
+                lambda x: all(word not in x for word in blacklist),
+                {},
+                options=fenjing.Options(
+                    python_version=fenjing.const.PythonVersion.PYTHON3,
+                    detect_mode=fenjing.const.DetectMode.FAST,
+                    speculative_workers=workers,
+                ),
+            )
+            for workers in [4, 0]
+        ]
+        for target in [(const.STRING, "__globals__"), (const.INTEGER, 114514)]:
+            self.assertEqual(gens[0].generate(*target), gens[1].generate(*target))
+        self.assertEqual(dict(gens[0].used_count), dict(gens[1].used_count))
+
+    def test_waf_call_count(self):
+        blacklist = ["'", '"', "_", "+", "[", "0", "1", "2", "os"]
+        calls = []
+
+        def waf_func(x):
+            calls.append(x)
+            return all(word not in x for word in blacklist)
+
+        payload_gen = PayloadGenerator(
+            waf_func,
+            {},
+            options=fenjing.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                speculative_workers=8,
+            ),
+        )
+        self.assertIsNotNone(payload_gen.generate(const.OS_POPEN_READ, "ls /"))
+        # 多个线程同时检测WAF时计数不会丢失
+        self.assertEqual(payload_gen.waf_call_count, len(calls))
+
+    def test_discard_speculation(self):
+        payload_gen = get_payload_gen([], {})
+        token = SpeculationToken()
+        payload_gen.speculation_state.token = token
+        try:
+            payload_gen.commit_generation(
+                (const.STRING, "a"),
+                (expression_gens[const.STRING][0], [], ("'a'", {}, [])),
+                set(),
+                payload_gen.failure_epoch(),
+            )
+        finally:
+            payload_gen.speculation_state.token = None
+        name = expression_gens[const.STRING][0].__name__
+        self.assertIn((const.STRING, "a"), payload_gen.cache)
+        self.assertEqual(payload_gen.used_count[name], 1)
+        payload_gen.discard_speculation(token)
+        self.assertNotIn((const.STRING, "a"), payload_gen.cache)
+        self.assertEqual(payload_gen.used_count[name], 0)
+
+
+class ContextInvalidationTest(unittest.TestCase):
+    def test_invalidate_by_value(self):
+        payload_gen = get_payload_gen(["'", '"'], {})
+        self.assertIsNotNone(payload_gen.generate(const.STRING, "abc"))
+        self.assertIsNotNone(payload_gen.generate(const.STRING, "def"))
+        self.assertIsNotNone(payload_gen.generate(const.INTEGER, 5))
+        payload_gen.context = {"x": ("abc", precedence["literal"])}
+        self.assertNotIn((const.STRING, "abc"), payload_gen.cache)
+        self.assertIn((const.STRING, "def"), payload_gen.cache)
+        self.assertIn((const.INTEGER, 5), payload_gen.cache)
+        self.assertEqual(payload_gen.generate(const.STRING, "abc"), "x")
+
+    def test_invalidate_context_reading_rules(self):
+        payload_gen = get_payload_gen(["'", '"'] + list(string.digits), {})
+        self.assertIsNotNone(payload_gen.generate(const.INTEGER, 5))
+        payload_gen.context = {"y": (3, precedence["literal"])}
+        self.assertNotIn((const.INTEGER, 5), payload_gen.cache)
+
+
+class UsedContextTest(unittest.TestCase):
+    def test_merge(self):
+        a = {"a": ("x", 0)}
+        self.assertEqual(merge_used_context([]), {})
+        self.assertIs(merge_used_context([a]), a)
+        merged = merge_used_context([a, {"b": ("y", 0)}])
+        self.assertEqual(merged, {"a": ("x", 0), "b": ("y", 0)})
+        self.assertEqual(a, {"a": ("x", 0)})
+
+    def test_generate(self):
+        payload_gen = get_payload_gen(
+            ["'", '"'],
+            {"a": ("ab", precedence["literal"]), "c": ("cd", precedence["literal"])},
+        )
+        result = payload_gen.generate_by_list(
+            [
+                (const.VARIABLE_OF, "ab"),
+                (const.LITERAL, "+"),
+                (const.VARIABLE_OF, "cd"),
+            ]
+        )
+        self.assertIsNotNone(result)
+        self.assertEqual(result[0], "a+c")
+        self.assertEqual(set(result[1]), {"a", "c"})
+
+
+class TargetHandlerTest(unittest.TestCase):
+    def test_custom_kind(self):
+        @target_handler("test_upper_literal")
+        def upper_literal_generate(payload_gen, target):
+            return (target[1].upper(), {}, [])
+
+        try:
+            payload_gen = get_payload_gen(["ab"], {})
+            self.assertEqual(
+                payload_gen.generate_by_list([("test_upper_literal", "ab")])[0], "AB"
+            )
+        finally:
+            del target_handlers["test_upper_literal"]
+
+
+class TargetCacheTest(unittest.TestCase):
+    def test_structural_key(self):
+        cache = TargetCache()
+        target = (const.ATTRIBUTE, (const.EXPRESSION, 0, [(const.LITERAL, "a")]), "b")
+        cache[target] = "result"
+        same_target = (
+            const.ATTRIBUTE,
+            (const.EXPRESSION, 0, [(const.LITERAL, "a")]),
+            "b",
+        )
+        self.assertIn(same_target, cache)
+        self.assertEqual(cache[same_target], "result")
+        self.assertNotIn((const.INTEGER, True), cache)
+        cache[(const.INTEGER, 1)] = "one"
+        self.assertNotIn((const.INTEGER, True), cache)
+        self.assertNotIn((const.ATTRIBUTE, [const.EXPRESSION], "b"), cache)
+
+    def test_delete_and_clear(self):
+        cache = TargetCache()
+        target = (const.STRING, "abc")
+        cache[target] = None
+        self.assertIn(target, cache)
+        self.assertIsNone(cache[target])
+        target_id = cache.interner.lookup(target)
+        del cache[target]
+        self.assertNotIn(target, cache)
+        cache[target] = "abc"
+        cache.clear()
+        self.assertNotIn(target, cache)
+        self.assertEqual(cache.interner.intern((const.STRING, "abc")), target_id)
+
+
+class CountingBatchWaf(BatchWafFunc):
+    batch_size = 16
+
+    def __init__(self, blacklist):
+        self.blacklist = blacklist
+        self.batches = []
+
+    def check_many(self, payloads):
+        self.batches.append(list(payloads))
+        return [all(word not in x for word in self.blacklist) for x in payloads]
+
+
+class BatchWafTest(unittest.TestCase):
+    def test_same_result(self):
+        blacklist = ["'", '"', "_", "+", "[", "0", "1"]
+        batch_waf = CountingBatchWaf(blacklist)
+        options = fenjing.Options(python_version=fenjing.const.PythonVersion.PYTHON3)
+        batch_gen = PayloadGenerator(batch_waf, {}, options=options)
+        plain_gen = get_payload_gen(blacklist, {})
+        for target_string in ["a", "__globals__"]:
+            self.assertEqual(
+                batch_gen.generate(const.STRING, target_string),
+                plain_gen.generate(const.STRING, target_string),
+            )
+        self.assertTrue(any(len(batch) > 1 for batch in batch_waf.batches))
+
+    def test_combined(self):
+        calls = []
+
+        def waf_expr(x):
+            calls.append(x)
+            return "b" not in x
+
+        waf = CombinedWafFunc(lambda x: "a" not in x, waf_expr)
+        self.assertEqual(waf.check_many(["a", "b", "c"]), [False, False, True])
+        self.assertEqual(calls, ["b", "c"])
+
+
+class SubstringMatcherTest(unittest.TestCase):
+    def test_findall(self):
+        matcher = SubstringMatcher(["he", "she", "his", "hers"])
+        self.assertEqual(matcher.findall("ushers"), ["she", "he", "hers"])
+        self.assertEqual(matcher.search("ushers"), "she")
+        self.assertIsNone(matcher.search("xyz"))
+        matcher.remove("she")
+        matcher.add("us")
+        self.assertEqual(matcher.findall("ushers"), ["us", "he", "hers"])
+        self.assertEqual(SubstringMatcher().findall("abc"), [])
+
+
+class KeywordMatcherTest(unittest.TestCase):
+    def test_trie_pattern(self):
+        self.assertEqual(trie_pattern(["class", "clear", "os"]), "(?:cl(?:ass|ear)|os)")
+        self.assertEqual(trie_pattern(["a", "ab"]), "a(?:b)?")
+        keywords = ["__", "_", "[", "os", "o", "'", "class", "cla", "+", "\\"]
+        matcher = KeywordMatcher(keywords)
+        rng = random.Random(1)
+        for _ in range(2000):
+            text = "".join(rng.choice("_[os'cla+\\x") for _ in range(rng.randint(0, 8)))
+            self.assertEqual(
+                text in matcher, any(keyword in text for keyword in keywords), text
+            )
+
+    def test_search(self):
+        matcher = KeywordMatcher(["os", "popen"], regexes=[r"\d{3}"])
+        self.assertEqual(matcher.search("lipsum.os"), "os")
+        self.assertEqual(matcher.search("a123"), "123")
+        self.assertIsNone(matcher.search("OS12"))
+        self.assertEqual(
+            KeywordMatcher(["os"], ignore_case=True).search("lipsum.OS"), "OS"
+        )
+        self.assertIsNone(KeywordMatcher(["", ""]).search("abc"))
+        self.assertIsNone(KeywordMatcher().search("abc"))
+
+    def test_waf_func(self):
+        waf_func = keyword_waf_func(["'"], regexes=["g+l"], max_length=6)
+        self.assertTrue(waf_func("{{1}}"))
+        self.assertFalse(waf_func("{{'}}"))
+        self.assertFalse(waf_func("{{ggl}}"[:6]))
+        self.assertFalse(waf_func("{{1+1}}"))
+        self.assertTrue(keyword_waf_func()("anything"))
+
+
+class LearnedBlacklistWafTest(unittest.TestCase):
+    def test_learn(self):
+        calls = []
+
+        def waf_func(x):
+            calls.append(x)
+            return "popen" not in x
+
+        waf = LearnedBlacklistWaf(waf_func)
+        self.assertFalse(waf("os.popen('ls').read()"))
+        self.assertIn("popen", waf.banned)
+        calls.clear()
+        self.assertEqual(
+            waf.check_many(["x.popen()", "popen", "os.system"]), [False, False, True]
+        )
+        self.assertEqual(calls, ["os.system"])
+        waf.bypass = True
+        self.assertFalse(waf("popen"))
+        self.assertEqual(calls, ["os.system", "popen"])
+
+    def test_probe_credit(self):
+        calls = []
+
+        # 不是子串黑名单，学习到的子串不会再被用到
+        def waf_func(x):
+            calls.append(x)
+            return len(x) < 5
+
+        waf = LearnedBlacklistWaf(waf_func)
+        payloads = [
+            "".join(random.choices(string.ascii_letters, k=40)) for _ in range(50)
+        ]
+        self.assertEqual(waf.check_many(payloads), [False] * len(payloads))
+        # 额外的检测次数不超过预先可以使用的次数
+        self.assertLessEqual(
+            len(calls), len(payloads) + LearnedBlacklistWaf.default_probe_allowance
+        )
+        self.assertGreater(len(waf.banned.patterns), 0)
+
+    def test_verify(self):
+        # 含有safe时不会拦截popen，学习到的子串并不可靠
+        def waf_func(x):
+            return "popen" not in x or "safe" in x
+
+        waf = LearnedBlacklistWaf(waf_func, verify_interval=1)
+        self.assertFalse(waf("os.popen"))
+        self.assertEqual(waf.banned.patterns, ["popen"])
+        self.assertTrue(waf("safe.popen"))
+        self.assertEqual(waf.banned.patterns, [])
+        self.assertFalse(waf("x.popen"))
+        self.assertEqual(waf.banned.patterns, [])
+
+    def test_generate(self):
+        blacklist = ["'", '"', "_", "+", "[", "0", "1"]
+        waf = LearnedBlacklistWaf(lambda x: all(word not in x for word in blacklist))
+        payload_gen = PayloadGenerator(
+            waf,
+            {},
+            options=fenjing.Options(python_version=fenjing.const.PythonVersion.PYTHON3),
+        )
+        self.assertEqual(
+            payload_gen.generate(const.STRING, "__globals__"),
+            get_payload_gen(blacklist, {}).generate(const.STRING, "__globals__"),
+        )
+        self.assertTrue(set(waf.banned.patterns) <= set(blacklist))
+        self.assertGreater(waf.local_rejections, 0)
+
+
+class IterativeEngineTest(unittest.TestCase):
+    blacklist = ["'", '"', "_", "+", "[", "0", "1"]
+
+    def get_payload_gen(self, waf_func, engine, strategy):
+        return PayloadGenerator(
+            waf_func,
+            {},
+            options=fenjing.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                search_strategy=strategy,
+                generation_engine=engine,
+            ),
+        )
+
+    def test_same_result(self):
+        waf_func = lambda x: all(word not in x for word in self.blacklist)
+        targets = [
+            (const.STRING, "__globals__"),
+            (const.POSITIVE_INTEGER, 1234),
+            (const.OS_POPEN_READ, "ls /"),
+        ]
+        for strategy in fenjing.const.SearchStrategy:
+            recursive_gen = self.get_payload_gen(
+                waf_func, fenjing.const.GenerationEngine.RECURSIVE, strategy
+            )
+            iterative_gen = self.get_payload_gen(
+                waf_func, fenjing.const.GenerationEngine.ITERATIVE, strategy
+            )
+            for target in targets:
+                self.assertEqual(
+                    iterative_gen.generate(*target),
+                    recursive_gen.generate(*target),
+                    target,
+                )
+
+    def test_step_resume(self):
+        batch_waf = CountingBatchWaf(self.blacklist)
+        payload_gen = self.get_payload_gen(
+            batch_waf,
+            fenjing.const.GenerationEngine.ITERATIVE,
+            fenjing.const.SearchStrategy.FIRST,
+        )
+        task = payload_gen.create_task([(const.STRING, "__globals__")])
+        payloads = task.step()
+        while payloads is not None:
+            payloads = task.resume(batch_waf.check_many(payloads))
+        self.assertTrue(task.done)
+        self.assertIsNotNone(task.result)
+        self.assertEqual(Template("{{" + task.result[0] + "}}").render(), "__globals__")
+        self.assertTrue(any(len(batch) > 1 for batch in batch_waf.batches))
+
+    def test_no_recursion(self):
+        payload_gen = self.get_payload_gen(
+            lambda x: True,
+            fenjing.const.GenerationEngine.ITERATIVE,
+            fenjing.const.SearchStrategy.FIRST,
+        )
+        targets = [(const.LITERAL, "a")]
+        for _ in range(sys.getrecursionlimit() * 2):
+            targets = [(const.EXPRESSION, 0, targets)]
+        self.assertEqual(payload_gen.generate(const.EXPRESSION, 0, targets), "a")
+
+
+class GenerationStatsTest(unittest.TestCase):
+    blacklist = ["'", '"', "_", "+", "[", "0", "1"]
+
+    def generate(self, engine):
+        calls = []
+
+        def waf_func(x):
+            calls.append(x)
+            return all(word not in x for word in self.blacklist)
+
+        stats = GenerationStats()
+        payload_gen = PayloadGenerator(
+            waf_func,
+            {},
+            options=fenjing.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                generation_engine=engine,
+                generation_stats=stats,
+            ),
+        )
+        self.assertIsNotNone(payload_gen.generate(const.STRING, "__globals__"))
+        return stats, calls
+
+    def test_waf_calls(self):
+        for engine in fenjing.const.GenerationEngine:
+            stats, calls = self.generate(engine)
+            data = stats.to_dict()
+            self.assertEqual(data["total"]["waf_calls"], len(calls))
+            self.assertLessEqual(
+                sum(entry["waf_calls"] for entry in data["rules"].values()),
+                len(calls),
+            )
+            self.assertGreater(data["target_types"][const.STRING]["successes"], 0)
+            self.assertGreater(data["total"]["cache_hits"], 0)
+            self.assertTrue(
+                any(entry["successes"] for entry in data["rules"].values())
+            )
+
+    def test_export(self):
+        stats, _ = self.generate(fenjing.const.GenerationEngine.RECURSIVE)
+        self.assertEqual(json.loads(stats.to_json()), stats.to_dict())
+        table = stats.format_table(sort_by="waf_calls", limit=5)
+        self.assertIn("Total WAF calls", table)
+        with self.assertRaises(ValueError):
+            stats.format_table(sort_by="nothing")
+
+
+class RuleOrderingTest(unittest.TestCase):
+    def test_score(self):
+        ordering = RuleOrdering()
+        for _ in range(5):
+            ordering.record("gen_string_good", True, 1)
+            ordering.record("gen_string_bad", False, 1)
+            ordering.record("gen_string_costly", True, 50)
+        self.assertGreater(
+            ordering.score("gen_string_good"), ordering.score("gen_string_unknown")
+        )
+        self.assertGreater(
+            ordering.score("gen_string_unknown"), ordering.score("gen_string_bad")
+        )
+        self.assertGreater(
+            ordering.score("gen_string_good"), ordering.score("gen_string_costly")
+        )
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rules.json")
+            ordering = RuleOrdering.load(path)
+            self.assertEqual(ordering.rules, {})
+            ordering.record("gen_string_good", True, 3)
+            ordering.save()
+            loaded = RuleOrdering.load(path)
+            self.assertAlmostEqual(loaded.rules["gen_string_good"].successes, 1, 3)
+            # 过时的统计数据会衰减
+            loaded.decay(loaded.half_life)
+            self.assertAlmostEqual(loaded.rules["gen_string_good"].successes, 0.5, 3)
+            with open(path, "w") as f:
+                f.write("not json")
+            self.assertEqual(RuleOrdering.load(path).rules, {})
+
+    def test_learned_order(self):
+        for engine in fenjing.const.GenerationEngine:
+            calls = []
+
+            def waf_func(x):
+                calls.append(x)
+                return all(word not in x for word in ["'", '"', "+", "~"])
+
+            ordering = RuleOrdering()
+            payload_gen = PayloadGenerator(
+                waf_func,
+                {},
+                options=fenjing.Options(
+                    python_version=fenjing.const.PythonVersion.PYTHON3,
+                    generation_engine=engine,
+                    rule_ordering=ordering,
+                ),
+            )
+            self.assertIsNotNone(payload_gen.generate(const.STRING, "__globals__"))
+            self.assertTrue(ordering.rules)
+            first_calls = len(calls)
+            # 学习到的排序会让下次生成直接尝试成功的规则
+            calls.clear()
+            payload_gen = PayloadGenerator(
+                waf_func,
+                {},
+                options=fenjing.Options(
+                    python_version=fenjing.const.PythonVersion.PYTHON3,
+                    generation_engine=engine,
+                    rule_ordering=ordering,
+                ),
+            )
+            self.assertIsNotNone(payload_gen.generate(const.STRING, "__globals__"))
+            self.assertLess(len(calls), first_calls)
+
+
+class MaxLengthTest(unittest.TestCase):
+    blacklist = ["'", '"', "_", "+", "[", "0", "1"]
+
+    def generate(self, max_length, engine, strategy):
+        calls = []
+
+        def waf_func(x):
+            calls.append(x)
+            return all(word not in x for word in self.blacklist)
+
+        payload_gen = PayloadGenerator(
+            waf_func,
+            {},
+            options=fenjing.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                search_strategy=strategy,
+                generation_engine=engine,
+                max_length=max_length,
+            ),
+        )
+        return payload_gen.generate(const.STRING, "__globals__"), calls
+
+    def test_within_budget(self):
+        for engine in fenjing.const.GenerationEngine:
+            unlimited, _ = self.generate(
+                None, engine, fenjing.const.SearchStrategy.FIRST
+            )
+            assert unlimited is not None
+            result, calls = self.generate(
+                150, engine, fenjing.const.SearchStrategy.FIRST
+            )
+            assert result is not None
+            self.assertLessEqual(len(result), 150)
+            self.assertLess(len(result), len(unlimited))
+            self.assertEqual(Template("{{" + result + "}}").render(), "__globals__")
+            # 超出预算的payload不会交给WAF函数检测
+            self.assertTrue(all(len(payload) <= 150 for payload in calls))
+
+    def test_warm_cache(self):
+        for engine in fenjing.const.GenerationEngine:
+            payload_gen = PayloadGenerator(
+                lambda x: all(word not in x for word in self.blacklist),
+                {},
+                options=fenjing.Options(
+                    python_version=fenjing.const.PythonVersion.PYTHON3,
+                    generation_engine=engine,
+                ),
+            )
+            unlimited = payload_gen.generate(const.STRING, "__globals__")
+            assert unlimited is not None and len(unlimited) > 150
+            # 缓存中超出预算的结果需要在预算内重新生成
+            payload_gen.max_length = 150
+            result = payload_gen.generate(const.STRING, "__globals__")
+            assert result is not None
+            self.assertLessEqual(len(result), 150)
+            self.assertEqual(Template("{{" + result + "}}").render(), "__globals__")
+
+    def test_fallback(self):
+        for engine in fenjing.const.GenerationEngine:
+            result, _ = self.generate(5, engine, fenjing.const.SearchStrategy.FIRST)
+            assert result is not None
+            self.assertEqual(Template("{{" + result + "}}").render(), "__globals__")
+
+
+class GenerateManyTest(unittest.TestCase):
+    blacklist = ["'", '"', "_", "+", "[", "0", "1", "os"]
+    targets = [
+        (const.OS_POPEN_READ, "ls /"),
+        (const.OS_POPEN_READ, "id"),
+        (const.STRING, "batch generation"),
+    ]
+
+    def test_plan(self):
+        payload_gen = get_payload_gen(self.blacklist, {})
+        shared = payload_gen.plan_shared_targets(self.targets)
+        self.assertIn((const.MODULE_OS,), shared)
+        self.assertEqual(payload_gen.plan_shared_targets(self.targets[:1]), [])
+
+    def test_same_result(self):
+        results = get_payload_gen(self.blacklist, {}).generate_many(self.targets)
+        single_gen = get_payload_gen(self.blacklist, {})
+        self.assertEqual([result.target for result in results], self.targets)
+        for result in results:
+            self.assertEqual(
+                result.result, single_gen.generate_detailed(*result.target)
+            )
+            self.assertGreaterEqual(result.elapsed, 0)
+
+    def test_streaming(self):
+        payload_gen = get_payload_gen(self.blacklist, {})
+        results = payload_gen.iter_generate_many(self.targets)
+        first = next(results)
+        self.assertEqual(first.target, self.targets[0])
+        assert first.result is not None
+        self.assertNotIn(self.targets[-1], payload_gen.cache)
+        self.assertEqual(len(list(results)), len(self.targets) - 1)
+
+
+class GenerationBudgetTest(unittest.TestCase):
+    blacklist = ["'", '"', "_", "+", "[", "0", "1"]
+
+    def generate(self, engine, strategy, **options):
+        calls = []
+
+        def waf_func(x):
+            calls.append(x)
+            return all(word not in x for word in self.blacklist)
+
+        payload_gen = PayloadGenerator(
+            waf_func,
+            {},
+            options=fenjing.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                search_strategy=strategy,
+                generation_engine=engine,
+                **options,
+            ),
+        )
+        return payload_gen, calls
+
+    def test_exhausted(self):
+        for engine in fenjing.const.GenerationEngine:
+            stats = GenerationStats()
+            payload_gen, calls = self.generate(
+                engine,
+                fenjing.const.SearchStrategy.FIRST,
+                waf_call_budget=20,
+                generation_stats=stats,
+            )
+            with self.assertRaises(GenerationBudgetExhausted) as cm:
+                payload_gen.generate(const.STRING, "__globals__")
+            self.assertEqual(cm.exception.reason, "waf_calls")
+            self.assertEqual(cm.exception.waf_calls, 20)
+            self.assertIs(cm.exception.stats, stats)
+            self.assertLessEqual(len(calls), 20)
+            # 预算只作用于一次生成，失败的结果没有被缓存
+            payload_gen.options.waf_call_budget = None
+            self.assertIsNotNone(payload_gen.generate(const.STRING, "__globals__"))
+
+    def test_time(self):
+        payload_gen, calls = self.generate(
+            fenjing.const.GenerationEngine.RECURSIVE,
+            fenjing.const.SearchStrategy.FIRST,
+            time_budget=0,
+        )
+        with self.assertRaises(GenerationBudgetExhausted) as cm:
+            payload_gen.generate(const.STRING, "__globals__")
+        self.assertEqual(cm.exception.reason, "time")
+        self.assertEqual(calls, [])
+
+    def test_best_so_far(self):
+        for engine in fenjing.const.GenerationEngine:
+            unlimited_gen, unlimited_calls = self.generate(
+                engine, fenjing.const.SearchStrategy.BEST_FIRST
+            )
+            unlimited = unlimited_gen.generate(const.STRING, "__globals__")
+            payload_gen, calls = self.generate(
+                engine, fenjing.const.SearchStrategy.BEST_FIRST, waf_call_budget=1000
+            )
+            result = payload_gen.generate(const.STRING, "__globals__")
+            assert result is not None and unlimited is not None
+            self.assertLessEqual(len(calls), 1000)
+            self.assertLess(len(calls), len(unlimited_calls))
+            self.assertEqual(Template("{{" + result + "}}").render(), "__globals__")
+
+
+class UnwrapWhitespaceTest(unittest.TestCase):
+    def test_lazy(self):
+        targets = [(const.LITERAL, "a"), (const.WHITESPACE,), (const.LITERAL, "b")]
+        unwrapper = WhitespaceUnwrapper()
+        result = unwrapper(targets)
+        self.assertIs(unwrapper(targets), result)
+        # 不同的生成器不共享结果
+        self.assertIsNot(WhitespaceUnwrapper()(targets), result)
+        self.assertEqual(unwrap_whitespace(targets), result)
+        alternatives = result[0][1]
+        self.assertEqual(len(alternatives), len(const.WHITESPACES_AND_EMPTY))
+        self.assertEqual(alternatives.alternatives.count(None), len(alternatives))
+        self.assertEqual(
+            alternatives[1],
+            [(const.LITERAL, "a"), (const.LITERAL, " "), (const.LITERAL, "b")],
+        )
+        self.assertIs(alternatives[1], alternatives[1])
+        self.assertEqual(alternatives.alternatives.count(None), len(alternatives) - 1)
+        self.assertEqual(
+            list(alternatives),
+            [
+                [(const.LITERAL, "a"), (const.LITERAL, w), (const.LITERAL, "b")]
+                for w in const.WHITESPACES_AND_EMPTY
+            ],
+        )
+        no_whitespace = [(const.LITERAL, "a")]
+        self.assertIs(unwrap_whitespace(no_whitespace), no_whitespace)
+        self.assertIs(unwrapper(no_whitespace), no_whitespace)
+        self.assertEqual(len(unwrapper.cache), 1)
+
+
 class WordlistTest(unittest.TestCase):
     def test_char_patterns(self):
         for pattern, indexes in CHAR_PATTERNS.items():
@@ -363,3 +1138,51 @@ class WordlistTest(unittest.TestCase):
                 ).replace("VALUE", repr(c))
                 result = Template(payload).render()
                 assert "yes" in result, f"Test {pattern!r} at {i} failed, {result=}"
+
+
+class SeedTest(unittest.TestCase):
+    blacklist = ["'", '"', "_", "+", "[", "0", "1", "request"]
+
+    def generate(self, seed):
+        calls = []
+
+        def waf_func(x):
+            calls.append(x)
+            return all(word not in x for word in self.blacklist)
+
+        payload_gen = PayloadGenerator(
+            waf_func,
+            {},
+            options=fenjing.Options(
+                python_version=fenjing.const.PythonVersion.PYTHON3,
+                seed=seed,
+            ),
+        )
+        payloads = [
+            payload_gen.generate(const.STRING, "__globals__"),
+            payload_gen.generate(const.STRING, "os"),
+        ]
+        return payloads, calls
+
+    def test_same_seed(self):
+        payloads, calls = self.generate(42)
+        self.assertNotIn(None, payloads)
+        self.assertEqual(self.generate(42), (payloads, calls))
+
+    def test_context_vars(self):
+        def waf_func(x):
+            return all(word not in x for word in self.blacklist)
+
+        options = fenjing.Options(seed=42)
+        names = [
+            prepare_context_vars(waf_func, options).generate_random_variable_name()
+            for _ in range(2)
+        ]
+        self.assertEqual(names[0], names[1])
+
+    def test_decide(self):
+        rule_random = RuleRandom(0)
+        first = rule_random.decide("test", lambda r: r.random())
+        rule_random.random()
+        self.assertEqual(rule_random.decide("test", lambda r: r.random()), first)
+        self.assertEqual(RuleRandom(0).decide("test", lambda r: r.random()), first)
@@ -3,6 +3,8 @@
 """
 import random
 import gc
+import time
+import uuid
 
 from flask import Flask, request, render_template_string
 from jinja2 import Template
@@ -333,6 +335,20 @@ def dynamic_waf():
     return render_template_string(template)
 
 
+@app.route("/csrf_token_waf", methods=["GET", "POST"])
+def csrf_token_waf():
+    name = request.args.get("name", "world")
+    page = (
+        "<html><body><form><input type='hidden' name='csrf' value='{}'></form>"
+        + "<p>{}</p><p>Generated at {}</p></body></html>"
+    )
+    token, timestamp = uuid.uuid4().hex, int(time.time() * 1000)
+    if not waf_pass(name):
+        return page.format(token, "Nope", timestamp)
+    template = "Hello, {}".format(name)
+    return page.format(token, render_template_string(template), timestamp)
+
+
 @app.route("/random_chars_waf", methods=["GET", "POST"])
 def random_chars_waf():
     name = request.args.get("name", "world")